@@ -1,18 +1,50 @@
 # auth.py
 
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Header, Query, Request, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel, EmailStr
+from sqlalchemy import func, insert, literal, select, tuple_, or_, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from database import get_db
+from database import DATABASE_BACKEND, get_db, get_read_db, note_writes, read_sessionmaker
 from models import User, Transaction, Company
-import bcrypt
-import random
-import string
-from datetime import datetime
-from typing import Optional
+from hashing import hash_pin, verify_pin
+from ratelimit import client_ip, login_attempts, login_failures, user_searches
+from sessions import check_any_session, check_session, check_stream_session, credential_cache, issue_token
+from users import (
+    UserResolver, account_exists_statement, get_read_user_resolver, get_user_resolver, insert_user_statement,
+    lookup_user_id, search_users
+)
+import ledger
+import idempotency
+import journal
+import events
+from journal import POSTING_JOURNAL, posting_journal
+from reference import next_reference_number
+from cache import user_cache
+from company_cache import company_directory
+from money import Money, cents_to_float, from_cents, to_cents
+from statements import EXPORT_FORMATS, statement_query, stream_statement
+from summaries import summary_context_query, summary_response, summary_rows_query
+from datetime import date, datetime
+from typing import List, Literal, NamedTuple, Optional
+from collections import defaultdict
+import base64
 
 router = APIRouter()
 
+# Largest page the history endpoint will return
+MAX_HISTORY_PAGE = 100
+
+# Most transfers accepted in one /send-money/batch request
+MAX_BATCH_TRANSFERS = 1000
+
+# Shortest user search prefix; shorter ones would walk the directory a letter at a time
+USER_SEARCH_MIN_LENGTH = 3
+
+# Balance and money-movement routes; auth_async.router mirrors these for DB_MODE=async
+money_router = APIRouter()
+
 # --- Pydantic Schemas ---
 class SignupSchema(BaseModel):
     first_name: str
@@ -27,31 +59,31 @@ class LoginSchema(BaseModel):
 
 class DepositSchema(BaseModel):
     username: str
-    amount: float
+    amount: Money
 
 class WithdrawSchema(BaseModel):
     username: str
-    amount: float
+    amount: Money
 
 class SendMoneySchema(BaseModel):
     sender_username: str
     recipient_username: str
-    amount: float
+    amount: Money
     notes: Optional[str] = None
 
 class PayBillsSchema(BaseModel):
     username: str
     company_name: str
-    amount: float
+    amount: Money
     notes: Optional[str] = None
 
 class BalanceResponse(BaseModel):
-    balance: float
+    balance: Money
     username: str
 
 class TransactionResponse(BaseModel):
     message: str
-    new_balance: float
+    new_balance: Money
     transaction_id: str
 
 class UpdateProfileSchema(BaseModel):
@@ -59,275 +91,779 @@ class UpdateProfileSchema(BaseModel):
     last_name: str
     email: EmailStr
 
+class BatchTransferItem(BaseModel):
+    recipient_username: str
+    amount: Money
+    notes: Optional[str] = None
+
+class BatchSendMoneySchema(BaseModel):
+    sender_username: str
+    transfers: List[BatchTransferItem]
+    mode: Literal["all_or_nothing", "best_effort"] = "all_or_nothing"
+    chunk_size: Optional[int] = None  # best_effort only: commit every chunk_size transfers
+
+class BatchTransferResult(BaseModel):
+    index: int
+    recipient_username: str
+    amount: Money
+    status: str  # 'posted' or 'failed'
+    transaction_id: Optional[str] = None
+    detail: Optional[str] = None
+
+class BatchTransferResponse(BaseModel):
+    message: str
+    new_balance: Money
+    posted: int
+    failed: int
+    results: List[BatchTransferResult]
+
+class TransactionItem(BaseModel):
+    reference_number: str
+    type: str
+    amount: float
+    description: Optional[str] = None
+    timestamp: datetime
+    recipient: Optional[str] = None
+    sender: Optional[str] = None
+    company: Optional[str] = None
+    notes: Optional[str] = None
+
+class ProfileResponse(BaseModel):
+    first_name: str
+    last_name: str
+    email: str
+    username: str
+    balance: float
+    created_at: Optional[datetime] = None
+
+class CompanyItem(BaseModel):
+    id: int
+    name: str
+    category: str
+
+class HistoryFilters(NamedTuple):
+    transaction_type: Optional[str] = None
+    start_date: Optional[datetime] = None
+    end_date: Optional[datetime] = None
+    counterparty: Optional[str] = None
+
 # --- Helper Functions ---
 def generate_reference_number():
     """Generate a unique reference number for transactions"""
-    timestamp = datetime.now().strftime("%Y%m")
-    random_digits = ''.join(random.choices(string.digits, k=4))
-    return f"{timestamp}{random_digits}"
+    return next_reference_number()
+
+def encode_cursor(timestamp: datetime, transaction_id: int) -> str:
+    """Opaque keyset cursor pointing just past (timestamp, id)"""
+    raw = f"{timestamp.isoformat()}|{transaction_id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor: Optional[str]):
+    if cursor is None:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        timestamp, transaction_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(timestamp), int(transaction_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def apply_history_filters(query, filters: HistoryFilters = None):
+    if filters is None:
+        return query
+    if filters.transaction_type:
+        query = query.where(Transaction.transaction_type == filters.transaction_type)
+    if filters.start_date:
+        query = query.where(Transaction.timestamp >= filters.start_date)
+    if filters.end_date:
+        query = query.where(Transaction.timestamp < filters.end_date)
+    if filters.counterparty:
+        query = query.where(or_(
+            Transaction.recipient_username == filters.counterparty,
+            Transaction.sender_username == filters.counterparty,
+            Transaction.bill_company == filters.counterparty
+        ))
+    return query
+
+# Columns a history page reads; rows come back as plain tuples, not Transaction entities
+HISTORY_COLUMNS = (
+    Transaction.id,
+    Transaction.reference_number,
+    Transaction.transaction_type,
+    Transaction.amount_cents,
+    Transaction.description,
+    Transaction.timestamp,
+    Transaction.recipient_username,
+    Transaction.sender_username,
+    Transaction.bill_company,
+    Transaction.notes,
+)
+
+def history_timestamp(value=Transaction.timestamp):
+    """Timestamp as history pages compare and order it.
+
+    SQLite keeps timestamps as text in whichever format wrote them
+    (CURRENT_TIMESTAMP has no fraction, a bound datetime has microseconds), so
+    comparing a cursor as text skips or repeats rows there; julianday() compares
+    the instants instead.
+    """
+    if DATABASE_BACKEND == "sqlite":
+        return func.julianday(value)
+    return value
+
+def history_query(username: str, limit: int, after=None, filters: HistoryFilters = None):
+    """Newest-first page of a user's history, joined on username.
+
+    Pages are keyset-based on (timestamp, id) and read limit + 1 rows so the
+    caller can tell whether another page exists; each page is an index range
+    scan on idx_transactions_user_timestamp_id however deep the cursor is.
+    """
+    query = (
+        select(*HISTORY_COLUMNS)
+        .join(User, User.id == Transaction.user_id)
+        .where(User.username == username)
+    )
+    if after is not None:
+        timestamp, transaction_id = after
+        query = query.where(
+            tuple_(history_timestamp(), Transaction.id)
+            < tuple_(history_timestamp(literal(timestamp, Transaction.timestamp.type)), transaction_id)
+        )
+    query = apply_history_filters(query, filters)
+    return query.order_by(history_timestamp().desc(), Transaction.id.desc()).limit(limit + 1)
+
+def split_page(transactions, limit: int):
+    """Trim the look-ahead row and build the cursor for the next page, if any"""
+    if len(transactions) <= limit:
+        return transactions, None
+    page = transactions[:limit]
+    return page, encode_cursor(page[-1].timestamp, page[-1].id)
 
-def create_transaction(db: Session, user_id: int, transaction_type: str, amount: float, 
+def transaction_to_dict(t, legacy_fields: bool = False):
+    """History item from a HISTORY_COLUMNS row; timestamp stays a datetime and goes out as ISO 8601.
+
+    legacy_fields restores the old shape for clients that still read it:
+    timestamp as "MM/DD/YYYY hh:mm AM" plus separate date and time strings.
+    """
+    # Unpacked by position: much cheaper than a Row attribute lookup per column
+    _, reference_number, transaction_type, amount_cents, description, timestamp, recipient, sender, company, notes = t
+    item = {
+        "reference_number": reference_number,
+        "type": transaction_type,
+        "amount": cents_to_float(amount_cents),
+        "description": description,
+        "timestamp": timestamp,
+        "recipient": recipient,
+        "sender": sender,
+        "company": company,
+        "notes": notes
+    }
+    if legacy_fields:
+        stamp = timestamp.strftime("%m/%d/%Y %I:%M %p")
+        item.update(timestamp=stamp, date=stamp[:10], time=stamp[11:])
+    return item
+
+def history_response(response: Response, page, next_cursor: Optional[str], legacy_fields: bool = False):
+    """What a history route returns: items for the TransactionItem response model.
+
+    Legacy items don't fit the model (their timestamp isn't ISO), so they are
+    rendered directly and the cursor header goes on that response instead.
+    """
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    items = [transaction_to_dict(t, legacy_fields) for t in page]
+    if legacy_fields:
+        return ORJSONResponse(items, headers=headers)
+    response.headers.update(headers)
+    return items
+
+def profile_snapshot(user: User):
+    """Cacheable view of a user row (everything GET /profile returns)"""
+    return {
+        "first_name": user.first_name,
+        "last_name": user.last_name,
+        "email": user.email,
+        "username": user.username,
+        "balance": cents_to_float(user.balance_cents),
+        "created_at": user.created_at.isoformat() if user.created_at else None
+    }
+
+def get_cached_profile(users: UserResolver, username: str):
+    """Profile snapshot from user_cache, read through to the database on a miss"""
+    profile, version = user_cache.lookup(username)
+    if profile is None:
+        user = users.get(username)
+        if not user:
+            return None
+        profile = profile_snapshot(user)
+        # Skipped if a posting invalidated the entry while this read was in flight
+        user_cache.fill(username, profile, version)
+    return profile
+
+def accounts_changed(*usernames: str):
+    """After a commit that changed these accounts: keep their reads on the primary and drop their cached profiles"""
+    note_writes(*usernames)
+    user_cache.invalidate(*usernames)
+
+def create_transaction(db: Session, user_id: int, transaction_type: str, amount_cents: int, 
                       description: str, recipient_username: str = None, 
                       sender_username: str = None, bill_company: str = None, 
-                      notes: str = None):
-    """Helper function to create a transaction record"""
-    reference_number = generate_reference_number()
-    transaction = Transaction(
-        user_id=user_id,
-        transaction_type=transaction_type,
-        amount=amount,
-        description=description,
-        reference_number=reference_number,
+                      notes: str = None, reference_number: str = None):
+    """Add a transaction record to the session; returns its column values (a transaction_row)"""
+    row = transaction_row(
+        user_id, transaction_type, amount_cents, description,
         recipient_username=recipient_username,
         sender_username=sender_username,
         bill_company=bill_company,
-        notes=notes
+        notes=notes,
+        reference_number=reference_number
+    )
+    db.add(Transaction(**row))
+    return row
+
+def transaction_row(user_id: int, transaction_type: str, amount_cents: int, description: str,
+                    recipient_username: str = None, sender_username: str = None,
+                    bill_company: str = None, notes: str = None, reference_number: str = None):
+    """Column values for a bulk Transaction insert"""
+    return {
+        "user_id": user_id,
+        "transaction_type": transaction_type,
+        "amount_cents": amount_cents,
+        "description": description,
+        "reference_number": reference_number or generate_reference_number(),
+        "recipient_username": recipient_username,
+        "sender_username": sender_username,
+        "bill_company": bill_company,
+        "notes": notes
+    }
+
+def journal_entry(username: str, transaction_type: str, amount_cents: int, description: str, **fields):
+    """A transaction_row for the posting journal, which fills in user_id once the account is locked"""
+    return journal.Entry(username, transaction_row(None, transaction_type, amount_cents, description, **fields))
+
+def validate_batch(batch_data: BatchSendMoneySchema):
+    if not batch_data.transfers:
+        raise HTTPException(status_code=400, detail="Batch must contain at least one transfer")
+    if len(batch_data.transfers) > MAX_BATCH_TRANSFERS:
+        raise HTTPException(status_code=400, detail=f"Batch is limited to {MAX_BATCH_TRANSFERS} transfers")
+    if batch_data.chunk_size is not None and batch_data.chunk_size <= 0:
+        raise HTTPException(status_code=400, detail="chunk_size must be greater than zero")
+
+def batch_chunks(batch_data: BatchSendMoneySchema):
+    """Indexed transfers split into the chunks that are committed together"""
+    indexed = list(enumerate(batch_data.transfers))
+    size = len(indexed)
+    if batch_data.mode == "best_effort" and batch_data.chunk_size:
+        size = batch_data.chunk_size
+    return [indexed[start:start + size] for start in range(0, len(indexed), size)]
+
+def prepare_batch_postings(batch_data: BatchSendMoneySchema, chunk, accounts):
+    """Decide which transfers in a chunk can post against the locked accounts.
+
+    Returns (results, total, credits, rows): per-item results, the centavos to
+    debit from the sender, {recipient: centavos} credits and the paired
+    send_money / receive_money rows to bulk insert.
+    """
+    sender_username = batch_data.sender_username
+    sender_id, remaining = accounts[sender_username]
+    results, credits, rows = [], defaultdict(int), []
+    total = 0
+    for index, item in chunk:
+        result = BatchTransferResult(
+            index=index, recipient_username=item.recipient_username,
+            amount=item.amount, status="failed"
+        )
+        results.append(result)
+        amount_cents = to_cents(item.amount)
+        if item.amount <= 0:
+            result.detail = "Amount must be greater than zero"
+        elif item.recipient_username == sender_username:
+            result.detail = "Cannot send money to yourself"
+        elif item.recipient_username not in accounts:
+            result.detail = "Recipient not found"
+        elif amount_cents > remaining:
+            result.detail = "Insufficient funds"
+        else:
+            remaining -= amount_cents
+            total += amount_cents
+            credits[item.recipient_username] += amount_cents
+            recipient_id, _ = accounts[item.recipient_username]
+            sent = transaction_row(
+                sender_id, "send_money", amount_cents,
+                f"Sent PHP {item.amount:.2f} to {item.recipient_username}",
+                recipient_username=item.recipient_username, notes=item.notes
+            )
+            received = transaction_row(
+                recipient_id, "receive_money", amount_cents,
+                f"Received PHP {item.amount:.2f} from {sender_username}",
+                sender_username=sender_username, notes=item.notes
+            )
+            rows.extend([sent, received])
+            result.status = "posted"
+            result.transaction_id = sent["reference_number"]
+    return results, total, credits, rows
+
+def batch_balances(accounts, sender_username: str, sender_balance: int, credits):
+    """{user_id: balance} once a chunk posts; recipients are locked, so theirs is the balance read plus the credit"""
+    balances = {
+        accounts[username][0]: accounts[username][1] + amount
+        for username, amount in credits.items()
+    }
+    balances[accounts[sender_username][0]] = sender_balance
+    return balances
+
+def batch_rejection(results):
+    return HTTPException(status_code=400, detail={
+        "message": "Batch rejected; no transfers were posted",
+        "results": [r.model_dump(mode="json") for r in results if r.status == "failed"]
+    })
+
+def batch_response(results, new_balance: int):
+    posted = sum(1 for r in results if r.status == "posted")
+    return BatchTransferResponse(
+        message=f"Posted {posted} of {len(results)} transfers",
+        new_balance=from_cents(new_balance),
+        posted=posted,
+        failed=len(results) - posted,
+        results=results
     )
-    db.add(transaction)
-    return reference_number
 
 # --- Authentication Routes ---
 @router.post("/signup")
 def signup(user: SignupSchema, db: Session = Depends(get_db)):
-    if db.query(User).filter((User.username == user.username) | (User.email == user.email)).first():
+    # Index-only check first so a taken username or email costs no bcrypt work
+    if db.execute(account_exists_statement(user.username, user.email)).scalar():
         raise HTTPException(status_code=400, detail="Username or email already exists")
+    # Hand the connection back to the pool while bcrypt runs
+    db.rollback()
     
-    hashed_pin = bcrypt.hashpw(user.pin.encode('utf-8'), bcrypt.gensalt())
+    hashed_pin = hash_pin(user.pin)
     
-    new_user = User(
+    # The unique indexes stay the real check: a signup racing this one is skipped here
+    created = db.execute(insert_user_statement(
         first_name=user.first_name,
         last_name=user.last_name,
         email=user.email,
         username=user.username,
-        hashed_pin=hashed_pin.decode('utf-8'),
-        balance=0.0
-    )
-    db.add(new_user)
+        hashed_pin=hashed_pin,
+        balance_cents=0
+    )).first()
     db.commit()
-    db.refresh(new_user)
+    if created is None:
+        raise HTTPException(status_code=400, detail="Username or email already exists")
+    note_writes(user.username)
     
     return {"message": "User created successfully"}
 
 @router.post("/login")
-def login(credentials: LoginSchema, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == credentials.username).first()
+def login(credentials: LoginSchema, request: Request, users: UserResolver = Depends(get_user_resolver)):
+    # Shed guesses before the user lookup and bcrypt; RateLimited becomes a 429.
+    # Every attempt takes a failure slot up front and only a success gives it
+    # back, so concurrent wrong PINs can't exceed the per-account cap
+    ip = client_ip(request)
+    login_attempts.acquire(ip)
+    login_failures.acquire(credentials.username)
+    
+    user = users.get(credentials.username)
     if not user:
         raise HTTPException(status_code=400, detail="Invalid username or PIN")
     
-    if not bcrypt.checkpw(credentials.pin.encode('utf-8'), user.hashed_pin.encode('utf-8')):
-        raise HTTPException(status_code=400, detail="Invalid username or PIN")
+    if not credential_cache.matches(user.username, user.hashed_pin, credentials.pin):
+        if not verify_pin(credentials.pin, user.hashed_pin):
+            raise HTTPException(status_code=400, detail="Invalid username or PIN")
+        credential_cache.remember(user.username, user.hashed_pin, credentials.pin)
     
-    return {"message": "Login successful", "username": user.username}
+    login_failures.reset(credentials.username)
+    token, expires_at = issue_token(user.username)
+    return {"message": "Login successful", "username": user.username, "token": token, "expires_at": expires_at}
 
 # --- Balance Route ---
-@router.get("/balance/{username}", response_model=BalanceResponse)
-def get_balance(username: str, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == username).first()
-    if not user:
+@money_router.get("/balance/{username}", response_model=BalanceResponse, dependencies=[Depends(check_session)])
+def get_balance(username: str, users: UserResolver = Depends(get_read_user_resolver)):
+    profile = get_cached_profile(users, username)
+    if not profile:
         raise HTTPException(status_code=404, detail="User not found")
     
-    return BalanceResponse(balance=user.balance, username=user.username)
+    return BalanceResponse(balance=profile["balance"], username=profile["username"])
 
 # --- Deposit Route ---
-@router.post("/deposit", response_model=TransactionResponse)
-def deposit(deposit_data: DepositSchema, db: Session = Depends(get_db)):
+@money_router.post("/deposit", response_model=TransactionResponse)
+def deposit(deposit_data: DepositSchema, idempotency_key: Optional[str] = Header(None), db: Session = Depends(get_db)):
     if deposit_data.amount <= 0:
         raise HTTPException(status_code=400, detail="Amount must be greater than zero")
     
     if deposit_data.amount < 100:
         raise HTTPException(status_code=400, detail="Minimum deposit amount is PHP 100")
     
-    user = db.query(User).filter(User.username == deposit_data.username).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+    message = f"Successfully deposited PHP {deposit_data.amount:.2f}"
+    description = f"Deposit of PHP {deposit_data.amount:.2f}"
+    amount_cents = to_cents(deposit_data.amount)
+    reference_number = generate_reference_number()
+    claim = idempotency.make_claim(idempotency_key, "deposit", deposit_data, message, reference_number)
     
     try:
-        user.balance += deposit_data.amount
-        reference_number = create_transaction(
-            db, user.id, "deposit", deposit_data.amount,
-            f"Deposit of PHP {deposit_data.amount:.2f}"
-        )
+        if POSTING_JOURNAL:
+            user_id, new_balance = posting_journal.post(journal.Posting(
+                amount_cents, (
+                    journal_entry(deposit_data.username, "deposit", amount_cents, description,
+                                  reference_number=reference_number),
+                ),
+                credit=deposit_data.username, claim=claim
+            ))
+        else:
+            user_id, new_balance = ledger.credit(db, deposit_data.username, amount_cents, claim=claim)
+            row = create_transaction(
+                db, user_id, "deposit", amount_cents, description,
+                reference_number=reference_number
+            )
+            events.queue_postings(db, {user_id: new_balance}, [row])
+            db.commit()
         
-        db.commit()
-        db.refresh(user)
+        accounts_changed(deposit_data.username)
         
         return TransactionResponse(
-            message=f"Successfully deposited PHP {deposit_data.amount:.2f}",
-            new_balance=user.balance,
+            message=message,
+            new_balance=from_cents(new_balance),
             transaction_id=reference_number
         )
         
+    except idempotency.DuplicateRequest:
+        db.rollback()
+        return idempotency.replay(db, claim)
+    except ledger.AccountNotFound:
+        db.rollback()
+        raise HTTPException(status_code=404, detail="User not found")
+    except journal.JournalBusy:
+        raise
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail="Deposit failed. Please try again.")
 
 # --- Withdraw Route ---
-@router.post("/withdraw", response_model=TransactionResponse)
-def withdraw(withdraw_data: WithdrawSchema, db: Session = Depends(get_db)):
+@money_router.post("/withdraw", response_model=TransactionResponse)
+def withdraw(withdraw_data: WithdrawSchema, idempotency_key: Optional[str] = Header(None), db: Session = Depends(get_db)):
     if withdraw_data.amount <= 0:
         raise HTTPException(status_code=400, detail="Amount must be greater than zero")
     
-    user = db.query(User).filter(User.username == withdraw_data.username).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    if user.balance < withdraw_data.amount:
-        raise HTTPException(status_code=400, detail="Insufficient funds")
+    message = f"Successfully withdrew PHP {withdraw_data.amount:.2f}"
+    description = f"Withdrawal of PHP {withdraw_data.amount:.2f}"
+    amount_cents = to_cents(withdraw_data.amount)
+    reference_number = generate_reference_number()
+    claim = idempotency.make_claim(idempotency_key, "withdraw", withdraw_data, message, reference_number)
     
     try:
-        user.balance -= withdraw_data.amount
-        reference_number = create_transaction(
-            db, user.id, "withdraw", withdraw_data.amount,
-            f"Withdrawal of PHP {withdraw_data.amount:.2f}"
-        )
+        if POSTING_JOURNAL:
+            user_id, new_balance = posting_journal.post(journal.Posting(
+                amount_cents, (
+                    journal_entry(withdraw_data.username, "withdraw", amount_cents, description,
+                                  reference_number=reference_number),
+                ),
+                debit=withdraw_data.username, claim=claim
+            ))
+        else:
+            user_id, new_balance = ledger.debit(db, withdraw_data.username, amount_cents, claim=claim)
+            row = create_transaction(
+                db, user_id, "withdraw", amount_cents, description,
+                reference_number=reference_number
+            )
+            events.queue_postings(db, {user_id: new_balance}, [row])
+            db.commit()
         
-        db.commit()
-        db.refresh(user)
+        accounts_changed(withdraw_data.username)
         
         return TransactionResponse(
-            message=f"Successfully withdrew PHP {withdraw_data.amount:.2f}",
-            new_balance=user.balance,
+            message=message,
+            new_balance=from_cents(new_balance),
             transaction_id=reference_number
         )
         
+    except idempotency.DuplicateRequest:
+        db.rollback()
+        return idempotency.replay(db, claim)
+    except ledger.AccountNotFound:
+        db.rollback()
+        raise HTTPException(status_code=404, detail="User not found")
+    except ledger.InsufficientFunds:
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Insufficient funds")
+    except journal.JournalBusy:
+        raise
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail="Withdrawal failed. Please try again.")
 
 # --- Send Money Route ---
-@router.post("/send-money", response_model=TransactionResponse)
-def send_money(send_data: SendMoneySchema, db: Session = Depends(get_db)):
+@money_router.post("/send-money", response_model=TransactionResponse)
+def send_money(send_data: SendMoneySchema, idempotency_key: Optional[str] = Header(None), db: Session = Depends(get_db)):
     if send_data.amount <= 0:
         raise HTTPException(status_code=400, detail="Amount must be greater than zero")
     
-    # Get sender
-    sender = db.query(User).filter(User.username == send_data.sender_username).first()
-    if not sender:
-        raise HTTPException(status_code=404, detail="Sender not found")
-    
-    # Get recipient
-    recipient = db.query(User).filter(User.username == send_data.recipient_username).first()
-    if not recipient:
-        raise HTTPException(status_code=404, detail="Recipient not found")
-    
-    if sender.balance < send_data.amount:
-        raise HTTPException(status_code=400, detail="Insufficient funds")
-    
     if send_data.sender_username == send_data.recipient_username:
         raise HTTPException(status_code=400, detail="Cannot send money to yourself")
     
+    message = f"Successfully sent PHP {send_data.amount:.2f} to {send_data.recipient_username}"
+    amount_cents = to_cents(send_data.amount)
+    reference_number = generate_reference_number()
+    claim = idempotency.make_claim(idempotency_key, "send_money", send_data, message, reference_number)
+    
+    sent_description = f"Sent PHP {send_data.amount:.2f} to {send_data.recipient_username}"
+    received_description = f"Received PHP {send_data.amount:.2f} from {send_data.sender_username}"
+    
     try:
-        # Deduct from sender
-        sender.balance -= send_data.amount
-        sender_ref = create_transaction(
-            db, sender.id, "send_money", send_data.amount,
-            f"Sent PHP {send_data.amount:.2f} to {send_data.recipient_username}",
-            recipient_username=send_data.recipient_username,
-            notes=send_data.notes
-        )
-        
-        # Add to recipient
-        recipient.balance += send_data.amount
-        create_transaction(
-            db, recipient.id, "receive_money", send_data.amount,
-            f"Received PHP {send_data.amount:.2f} from {send_data.sender_username}",
-            sender_username=send_data.sender_username,
-            notes=send_data.notes
-        )
+        if POSTING_JOURNAL:
+            _, sender_balance = posting_journal.post(journal.Posting(
+                amount_cents, (
+                    journal_entry(send_data.sender_username, "send_money", amount_cents, sent_description,
+                                  recipient_username=send_data.recipient_username, notes=send_data.notes,
+                                  reference_number=reference_number),
+                    journal_entry(send_data.recipient_username, "receive_money", amount_cents, received_description,
+                                  sender_username=send_data.sender_username, notes=send_data.notes),
+                ),
+                debit=send_data.sender_username, credit=send_data.recipient_username, claim=claim
+            ))
+        else:
+            # Debit sender and credit recipient in lock order
+            postings = ledger.transfer(
+                db, send_data.sender_username, send_data.recipient_username, amount_cents,
+                claim=claim
+            )
+            sender_id, sender_balance = postings[send_data.sender_username]
+            recipient_id, recipient_balance = postings[send_data.recipient_username]
+            rows = [
+                transaction_row(
+                    sender_id, "send_money", amount_cents, sent_description,
+                    recipient_username=send_data.recipient_username,
+                    notes=send_data.notes,
+                    reference_number=reference_number
+                ),
+                transaction_row(
+                    recipient_id, "receive_money", amount_cents, received_description,
+                    sender_username=send_data.sender_username,
+                    notes=send_data.notes
+                ),
+            ]
+            
+            # Core table insert: one executemany for both rows (the ORM bulk path splits them by NULL columns)
+            db.execute(insert(Transaction.__table__), rows)
+            events.queue_postings(db, {sender_id: sender_balance, recipient_id: recipient_balance}, rows)
+            db.commit()
         
-        db.commit()
-        db.refresh(sender)
+        accounts_changed(send_data.sender_username, send_data.recipient_username)
         
         return TransactionResponse(
-            message=f"Successfully sent PHP {send_data.amount:.2f} to {send_data.recipient_username}",
-            new_balance=sender.balance,
-            transaction_id=sender_ref
+            message=message,
+            new_balance=from_cents(sender_balance),
+            transaction_id=reference_number
         )
         
+    except idempotency.DuplicateRequest:
+        db.rollback()
+        return idempotency.replay(db, claim)
+    except ledger.AccountNotFound as e:
+        db.rollback()
+        party = "Sender" if e.username == send_data.sender_username else "Recipient"
+        raise HTTPException(status_code=404, detail=f"{party} not found")
+    except ledger.InsufficientFunds:
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Insufficient funds")
+    except journal.JournalBusy:
+        raise
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail="Money transfer failed. Please try again.")
 
+# --- Batch Send Money Route ---
+@money_router.post("/send-money/batch", response_model=BatchTransferResponse)
+def send_money_batch(batch_data: BatchSendMoneySchema, db: Session = Depends(get_db)):
+    validate_batch(batch_data)
+    sender_username = batch_data.sender_username
+    results = []
+    
+    for chunk in batch_chunks(batch_data):
+        try:
+            # Resolve and lock sender and recipients in one IN query, in lock order
+            accounts = ledger.lock_accounts(
+                db, [sender_username] + [item.recipient_username for _, item in chunk]
+            )
+            if sender_username not in accounts:
+                raise ledger.AccountNotFound(sender_username)
+            
+            chunk_results, total, credits, rows = prepare_batch_postings(batch_data, chunk, accounts)
+            if batch_data.mode == "all_or_nothing" and any(r.status == "failed" for r in chunk_results):
+                db.rollback()
+                raise batch_rejection(chunk_results)
+            
+            new_balance = accounts[sender_username][1]
+            if total:
+                _, new_balance = ledger.debit(db, sender_username, total)
+                ledger.credit_many(db, credits)
+                db.execute(insert(Transaction.__table__), rows)
+                events.queue_postings(db, batch_balances(accounts, sender_username, new_balance, credits), rows)
+            
+            db.commit()
+            accounts_changed(sender_username, *credits)
+            results.extend(chunk_results)
+            
+        except HTTPException:
+            raise
+        except ledger.AccountNotFound:
+            db.rollback()
+            raise HTTPException(status_code=404, detail="Sender not found")
+        except Exception as e:
+            db.rollback()
+            posted = sum(1 for r in results if r.status == "posted")
+            raise HTTPException(
+                status_code=500,
+                detail=f"Batch transfer failed. {posted} transfers were posted before the error."
+            )
+    
+    return batch_response(results, new_balance)
+
 # --- Pay Bills Route ---
-@router.post("/pay-bills", response_model=TransactionResponse)
-def pay_bills(bill_data: PayBillsSchema, db: Session = Depends(get_db)):
+@money_router.post("/pay-bills", response_model=TransactionResponse)
+def pay_bills(bill_data: PayBillsSchema, idempotency_key: Optional[str] = Header(None), db: Session = Depends(get_db)):
     if bill_data.amount <= 0:
         raise HTTPException(status_code=400, detail="Amount must be greater than zero")
     
-    user = db.query(User).filter(User.username == bill_data.username).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
     # Check if company exists
-    company = db.query(Company).filter(Company.name == bill_data.company_name).first()
+    company = company_directory.get(db, bill_data.company_name)
     if not company:
         raise HTTPException(status_code=404, detail="Company not found")
     
-    if user.balance < bill_data.amount:
-        raise HTTPException(status_code=400, detail="Insufficient funds")
+    message = f"Successfully paid PHP {bill_data.amount:.2f} to {bill_data.company_name}"
+    description = f"Bill payment to {bill_data.company_name} - PHP {bill_data.amount:.2f}"
+    amount_cents = to_cents(bill_data.amount)
+    reference_number = generate_reference_number()
+    claim = idempotency.make_claim(idempotency_key, "pay_bills", bill_data, message, reference_number)
     
     try:
-        user.balance -= bill_data.amount
-        reference_number = create_transaction(
-            db, user.id, "pay_bills", bill_data.amount,
-            f"Bill payment to {bill_data.company_name} - PHP {bill_data.amount:.2f}",
-            bill_company=bill_data.company_name,
-            notes=bill_data.notes
-        )
+        if POSTING_JOURNAL:
+            user_id, new_balance = posting_journal.post(journal.Posting(
+                amount_cents, (
+                    journal_entry(bill_data.username, "pay_bills", amount_cents, description,
+                                  bill_company=bill_data.company_name, notes=bill_data.notes,
+                                  reference_number=reference_number),
+                ),
+                debit=bill_data.username, claim=claim
+            ))
+        else:
+            user_id, new_balance = ledger.debit(db, bill_data.username, amount_cents, claim=claim)
+            row = create_transaction(
+                db, user_id, "pay_bills", amount_cents, description,
+                bill_company=bill_data.company_name,
+                notes=bill_data.notes,
+                reference_number=reference_number
+            )
+            events.queue_postings(db, {user_id: new_balance}, [row])
+            db.commit()
         
-        db.commit()
-        db.refresh(user)
+        accounts_changed(bill_data.username)
         
         return TransactionResponse(
-            message=f"Successfully paid PHP {bill_data.amount:.2f} to {bill_data.company_name}",
-            new_balance=user.balance,
+            message=message,
+            new_balance=from_cents(new_balance),
             transaction_id=reference_number
         )
         
+    except idempotency.DuplicateRequest:
+        db.rollback()
+        return idempotency.replay(db, claim)
+    except ledger.AccountNotFound:
+        db.rollback()
+        raise HTTPException(status_code=404, detail="User not found")
+    except ledger.InsufficientFunds:
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Insufficient funds")
+    except journal.JournalBusy:
+        raise
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail="Bill payment failed. Please try again.")
 
 # --- Transaction History Route ---
-@router.get("/transactions/{username}")
-def get_transactions(username: str, limit: int = 10, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == username).first()
+@money_router.get(
+    "/transactions/{username}",
+    response_model=List[TransactionItem],
+    response_class=ORJSONResponse,
+    dependencies=[Depends(check_session)]
+)
+def get_transactions(
+    username: str,
+    response: Response,
+    limit: int = Query(10, ge=1, le=MAX_HISTORY_PAGE),
+    cursor: Optional[str] = None,
+    transaction_type: Optional[str] = Query(None, alias="type"),
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    counterparty: Optional[str] = None,
+    legacy_fields: bool = False,
+    db: Session = Depends(get_read_db),
+    users: UserResolver = Depends(get_read_user_resolver)
+):
+    filters = HistoryFilters(transaction_type, start_date, end_date, counterparty)
+    transactions = db.execute(
+        history_query(username, limit, decode_cursor(cursor), filters)
+    ).all()
+    
+    # An empty first page is the only time we need to tell "no user" from "no history"
+    if not transactions and cursor is None:
+        if not users.get(username):
+            raise HTTPException(status_code=404, detail="User not found")
+    
+    page, next_cursor = split_page(transactions, limit)
+    return history_response(response, page, next_cursor, legacy_fields)
+
+# --- Statement Export Route ---
+@money_router.get("/transactions/{username}/export", dependencies=[Depends(check_session)])
+def export_transactions(
+    username: str,
+    export_format: str = Query("csv", alias="format"),
+    transaction_type: Optional[str] = Query(None, alias="type"),
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    counterparty: Optional[str] = None,
+    users: UserResolver = Depends(get_read_user_resolver)
+):
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Format must be csv or ndjson")
+    
+    user = users.get(username)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    transactions = db.query(Transaction).filter(
-        Transaction.user_id == user.id
-    ).order_by(Transaction.timestamp.desc()).limit(limit).all()
+    filters = HistoryFilters(transaction_type, start_date, end_date, counterparty)
+    query = apply_history_filters(statement_query(user.id), filters)
+    return StreamingResponse(
+        stream_statement(query, export_format, read_sessionmaker(username)),
+        media_type=EXPORT_FORMATS[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{username}-statement.{export_format}"'}
+    )
+
+# --- Account Summary Route ---
+@money_router.get("/summary/{username}", dependencies=[Depends(check_session)])
+def get_summary(
+    username: str,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    db: Session = Depends(get_read_db)
+):
+    """Totals by type and month plus opening/closing balances, from the daily snapshots"""
+    if start_date and end_date and start_date > end_date:
+        raise HTTPException(status_code=400, detail="start_date must not be after end_date")
     
-    return [
-        {
-            "reference_number": t.reference_number,
-            "type": t.transaction_type,
-            "amount": t.amount,
-            "description": t.description,
-            "timestamp": t.timestamp.strftime("%m/%d/%Y %I:%M %p"),
-            "date": t.timestamp.strftime("%m/%d/%Y"),
-            "time": t.timestamp.strftime("%I:%M %p"),
-            "recipient": t.recipient_username,
-            "sender": t.sender_username,
-            "company": t.bill_company,
-            "notes": t.notes
-        }
-        for t in transactions
-    ]
+    context = db.execute(summary_context_query(username, start_date)).one()
+    if not context.user_exists:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    rows = db.execute(summary_rows_query(username, start_date, end_date)).all()
+    return summary_response(username, start_date, end_date, context, rows)
 
 # --- Companies Route ---
-@router.get("/companies")
-def get_companies(db: Session = Depends(get_db)):
-    companies = db.query(Company).filter(Company.is_active == True).all()
-    return [
-        {
-            "id": c.id,
-            "name": c.name,
-            "category": c.category
-        }
-        for c in companies
-    ]
+@router.get("/companies", response_model=List[CompanyItem])
+def get_companies(request: Request, db: Session = Depends(get_read_db)):
+    body, etag = company_directory.listing(db)
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
 
 @router.post("/companies")
 def create_company(name: str, category: str, db: Session = Depends(get_db)):
@@ -339,60 +875,96 @@ def create_company(name: str, category: str, db: Session = Depends(get_db)):
     db.add(company)
     db.commit()
     db.refresh(company)
+    # Reload from the primary now: left to the next GET, a lagging replica could cache the list without it
+    company_directory.refresh(db)
     
     return {"message": f"Company {name} created successfully", "id": company.id}
 
 # --- User Profile Route ---
-@router.get("/profile/{username}")
-def get_profile(username: str, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == username).first()
-    if not user:
+@router.get(
+    "/profile/{username}",
+    response_model=ProfileResponse,
+    response_class=ORJSONResponse,
+    dependencies=[Depends(check_session)]
+)
+def get_profile(username: str, users: UserResolver = Depends(get_read_user_resolver)):
+    profile = get_cached_profile(users, username)
+    if not profile:
         raise HTTPException(status_code=404, detail="User not found")
 
-    return {
-        "first_name": user.first_name,
-        "last_name": user.last_name,
-        "email": user.email,
-        "username": user.username,
-        "balance": user.balance,
-        "created_at": user.created_at
-    }
+    return profile
 
-# --- Edit Profile Route ---
-@router.put("/profile/{username}")
-def update_profile(username: str, profile_data: UpdateProfileSchema, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == username).first()
-    if not user:
+# --- User Search Route ---
+@router.get("/users/search", dependencies=[Depends(check_any_session)])
+def search_user_directory(
+    request: Request,
+    q: str = Query(..., min_length=USER_SEARCH_MIN_LENGTH, max_length=64),
+    limit: int = Query(8, ge=1, le=20),
+    db: Session = Depends(get_read_db)
+):
+    """Usernames starting with q, for recipient autocomplete; exists says whether q itself is a user.
+
+    Needs a logged-in caller and is rate limited per client IP, so the directory
+    can't be scraped anonymously or in bulk.
+    """
+    user_searches.acquire(client_ip(request))
+    return search_users(db, q, limit)
+
+# --- Live Events Route ---
+@router.get("/stream/{username}", dependencies=[Depends(check_stream_session)])
+async def stream_events(username: str):
+    """Server-sent events for one account, so clients stop polling balance and history.
+
+    `transaction` carries a history item and `balance` the new balance as each
+    posting commits; `resync` means events may have been missed and the client
+    should refetch both. Idle streams get a comment every EVENT_HEARTBEAT_SECONDS.
+    """
+    user_id = await lookup_user_id(username)
+    if user_id is None:
         raise HTTPException(status_code=404, detail="User not found")
     
-    # Check if email is being changed and if it's already taken by another user
-    if profile_data.email != user.email:
-        existing_email = db.query(User).filter(
-            User.email == profile_data.email,
-            User.id != user.id
-        ).first()
-        if existing_email:
-            raise HTTPException(status_code=400, detail="Email already exists")
-    
+    return events.EventStreamResponse(events.event_hub, user_id)
+
+# --- Edit Profile Route ---
+@router.put("/profile/{username}", dependencies=[Depends(check_session)])
+def update_profile(username: str, profile_data: UpdateProfileSchema, db: Session = Depends(get_db)):
+    # One UPDATE ... RETURNING: no row means no such user, and the unique index on
+    # email rejects an address another user already has
     try:
-        # Update user fields
-        user.first_name = profile_data.first_name
-        user.last_name = profile_data.last_name
-        user.email = profile_data.email
+        user = db.execute(
+            update(User)
+            .where(User.username == username)
+            .values(
+                first_name=profile_data.first_name,
+                last_name=profile_data.last_name,
+                email=profile_data.email
+            )
+            .returning(User)
+        ).scalar_one_or_none()
+        if not user:
+            db.rollback()
+            raise HTTPException(status_code=404, detail="User not found")
         
-        db.commit()
-        db.refresh(user)
-        
-        return {
+        # Read the returned row before commit expires it, which would cost a reload
+        updated = {
             "message": "Profile updated successfully",
             "first_name": user.first_name,
             "last_name": user.last_name,
             "email": user.email,
             "username": user.username,
-            "balance": user.balance,
+            "balance": cents_to_float(user.balance_cents),
             "created_at": user.created_at
         }
+        db.commit()
+        accounts_changed(username)
         
+        return updated
+        
+    except HTTPException:
+        raise
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Email already exists")
     except Exception as e:
         db.rollback()
-        raise HTTPException(status_code=500, detail="Profile update failed. Please try again.")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Profile update failed. Please try again.")
@@ -0,0 +1,423 @@
+# auth_async.py
+
+from fastapi import APIRouter, HTTPException, Depends, Header, Query, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import async_read_sessionmaker, get_async_db, get_async_read_db
+from models import Transaction
+import ledger
+import idempotency
+import journal
+import events
+from journal import POSTING_JOURNAL, posting_journal
+from auth import (
+    DepositSchema, WithdrawSchema, SendMoneySchema, PayBillsSchema, BatchSendMoneySchema,
+    BalanceResponse, TransactionResponse, BatchTransferResponse, TransactionItem, HistoryFilters, MAX_HISTORY_PAGE,
+    accounts_changed, apply_history_filters, batch_balances, batch_chunks, batch_rejection, batch_response, create_transaction,
+    decode_cursor, generate_reference_number, history_query, history_response, journal_entry,
+    prepare_batch_postings, profile_snapshot, split_page, transaction_row, validate_batch
+)
+from cache import user_cache
+from sessions import check_session
+from users import AsyncUserResolver, get_async_read_user_resolver
+from company_cache import company_directory
+from money import from_cents, to_cents
+from statements import EXPORT_FORMATS, statement_query, stream_statement_async
+from summaries import summary_context_query, summary_response, summary_rows_query
+from datetime import date, datetime
+from typing import List, Optional
+
+# Async twins of auth.money_router, served on the event loop instead of the threadpool
+router = APIRouter()
+
+# --- Helper Functions ---
+async def get_cached_profile(users: AsyncUserResolver, username: str):
+    profile, version = user_cache.lookup(username)
+    if profile is None:
+        user = await users.get(username)
+        if not user:
+            return None
+        profile = profile_snapshot(user)
+        # Skipped if a posting invalidated the entry while this read was in flight
+        user_cache.fill(username, profile, version)
+    return profile
+
+# --- Balance Route ---
+@router.get("/balance/{username}", response_model=BalanceResponse, dependencies=[Depends(check_session)])
+async def get_balance(username: str, users: AsyncUserResolver = Depends(get_async_read_user_resolver)):
+    profile = await get_cached_profile(users, username)
+    if not profile:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    return BalanceResponse(balance=profile["balance"], username=profile["username"])
+
+# --- Deposit Route ---
+@router.post("/deposit", response_model=TransactionResponse)
+async def deposit(deposit_data: DepositSchema, idempotency_key: Optional[str] = Header(None), db: AsyncSession = Depends(get_async_db)):
+    if deposit_data.amount <= 0:
+        raise HTTPException(status_code=400, detail="Amount must be greater than zero")
+
+    if deposit_data.amount < 100:
+        raise HTTPException(status_code=400, detail="Minimum deposit amount is PHP 100")
+
+    message = f"Successfully deposited PHP {deposit_data.amount:.2f}"
+    description = f"Deposit of PHP {deposit_data.amount:.2f}"
+    amount_cents = to_cents(deposit_data.amount)
+    reference_number = generate_reference_number()
+    claim = idempotency.make_claim(idempotency_key, "deposit", deposit_data, message, reference_number)
+
+    try:
+        if POSTING_JOURNAL:
+            user_id, new_balance = await posting_journal.post_async(journal.Posting(
+                amount_cents, (
+                    journal_entry(deposit_data.username, "deposit", amount_cents, description,
+                                  reference_number=reference_number),
+                ),
+                credit=deposit_data.username, claim=claim
+            ))
+        else:
+            user_id, new_balance = await ledger.credit_async(db, deposit_data.username, amount_cents, claim=claim)
+            row = create_transaction(
+                db, user_id, "deposit", amount_cents, description,
+                reference_number=reference_number
+            )
+            events.queue_postings(db, {user_id: new_balance}, [row])
+            await db.commit()
+
+        accounts_changed(deposit_data.username)
+
+        return TransactionResponse(
+            message=message,
+            new_balance=from_cents(new_balance),
+            transaction_id=reference_number
+        )
+
+    except idempotency.DuplicateRequest:
+        await db.rollback()
+        return await idempotency.replay_async(db, claim)
+    except ledger.AccountNotFound:
+        await db.rollback()
+        raise HTTPException(status_code=404, detail="User not found")
+    except journal.JournalBusy:
+        raise
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail="Deposit failed. Please try again.")
+
+# --- Withdraw Route ---
+@router.post("/withdraw", response_model=TransactionResponse)
+async def withdraw(withdraw_data: WithdrawSchema, idempotency_key: Optional[str] = Header(None), db: AsyncSession = Depends(get_async_db)):
+    if withdraw_data.amount <= 0:
+        raise HTTPException(status_code=400, detail="Amount must be greater than zero")
+
+    message = f"Successfully withdrew PHP {withdraw_data.amount:.2f}"
+    description = f"Withdrawal of PHP {withdraw_data.amount:.2f}"
+    amount_cents = to_cents(withdraw_data.amount)
+    reference_number = generate_reference_number()
+    claim = idempotency.make_claim(idempotency_key, "withdraw", withdraw_data, message, reference_number)
+
+    try:
+        if POSTING_JOURNAL:
+            user_id, new_balance = await posting_journal.post_async(journal.Posting(
+                amount_cents, (
+                    journal_entry(withdraw_data.username, "withdraw", amount_cents, description,
+                                  reference_number=reference_number),
+                ),
+                debit=withdraw_data.username, claim=claim
+            ))
+        else:
+            user_id, new_balance = await ledger.debit_async(db, withdraw_data.username, amount_cents, claim=claim)
+            row = create_transaction(
+                db, user_id, "withdraw", amount_cents, description,
+                reference_number=reference_number
+            )
+            events.queue_postings(db, {user_id: new_balance}, [row])
+            await db.commit()
+
+        accounts_changed(withdraw_data.username)
+
+        return TransactionResponse(
+            message=message,
+            new_balance=from_cents(new_balance),
+            transaction_id=reference_number
+        )
+
+    except idempotency.DuplicateRequest:
+        await db.rollback()
+        return await idempotency.replay_async(db, claim)
+    except ledger.AccountNotFound:
+        await db.rollback()
+        raise HTTPException(status_code=404, detail="User not found")
+    except ledger.InsufficientFunds:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Insufficient funds")
+    except journal.JournalBusy:
+        raise
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail="Withdrawal failed. Please try again.")
+
+# --- Send Money Route ---
+@router.post("/send-money", response_model=TransactionResponse)
+async def send_money(send_data: SendMoneySchema, idempotency_key: Optional[str] = Header(None), db: AsyncSession = Depends(get_async_db)):
+    if send_data.amount <= 0:
+        raise HTTPException(status_code=400, detail="Amount must be greater than zero")
+
+    if send_data.sender_username == send_data.recipient_username:
+        raise HTTPException(status_code=400, detail="Cannot send money to yourself")
+
+    message = f"Successfully sent PHP {send_data.amount:.2f} to {send_data.recipient_username}"
+    amount_cents = to_cents(send_data.amount)
+    reference_number = generate_reference_number()
+    claim = idempotency.make_claim(idempotency_key, "send_money", send_data, message, reference_number)
+
+    sent_description = f"Sent PHP {send_data.amount:.2f} to {send_data.recipient_username}"
+    received_description = f"Received PHP {send_data.amount:.2f} from {send_data.sender_username}"
+
+    try:
+        if POSTING_JOURNAL:
+            _, sender_balance = await posting_journal.post_async(journal.Posting(
+                amount_cents, (
+                    journal_entry(send_data.sender_username, "send_money", amount_cents, sent_description,
+                                  recipient_username=send_data.recipient_username, notes=send_data.notes,
+                                  reference_number=reference_number),
+                    journal_entry(send_data.recipient_username, "receive_money", amount_cents, received_description,
+                                  sender_username=send_data.sender_username, notes=send_data.notes),
+                ),
+                debit=send_data.sender_username, credit=send_data.recipient_username, claim=claim
+            ))
+        else:
+            # Debit sender and credit recipient in lock order
+            postings = await ledger.transfer_async(
+                db, send_data.sender_username, send_data.recipient_username, amount_cents,
+                claim=claim
+            )
+            sender_id, sender_balance = postings[send_data.sender_username]
+            recipient_id, recipient_balance = postings[send_data.recipient_username]
+            rows = [
+                transaction_row(
+                    sender_id, "send_money", amount_cents, sent_description,
+                    recipient_username=send_data.recipient_username,
+                    notes=send_data.notes,
+                    reference_number=reference_number
+                ),
+                transaction_row(
+                    recipient_id, "receive_money", amount_cents, received_description,
+                    sender_username=send_data.sender_username,
+                    notes=send_data.notes
+                ),
+            ]
+
+            # Core table insert: one executemany for both rows (the ORM bulk path splits them by NULL columns)
+            await db.execute(insert(Transaction.__table__), rows)
+            events.queue_postings(db, {sender_id: sender_balance, recipient_id: recipient_balance}, rows)
+            await db.commit()
+
+        accounts_changed(send_data.sender_username, send_data.recipient_username)
+
+        return TransactionResponse(
+            message=message,
+            new_balance=from_cents(sender_balance),
+            transaction_id=reference_number
+        )
+
+    except idempotency.DuplicateRequest:
+        await db.rollback()
+        return await idempotency.replay_async(db, claim)
+    except ledger.AccountNotFound as e:
+        await db.rollback()
+        party = "Sender" if e.username == send_data.sender_username else "Recipient"
+        raise HTTPException(status_code=404, detail=f"{party} not found")
+    except ledger.InsufficientFunds:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Insufficient funds")
+    except journal.JournalBusy:
+        raise
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail="Money transfer failed. Please try again.")
+
+# --- Batch Send Money Route ---
+@router.post("/send-money/batch", response_model=BatchTransferResponse)
+async def send_money_batch(batch_data: BatchSendMoneySchema, db: AsyncSession = Depends(get_async_db)):
+    validate_batch(batch_data)
+    sender_username = batch_data.sender_username
+    results = []
+
+    for chunk in batch_chunks(batch_data):
+        try:
+            # Resolve and lock sender and recipients in one IN query, in lock order
+            accounts = await ledger.lock_accounts_async(
+                db, [sender_username] + [item.recipient_username for _, item in chunk]
+            )
+            if sender_username not in accounts:
+                raise ledger.AccountNotFound(sender_username)
+
+            chunk_results, total, credits, rows = prepare_batch_postings(batch_data, chunk, accounts)
+            if batch_data.mode == "all_or_nothing" and any(r.status == "failed" for r in chunk_results):
+                await db.rollback()
+                raise batch_rejection(chunk_results)
+
+            new_balance = accounts[sender_username][1]
+            if total:
+                _, new_balance = await ledger.debit_async(db, sender_username, total)
+                await ledger.credit_many_async(db, credits)
+                await db.execute(insert(Transaction.__table__), rows)
+                events.queue_postings(db, batch_balances(accounts, sender_username, new_balance, credits), rows)
+
+            await db.commit()
+            accounts_changed(sender_username, *credits)
+            results.extend(chunk_results)
+
+        except HTTPException:
+            raise
+        except ledger.AccountNotFound:
+            await db.rollback()
+            raise HTTPException(status_code=404, detail="Sender not found")
+        except Exception as e:
+            await db.rollback()
+            posted = sum(1 for r in results if r.status == "posted")
+            raise HTTPException(
+                status_code=500,
+                detail=f"Batch transfer failed. {posted} transfers were posted before the error."
+            )
+
+    return batch_response(results, new_balance)
+
+# --- Pay Bills Route ---
+@router.post("/pay-bills", response_model=TransactionResponse)
+async def pay_bills(bill_data: PayBillsSchema, idempotency_key: Optional[str] = Header(None), db: AsyncSession = Depends(get_async_db)):
+    if bill_data.amount <= 0:
+        raise HTTPException(status_code=400, detail="Amount must be greater than zero")
+
+    # Check if company exists
+    company = await company_directory.get_async(db, bill_data.company_name)
+    if not company:
+        raise HTTPException(status_code=404, detail="Company not found")
+
+    message = f"Successfully paid PHP {bill_data.amount:.2f} to {bill_data.company_name}"
+    description = f"Bill payment to {bill_data.company_name} - PHP {bill_data.amount:.2f}"
+    amount_cents = to_cents(bill_data.amount)
+    reference_number = generate_reference_number()
+    claim = idempotency.make_claim(idempotency_key, "pay_bills", bill_data, message, reference_number)
+
+    try:
+        if POSTING_JOURNAL:
+            user_id, new_balance = await posting_journal.post_async(journal.Posting(
+                amount_cents, (
+                    journal_entry(bill_data.username, "pay_bills", amount_cents, description,
+                                  bill_company=bill_data.company_name, notes=bill_data.notes,
+                                  reference_number=reference_number),
+                ),
+                debit=bill_data.username, claim=claim
+            ))
+        else:
+            user_id, new_balance = await ledger.debit_async(db, bill_data.username, amount_cents, claim=claim)
+            row = create_transaction(
+                db, user_id, "pay_bills", amount_cents, description,
+                bill_company=bill_data.company_name,
+                notes=bill_data.notes,
+                reference_number=reference_number
+            )
+            events.queue_postings(db, {user_id: new_balance}, [row])
+            await db.commit()
+
+        accounts_changed(bill_data.username)
+
+        return TransactionResponse(
+            message=message,
+            new_balance=from_cents(new_balance),
+            transaction_id=reference_number
+        )
+
+    except idempotency.DuplicateRequest:
+        await db.rollback()
+        return await idempotency.replay_async(db, claim)
+    except ledger.AccountNotFound:
+        await db.rollback()
+        raise HTTPException(status_code=404, detail="User not found")
+    except ledger.InsufficientFunds:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Insufficient funds")
+    except journal.JournalBusy:
+        raise
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail="Bill payment failed. Please try again.")
+
+# --- Transaction History Route ---
+@router.get(
+    "/transactions/{username}",
+    response_model=List[TransactionItem],
+    response_class=ORJSONResponse,
+    dependencies=[Depends(check_session)]
+)
+async def get_transactions(
+    username: str,
+    response: Response,
+    limit: int = Query(10, ge=1, le=MAX_HISTORY_PAGE),
+    cursor: Optional[str] = None,
+    transaction_type: Optional[str] = Query(None, alias="type"),
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    counterparty: Optional[str] = None,
+    legacy_fields: bool = False,
+    db: AsyncSession = Depends(get_async_read_db),
+    users: AsyncUserResolver = Depends(get_async_read_user_resolver)
+):
+    filters = HistoryFilters(transaction_type, start_date, end_date, counterparty)
+    result = await db.execute(history_query(username, limit, decode_cursor(cursor), filters))
+    transactions = result.all()
+
+    # An empty first page is the only time we need to tell "no user" from "no history"
+    if not transactions and cursor is None:
+        if not await users.get(username):
+            raise HTTPException(status_code=404, detail="User not found")
+
+    page, next_cursor = split_page(transactions, limit)
+    return history_response(response, page, next_cursor, legacy_fields)
+
+# --- Statement Export Route ---
+@router.get("/transactions/{username}/export", dependencies=[Depends(check_session)])
+async def export_transactions(
+    username: str,
+    export_format: str = Query("csv", alias="format"),
+    transaction_type: Optional[str] = Query(None, alias="type"),
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    counterparty: Optional[str] = None,
+    users: AsyncUserResolver = Depends(get_async_read_user_resolver)
+):
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Format must be csv or ndjson")
+
+    user = await users.get(username)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    filters = HistoryFilters(transaction_type, start_date, end_date, counterparty)
+    query = apply_history_filters(statement_query(user.id), filters)
+    return StreamingResponse(
+        stream_statement_async(query, export_format, async_read_sessionmaker(username)),
+        media_type=EXPORT_FORMATS[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{username}-statement.{export_format}"'}
+    )
+
+# --- Account Summary Route ---
+@router.get("/summary/{username}", dependencies=[Depends(check_session)])
+async def get_summary(
+    username: str,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    if start_date and end_date and start_date > end_date:
+        raise HTTPException(status_code=400, detail="start_date must not be after end_date")
+
+    context = (await db.execute(summary_context_query(username, start_date))).one()
+    if not context.user_exists:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    rows = (await db.execute(summary_rows_query(username, start_date, end_date))).all()
+    return summary_response(username, start_date, end_date, context, rows)
@@ -0,0 +1,282 @@
+# cache.py
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# "lru" or "memory" (a stand-in for a shared backend in tests) keep entries in this
+# process only: an invalidation reaches this worker's cache, and the others keep
+# serving their copy for up to CACHE_TTL. "redis" (needs REDIS_URL) is shared by
+# every worker and is the one to use when running more than one.
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "lru").lower()
+
+# Seconds an entry is served before it is re-read from the database
+CACHE_TTL = float(os.getenv("CACHE_TTL", "10"))
+
+# Entries kept by the in-process LRU
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+
+# Seconds Redis remembers that a key was invalidated; a fill that takes longer is dropped
+INVALIDATION_MEMORY_SECONDS = 300
+
+# --- Backends ---
+class CacheBackend:
+    """Interface every cache backend implements; values are JSON-serializable.
+
+    lookup() and fill() make read-through safe against invalidation: lookup
+    returns a version along with the value, and fill() stores a value read from
+    the database only if delete() hasn't touched the key since that version,
+    so a fill racing an invalidation can't put the old value back.
+    """
+
+    def get(self, key: str):
+        raise NotImplementedError
+
+    def lookup(self, key: str):
+        """(value or None, version to pass to fill)"""
+        raise NotImplementedError
+
+    def set(self, key: str, value, ttl: float):
+        raise NotImplementedError
+
+    def fill(self, key: str, value, ttl: float, version) -> bool:
+        """set() unless key was deleted since lookup() returned version; False if skipped"""
+        raise NotImplementedError
+
+    def delete(self, *keys: str):
+        raise NotImplementedError
+
+class Invalidations:
+    """When each key was last deleted, on a per-backend counter; call under the backend's lock.
+
+    Bounded like the LRU: once the oldest record is dropped, every fill that
+    started before it is treated as stale, which only costs a cache miss.
+    """
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.counter = 0
+        self._deleted_at = OrderedDict()
+        self._forgotten = 0
+
+    def record(self, key: str):
+        self.counter += 1
+        self._deleted_at[key] = self.counter
+        self._deleted_at.move_to_end(key)
+        while len(self._deleted_at) > self.max_entries:
+            _, deleted_at = self._deleted_at.popitem(last=False)
+            self._forgotten = deleted_at
+
+    def changed_since(self, key: str, version: int) -> bool:
+        return max(self._deleted_at.get(key, 0), self._forgotten) > version
+
+class LRUBackend(CacheBackend):
+    """Bounded in-process LRU with per-entry expiry"""
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._invalidations = Invalidations(max_entries)
+        self._lock = threading.Lock()
+
+    def _get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _set(self, key: str, value, ttl: float):
+        self._entries[key] = (value, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key: str):
+        with self._lock:
+            return self._get(key)
+
+    def lookup(self, key: str):
+        with self._lock:
+            return self._get(key), self._invalidations.counter
+
+    def set(self, key: str, value, ttl: float):
+        with self._lock:
+            self._set(key, value, ttl)
+
+    def fill(self, key: str, value, ttl: float, version) -> bool:
+        with self._lock:
+            if self._invalidations.changed_since(key, version):
+                return False
+            self._set(key, value, ttl)
+            return True
+
+    def delete(self, *keys: str):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+                self._invalidations.record(key)
+
+class InMemorySharedBackend(CacheBackend):
+    """Stand-in for a shared cache in tests: values go through JSON like they would
+    over the wire, but the entries still live in this process only"""
+
+    def __init__(self):
+        self._entries = {}
+        self._invalidations = Invalidations()
+        self._lock = threading.Lock()
+
+    def _get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        payload, expires_at = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[key]
+            return None
+        return json.loads(payload)
+
+    def get(self, key: str):
+        with self._lock:
+            return self._get(key)
+
+    def lookup(self, key: str):
+        with self._lock:
+            return self._get(key), self._invalidations.counter
+
+    def set(self, key: str, value, ttl: float):
+        with self._lock:
+            self._entries[key] = (json.dumps(value), time.monotonic() + ttl)
+
+    def fill(self, key: str, value, ttl: float, version) -> bool:
+        with self._lock:
+            if self._invalidations.changed_since(key, version):
+                return False
+            self._entries[key] = (json.dumps(value), time.monotonic() + ttl)
+            return True
+
+    def delete(self, *keys: str):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+                self._invalidations.record(key)
+
+# Sets KEYS[1] only while its version counter KEYS[2] still holds what lookup() read
+FILL_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[3] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+return 1
+"""
+
+class RedisBackend(CacheBackend):
+    """Cache shared by every worker; needs the optional redis package.
+
+    Each deleted key gets a version counter under "<key>:v" that lives for
+    INVALIDATION_MEMORY_SECONDS; fills compare it atomically in a Lua script.
+    """
+
+    def __init__(self, url: str):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_BACKEND=redis requires the redis package (pip install redis)")
+        self._client = redis.Redis.from_url(url)
+        self._fill = self._client.register_script(FILL_SCRIPT)
+
+    def get(self, key: str):
+        payload = self._client.get(key)
+        return None if payload is None else json.loads(payload)
+
+    def lookup(self, key: str):
+        payload, version = self._client.mget(key, f"{key}:v")
+        return (None if payload is None else json.loads(payload)), (version or b"0").decode()
+
+    def set(self, key: str, value, ttl: float):
+        self._client.set(key, json.dumps(value), px=int(ttl * 1000))
+
+    def fill(self, key: str, value, ttl: float, version) -> bool:
+        return bool(self._fill(keys=[key, f"{key}:v"], args=[json.dumps(value), int(ttl * 1000), version]))
+
+    def delete(self, *keys: str):
+        if not keys:
+            return
+        pipe = self._client.pipeline()
+        pipe.delete(*keys)
+        for key in keys:
+            pipe.incr(f"{key}:v")
+            pipe.expire(f"{key}:v", INVALIDATION_MEMORY_SECONDS)
+        pipe.execute()
+
+def create_backend(name: str = CACHE_BACKEND) -> CacheBackend:
+    if name == "lru":
+        return LRUBackend()
+    if name == "memory":
+        return InMemorySharedBackend()
+    if name == "redis":
+        redis_url = os.getenv("REDIS_URL")
+        if not redis_url:
+            raise ValueError("REDIS_URL not found in .env")
+        return RedisBackend(redis_url)
+    raise ValueError("CACHE_BACKEND must be 'lru', 'redis' or 'memory'")
+
+# --- Read-Through Cache ---
+class ReadThroughCache:
+    """Namespaced cache with hit/miss counters over a pluggable backend.
+
+    Read through with lookup() and fill(), not get() and set(): a fill whose
+    database read raced an invalidate() is dropped instead of caching the old value.
+    """
+
+    def __init__(self, namespace: str, backend: CacheBackend, ttl: float = CACHE_TTL):
+        self.namespace = namespace
+        self.backend = backend
+        self.ttl = ttl
+        self._stats_lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "invalidations": 0, "stale_fills": 0}
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    def _count(self, name: str, amount: int = 1):
+        with self._stats_lock:
+            self._stats[name] += amount
+
+    def get(self, key: str):
+        value = self.backend.get(self._key(key))
+        self._count("hits" if value is not None else "misses")
+        return value
+
+    def lookup(self, key: str):
+        """(cached value or None, version to hand to fill() after reading the database)"""
+        value, version = self.backend.lookup(self._key(key))
+        self._count("hits" if value is not None else "misses")
+        return value, version
+
+    def set(self, key: str, value):
+        self.backend.set(self._key(key), value, self.ttl)
+
+    def fill(self, key: str, value, version):
+        if not self.backend.fill(self._key(key), value, self.ttl, version):
+            self._count("stale_fills")
+
+    def invalidate(self, *keys: str):
+        self.backend.delete(*(self._key(key) for key in keys))
+        self._count("invalidations", len(keys))
+
+    def get_stats(self):
+        with self._stats_lock:
+            return dict(self._stats)
+
+# Profile snapshots (including balance) keyed by username
+user_cache = ReadThroughCache("user", create_backend())
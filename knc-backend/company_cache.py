@@ -0,0 +1,99 @@
+# company_cache.py
+
+import hashlib
+import os
+import threading
+import time
+from typing import NamedTuple
+import orjson
+from sqlalchemy import select
+from dotenv import load_dotenv
+from models import Company
+
+load_dotenv()
+
+# Seconds before the directory is reloaded; create_company also invalidates it right away
+COMPANY_CACHE_TTL = float(os.getenv("COMPANY_CACHE_TTL", "300"))
+
+class CachedCompany(NamedTuple):
+    id: int
+    name: str
+    category: str
+    is_active: bool
+
+class CompanyDirectory:
+    """In-process copy of the companies table.
+
+    Bill payments look billers up here instead of querying, and GET /companies
+    serves a pre-rendered JSON body with an ETag. The table is tiny, so the
+    whole thing is reloaded on expiry rather than updated piecemeal.
+    """
+
+    def __init__(self, ttl: float = COMPANY_CACHE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._by_name = {}
+        self._body = b"[]"
+        self._etag = None
+        self._expires_at = 0.0
+
+    def _query(self):
+        return select(Company.id, Company.name, Company.category, Company.is_active).order_by(Company.id)
+
+    def _install(self, rows):
+        companies = [CachedCompany(*row) for row in rows]
+        body = orjson.dumps([
+            {"id": c.id, "name": c.name, "category": c.category}
+            for c in companies if c.is_active
+        ])
+        with self._lock:
+            self._by_name = {c.name: c for c in companies}
+            self._body = body
+            self._etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+            self._expires_at = time.monotonic() + self.ttl
+
+    @property
+    def is_stale(self) -> bool:
+        return time.monotonic() >= self._expires_at
+
+    def invalidate(self):
+        with self._lock:
+            self._expires_at = 0.0
+
+    # --- Sync Access ---
+    def refresh(self, db):
+        self._install(db.execute(self._query()).all())
+
+    def ensure_fresh(self, db):
+        if self.is_stale:
+            self.refresh(db)
+
+    def get(self, db, name: str):
+        """Company by name; a miss re-checks the database once in case another worker just added it"""
+        self.ensure_fresh(db)
+        company = self._by_name.get(name)
+        if company is None and db.execute(select(Company.id).where(Company.name == name)).first():
+            self.refresh(db)
+            company = self._by_name.get(name)
+        return company
+
+    def listing(self, db):
+        """(body, etag) for GET /companies"""
+        self.ensure_fresh(db)
+        with self._lock:
+            return self._body, self._etag
+
+    # --- Async Access ---
+    async def refresh_async(self, db):
+        self._install((await db.execute(self._query())).all())
+
+    async def get_async(self, db, name: str):
+        if self.is_stale:
+            await self.refresh_async(db)
+        company = self._by_name.get(name)
+        if company is None and (await db.execute(select(Company.id).where(Company.name == name))).first():
+            await self.refresh_async(db)
+            company = self._by_name.get(name)
+        return company
+
+company_directory = CompanyDirectory()
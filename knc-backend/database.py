@@ -1,32 +1,317 @@
 #database.py
 
 import os
+import threading
+import time
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from fastapi import Request
 from dotenv import load_dotenv
+from cache import ReadThroughCache, create_backend
+import metrics
 
 # Load environment variables from .env
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-if not DATABASE_URL:
-    raise ValueError("DATABASE_URL not found in .env")
+# "postgresql", "sqlite", ... read from the URL alone, so checking it never builds an engine
+DATABASE_BACKEND = make_url(DATABASE_URL).get_backend_name() if DATABASE_URL else None
 
-# Create SQLAlchemy engine
-engine = create_engine(DATABASE_URL)
+# "sync" serves the money routes from the threadpool, "async" from the event loop
+DB_MODE = os.getenv("DB_MODE", "sync").lower()
+
+if DB_MODE not in ("sync", "async"):
+    raise ValueError("DB_MODE must be 'sync' or 'async'")
+
+USE_ASYNC_DB = DB_MODE == "async"
+
+# --- Pool Settings ---
+# Per worker process: size the pool so workers * (size + overflow) stays under max_connections
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))     # seconds to wait for a connection
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))     # seconds before a connection is replaced
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))  # 0 leaves the server default
+DB_EXECUTEMANY_MODE = os.getenv("DB_EXECUTEMANY_MODE", "values_plus_batch")
+
+class _TimedCheckoutMixin:
+    """Records how long callers wait for a pooled connection"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkout_stats_lock = threading.Lock()
+        self.checkout_stats = {
+            "checkouts": 0,
+            "timeouts": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+        }
+
+    def _record_checkout(self, waited: float, timed_out: bool):
+        with self.checkout_stats_lock:
+            self.checkout_stats["timeouts" if timed_out else "checkouts"] += 1
+            self.checkout_stats["wait_seconds_total"] += waited
+            self.checkout_stats["wait_seconds_max"] = max(self.checkout_stats["wait_seconds_max"], waited)
+        metrics.observe_pool_wait(waited)
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except Exception:
+            self._record_checkout(time.perf_counter() - started, timed_out=True)
+            raise
+        self._record_checkout(time.perf_counter() - started, timed_out=False)
+        return connection
+
+class TimedQueuePool(_TimedCheckoutMixin, QueuePool):
+    pass
+
+class TimedAsyncQueuePool(_TimedCheckoutMixin, AsyncAdaptedQueuePool):
+    pass
+
+def engine_options(url: str, is_async: bool = False, read_only: bool = False):
+    """create_engine keyword arguments for url; pool tuning only applies to Postgres.
+
+    read_only makes every transaction READ ONLY, so a read route that starts
+    writing fails loudly instead of writing to a database that isn't the primary.
+    """
+    if make_url(url).get_backend_name() != "postgresql":
+        return {}
+
+    options = {
+        "poolclass": TimedAsyncQueuePool if is_async else TimedQueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+    settings = {}
+    if DB_STATEMENT_TIMEOUT_MS:
+        settings["statement_timeout"] = str(DB_STATEMENT_TIMEOUT_MS)
+    if read_only:
+        settings["default_transaction_read_only"] = "on"
+    if is_async:
+        if settings:
+            options["connect_args"] = {"server_settings": settings}
+    else:
+        options["executemany_mode"] = DB_EXECUTEMANY_MODE
+        if settings:
+            options["connect_args"] = {"options": " ".join(f"-c {name}={value}" for name, value in settings.items())}
+    return options
+
+# --- Lazy Engines ---
+# Engines are built on first use, not at import: importing the app opens no
+# connections and needs no DATABASE_URL, and a worker starts without touching
+# the database. Schema changes are applied by migrations.py, never at startup.
+_engines = {}
+_engines_lock = threading.Lock()
+
+def _lazy(name: str, build):
+    built = _engines.get(name)
+    if built is None:
+        with _engines_lock:
+            built = _engines.get(name)
+            if built is None:
+                built = _engines[name] = build()
+    return built
+
+def _build_engine():
+    if not DATABASE_URL:
+        raise ValueError("DATABASE_URL not found in .env")
+    built = create_engine(DATABASE_URL, **engine_options(DATABASE_URL))
+    metrics.instrument_engine(built)
+    return built
+
+def get_engine():
+    return _lazy("sync", _build_engine)
+
+class LazySessionmaker:
+    """Stands in for a sessionmaker and builds it (and its engine) when the first session is opened"""
+
+    def __init__(self, build):
+        self._build = build
+        self._factory = None
+        self._lock = threading.Lock()
+
+    def __call__(self, **kwargs):
+        if self._factory is None:
+            with self._lock:
+                if self._factory is None:
+                    self._factory = self._build()
+        return self._factory(**kwargs)
 
 # Create a configured "Session" class
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+SessionLocal = LazySessionmaker(lambda: sessionmaker(autocommit=False, autoflush=False, bind=get_engine()))
 
 # Base class for models
 Base = declarative_base()
 
 # Dependency to get DB session
 def get_db():
+    # A Session only checks out a pooled connection on its first query, so
+    # requests rejected by validation never touch the pool
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+# --- Async Engine ---
+def to_async_url(url: str) -> str:
+    """Map a sync DATABASE_URL onto its async driver (asyncpg / aiosqlite)"""
+    scheme, sep, rest = url.partition("://")
+    driver = {
+        "postgres": "postgresql+asyncpg",
+        "postgresql": "postgresql+asyncpg",
+        "postgresql+psycopg2": "postgresql+asyncpg",
+        "sqlite": "sqlite+aiosqlite",
+    }.get(scheme, scheme)
+    return f"{driver}{sep}{rest}"
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or (to_async_url(DATABASE_URL) if DATABASE_URL else None)
+
+def _build_async_engine():
+    # Imported here so the sync deployment doesn't need the async driver installed
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    if not ASYNC_DATABASE_URL:
+        raise ValueError("DATABASE_URL not found in .env")
+    built = create_async_engine(ASYNC_DATABASE_URL, **engine_options(ASYNC_DATABASE_URL, is_async=True))
+    metrics.instrument_engine(built.sync_engine)
+    return built
+
+def get_async_engine():
+    """The async engine, or None unless DB_MODE=async"""
+    return _lazy("async", _build_async_engine) if USE_ASYNC_DB else None
+
+def _build_async_sessionmaker():
+    from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+    return async_sessionmaker(get_async_engine(), class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+AsyncSessionLocal = LazySessionmaker(_build_async_sessionmaker)
+
+# Dependency to get an async DB session
+async def get_async_db():
+    if not USE_ASYNC_DB:
+        raise RuntimeError("Async database is disabled; set DB_MODE=async")
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# --- Read Replica ---
+# Optional streaming replica of DATABASE_URL for read-only routes; unset, every read goes to the primary
+REPLICA_DATABASE_URL = os.getenv("REPLICA_DATABASE_URL")
+
+ASYNC_REPLICA_DATABASE_URL = os.getenv("ASYNC_REPLICA_DATABASE_URL") or (
+    to_async_url(REPLICA_DATABASE_URL) if REPLICA_DATABASE_URL else None
+)
+
+# Seconds after a write during which the accounts it touched are read from the
+# primary; keep it above the replica's normal lag. Shared between workers when
+# CACHE_BACKEND is (like the user cache)
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+
+def _build_replica_engine():
+    built = create_engine(REPLICA_DATABASE_URL, **engine_options(REPLICA_DATABASE_URL, read_only=True))
+    metrics.instrument_engine(built)
+    return built
+
+def get_replica_engine():
+    """The replica engine, or None when REPLICA_DATABASE_URL is unset"""
+    return _lazy("replica", _build_replica_engine) if REPLICA_DATABASE_URL else None
+
+def _build_async_replica_engine():
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    built = create_async_engine(
+        ASYNC_REPLICA_DATABASE_URL, **engine_options(ASYNC_REPLICA_DATABASE_URL, is_async=True, read_only=True)
+    )
+    metrics.instrument_engine(built.sync_engine)
+    return built
+
+def get_async_replica_engine():
+    """The async replica engine, or None unless DB_MODE=async and a replica is configured"""
+    return _lazy("async_replica", _build_async_replica_engine) if USE_ASYNC_DB and REPLICA_DATABASE_URL else None
+
+def _build_async_replica_sessionmaker():
+    from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+    return async_sessionmaker(get_async_replica_engine(), class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+ReplicaSessionLocal = LazySessionmaker(lambda: sessionmaker(autocommit=False, autoflush=False, bind=get_replica_engine()))
+AsyncReplicaSessionLocal = LazySessionmaker(_build_async_replica_sessionmaker)
+
+# Usernames written in the last READ_YOUR_WRITES_SECONDS
+recent_writes = ReadThroughCache("wrote", create_backend(), ttl=READ_YOUR_WRITES_SECONDS)
+
+def note_writes(*usernames: str):
+    """Keep these accounts' reads on the primary until the replica has caught up with this write"""
+    if REPLICA_DATABASE_URL:
+        for username in usernames:
+            recent_writes.set(username, 1)
+
+def reads_from_replica(username: str = None) -> bool:
+    if not REPLICA_DATABASE_URL:
+        return False
+    return username is None or recent_writes.get(username) is None
+
+def read_sessionmaker(username: str = None):
+    """Session factory for a read about username: the replica, or the primary within its write window"""
+    return ReplicaSessionLocal if reads_from_replica(username) else SessionLocal
+
+def async_read_sessionmaker(username: str = None):
+    return AsyncReplicaSessionLocal if reads_from_replica(username) else AsyncSessionLocal
+
+# Read-only routes use these in place of get_db / get_async_db; the account is
+# the route's {username}, and routes without one always read from the replica
+def get_read_db(request: Request):
+    db = read_sessionmaker(request.path_params.get("username"))()
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def get_async_read_db(request: Request):
+    if not USE_ASYNC_DB:
+        raise RuntimeError("Async database is disabled; set DB_MODE=async")
+    async with async_read_sessionmaker(request.path_params.get("username"))() as db:
+        yield db
+
+def __getattr__(name: str):
+    # `from database import engine` keeps working; the engine is built on that first access
+    if name == "engine":
+        return get_engine()
+    if name == "async_engine":
+        return get_async_engine()
+    if name == "replica_engine":
+        return get_replica_engine()
+    if name == "async_replica_engine":
+        return get_async_replica_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# --- Pool Metrics ---
+def pool_stats(pool):
+    """Live occupancy plus cumulative checkout wait times for one pool"""
+    stats = {"status": pool.status()}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": pool.overflow(),
+        })
+    if isinstance(pool, _TimedCheckoutMixin):
+        with pool.checkout_stats_lock:
+            stats.update(pool.checkout_stats)
+    return stats
+
+def get_pool_stats():
+    """Stats for the engines built so far in this process"""
+    return {name: pool_stats(built.pool) for name, built in _engines.items()}
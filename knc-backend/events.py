@@ -0,0 +1,338 @@
+# events.py
+
+import asyncio
+import logging
+import os
+import threading
+from collections import defaultdict
+from datetime import datetime, timezone
+import orjson
+from fastapi.responses import StreamingResponse
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+from database import DATABASE_BACKEND
+from money import cents_to_float
+
+load_dotenv()
+
+# Where committed postings are announced to /auth/stream/{username}:
+# "memory" reaches only streams held by the worker that posted (enough for one
+# worker), "postgres" fans out to every worker with LISTEN/NOTIFY at the cost of
+# a pg_notify per posting and a LISTEN connection per worker, "none" turns
+# publishing off. Opt in to "postgres" when running more than one worker.
+EVENTS_BACKEND = os.getenv("EVENTS_BACKEND", "memory").lower()
+
+if EVENTS_BACKEND not in ("postgres", "memory", "none"):
+    raise ValueError("EVENTS_BACKEND must be 'postgres', 'memory' or 'none'")
+
+if EVENTS_BACKEND == "postgres" and DATABASE_BACKEND != "postgresql":
+    raise ValueError("EVENTS_BACKEND=postgres needs a PostgreSQL DATABASE_URL")
+
+# Seconds between keep-alive comments on an idle stream, so proxies don't drop it
+EVENT_HEARTBEAT_SECONDS = float(os.getenv("EVENT_HEARTBEAT_SECONDS", "15"))
+
+# Events queued per stream; a client that falls further behind is sent `resync` instead
+EVENT_CLIENT_BUFFER = int(os.getenv("EVENT_CLIENT_BUFFER", "64"))
+
+# Open streams allowed per worker before new ones get a retryable 503
+EVENT_MAX_STREAMS = int(os.getenv("EVENT_MAX_STREAMS", "10000"))
+
+# Seconds a rejected client is told to wait before reconnecting
+EVENT_RETRY_AFTER = int(os.getenv("EVENT_RETRY_AFTER", "5"))
+
+# Seconds before the LISTEN connection is reopened after it fails
+EVENT_LISTEN_RETRY_SECONDS = float(os.getenv("EVENT_LISTEN_RETRY_SECONDS", "2"))
+
+EVENTS_CHANNEL = "knc_events"
+
+# NOTIFY payloads must stay under 8000 bytes; larger batches are split across several
+NOTIFY_PAYLOAD_BYTES = 7000
+
+_PENDING = "knc_pending_events"
+
+log = logging.getLogger("knc.events")
+
+class StreamLimitReached(Exception):
+    """Raised when this worker already holds EVENT_MAX_STREAMS streams"""
+    retry_after = EVENT_RETRY_AFTER
+
+# --- Wire Format ---
+def sse_message(name: str, data) -> bytes:
+    return b"event: " + name.encode() + b"\ndata: " + orjson.dumps(data) + b"\n\n"
+
+# Reconnect delay for EventSource, then a comment so proxies flush the headers
+STREAM_PREAMBLE = b"retry: 3000\n: connected\n\n"
+HEARTBEAT = b": keep-alive\n\n"
+RESYNC = sse_message("resync", {})
+
+# --- Hub ---
+class EventHub:
+    """This worker's open streams, keyed by user id.
+
+    Lives on the event loop: each stream is a bounded asyncio.Queue of rendered
+    messages, so an idle stream costs a queue and a suspended coroutine, and one
+    timer sends every idle stream its heartbeat. A stream whose queue is full
+    loses what is queued and gets a single `resync` telling the client to
+    refetch balance and history.
+    """
+
+    def __init__(self, buffer: int = EVENT_CLIENT_BUFFER, max_streams: int = EVENT_MAX_STREAMS):
+        self.buffer = buffer
+        self.max_streams = max_streams
+        self._streams = defaultdict(set)
+        self._open = 0
+        self._open_lock = threading.Lock()
+        self._loop = None
+        self._stats = {"delivered": 0, "resyncs": 0, "rejected": 0}
+
+    def start(self, loop):
+        self._loop = loop
+
+    # --- Streams ---
+    def reserve(self):
+        """Take one of max_streams slots or raise StreamLimitReached.
+
+        The check and the count happen under one lock, so connects racing each
+        other can't all pass the check and overshoot the limit. The slot belongs
+        to the stream that follows and is given back when it ends; use
+        EventStreamResponse, which also covers a client gone before it starts.
+        """
+        with self._open_lock:
+            if self._open >= self.max_streams:
+                self._stats["rejected"] += 1
+                raise StreamLimitReached()
+            self._open += 1
+
+    def release(self):
+        with self._open_lock:
+            self._open -= 1
+
+    async def stream(self, user_id: int):
+        """Server-sent event bytes for one client, until it disconnects; call reserve() first"""
+        queue = asyncio.Queue(self.buffer)
+        self._streams[user_id].add(queue)
+        try:
+            yield STREAM_PREAMBLE
+            while True:
+                yield await queue.get()
+        finally:
+            self.release()
+            streams = self._streams[user_id]
+            streams.discard(queue)
+            if not streams:
+                del self._streams[user_id]
+
+    def _offer(self, queue, message: bytes):
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(RESYNC)
+            self._stats["resyncs"] += 1
+
+    # --- Delivery (event loop only) ---
+    def deliver(self, events):
+        """Queue [user_id, name, data] events on the streams of their users"""
+        for user_id, name, data in events:
+            queues = self._streams.get(user_id)
+            if not queues:
+                continue
+            message = sse_message(name, data)
+            for queue in queues:
+                self._offer(queue, message)
+            self._stats["delivered"] += len(queues)
+
+    def resync_all(self):
+        """After a gap in delivery (e.g. the LISTEN connection dropped) every client must refetch"""
+        for queues in self._streams.values():
+            for queue in queues:
+                self._offer(queue, RESYNC)
+
+    def is_watched(self, user_id: int) -> bool:
+        """Whether this worker holds a stream for user_id; safe to call from any thread"""
+        return user_id in self._streams
+
+    def deliver_threadsafe(self, events):
+        """deliver() from any thread, e.g. a sync handler that just committed"""
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self.deliver, events)
+
+    async def run_heartbeat(self, interval: float = EVENT_HEARTBEAT_SECONDS):
+        """One timer for the whole worker; streams with messages waiting don't need one"""
+        while True:
+            await asyncio.sleep(interval)
+            for queues in self._streams.values():
+                for queue in queues:
+                    if queue.empty():
+                        queue.put_nowait(HEARTBEAT)
+
+    def get_stats(self):
+        return {
+            "backend": EVENTS_BACKEND,
+            "open_streams": self._open,
+            "users": len(self._streams),
+            **self._stats,
+        }
+
+event_hub = EventHub()
+
+class EventStreamResponse(StreamingResponse):
+    """text/event-stream response holding one of the hub's stream slots.
+
+    The slot is taken when the response is built (StreamLimitReached becomes a
+    503 before any headers go out) and given back when the stream ends, or
+    after the response if the client left before the body was ever started,
+    where the stream's own cleanup never runs.
+    """
+
+    def __init__(self, hub: EventHub, user_id: int):
+        hub.reserve()
+        self._hub = hub
+        self._started = False
+        super().__init__(
+            self._messages(user_id),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    async def _messages(self, user_id: int):
+        self._started = True
+        async for message in self._hub.stream(user_id):
+            yield message
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if not self._started:
+                self._hub.release()
+
+# --- Publishing ---
+def _transaction_item(row, timestamp: str):
+    """A transaction_row in the shape of a history item (TransactionItem)"""
+    return {
+        "reference_number": row["reference_number"],
+        "type": row["transaction_type"],
+        "amount": cents_to_float(row["amount_cents"]),
+        "description": row["description"],
+        "timestamp": timestamp,
+        "recipient": row["recipient_username"],
+        "sender": row["sender_username"],
+        "company": row["bill_company"],
+        "notes": row["notes"],
+    }
+
+def queue_postings(db, balances, rows=()):
+    """Announce postings made in db's current transaction to their account holders' streams.
+
+    balances is {user_id: balance_cents} after the postings and rows are the
+    transaction_row dicts written. Nothing is sent unless the transaction
+    commits: with the postgres backend every event rides in pg_notify calls
+    inside it, otherwise they reach this worker's hub after the commit.
+    """
+    if EVENTS_BACKEND == "none":
+        return
+    if EVENTS_BACKEND == "memory":
+        # Only this worker's streams can hear it, so skip users nobody here is watching
+        rows = [row for row in rows if event_hub.is_watched(row["user_id"])]
+        balances = {user_id: balance for user_id, balance in balances.items() if event_hub.is_watched(user_id)}
+        if not rows and not balances:
+            return
+    timestamp = datetime.now(timezone.utc).isoformat()
+    pending = db.info.setdefault(_PENDING, [])
+    pending.extend([row["user_id"], "transaction", _transaction_item(row, timestamp)] for row in rows)
+    pending.extend([user_id, "balance", {"balance": cents_to_float(balance)}] for user_id, balance in balances.items())
+
+def _notify_payloads(events):
+    """JSON arrays of events, each under NOTIFY_PAYLOAD_BYTES"""
+    payloads, chunk, size = [], [], 2
+    for item in events:
+        encoded = orjson.dumps(item)
+        if len(encoded) + 2 > NOTIFY_PAYLOAD_BYTES:
+            # Too big to send (very long notes): the client refetches instead
+            encoded = orjson.dumps([item[0], "resync", {}])
+        if chunk and size + len(encoded) + 1 > NOTIFY_PAYLOAD_BYTES:
+            payloads.append(b"[" + b",".join(chunk) + b"]")
+            chunk, size = [], 2
+        chunk.append(encoded)
+        size += len(encoded) + 1
+    if chunk:
+        payloads.append(b"[" + b",".join(chunk) + b"]")
+    return [payload.decode() for payload in payloads]
+
+# AsyncSession commits through its sync Session, so these hooks cover both modes
+@event.listens_for(Session, "before_commit")
+def _notify_before_commit(session):
+    pending = session.info.get(_PENDING)
+    if pending and EVENTS_BACKEND == "postgres":
+        # Postgres delivers these at commit, and drops them if the transaction rolls back
+        session.info.pop(_PENDING)
+        session.execute(select(*(func.pg_notify(EVENTS_CHANNEL, p) for p in _notify_payloads(pending))))
+
+@event.listens_for(Session, "after_commit")
+def _deliver_after_commit(session):
+    pending = session.info.pop(_PENDING, None)
+    if pending:
+        event_hub.deliver_threadsafe(pending)
+
+@event.listens_for(Session, "after_transaction_end")
+def _discard_uncommitted(session, transaction):
+    if transaction.parent is None:
+        session.info.pop(_PENDING, None)
+
+# --- Postgres Fan-out ---
+def _listen_connection(engine):
+    """A dedicated autocommit DBAPI connection (outside the pool) listening on EVENTS_CHANNEL"""
+    if engine.dialect.driver != "psycopg2":
+        raise RuntimeError("EVENTS_BACKEND=postgres listens with psycopg2 (pip install psycopg2-binary)")
+    cargs, cparams = engine.dialect.create_connect_args(engine.url)
+    # TCP keepalives notice a dead server even though this connection never sends anything
+    cparams.setdefault("keepalives", 1)
+    cparams.setdefault("keepalives_idle", 30)
+    connection = engine.dialect.loaded_dbapi.connect(*cargs, **cparams)
+    connection.autocommit = True
+    with connection.cursor() as cursor:
+        cursor.execute(f"LISTEN {EVENTS_CHANNEL}")
+    return connection
+
+async def _drain_notifications(connection, hub: EventHub):
+    loop = asyncio.get_running_loop()
+    readable = asyncio.Event()
+    fd = connection.fileno()
+    loop.add_reader(fd, readable.set)
+    try:
+        while True:
+            await readable.wait()
+            readable.clear()
+            connection.poll()
+            while connection.notifies:
+                hub.deliver(orjson.loads(connection.notifies.pop(0).payload))
+    finally:
+        loop.remove_reader(fd)
+
+async def run_listener(engine, hub: EventHub = None):
+    """Background task started by the app lifespan: NOTIFY payloads from every worker
+    (this one included) go to this worker's streams. Reading is driven by the
+    event loop, so the listener holds no thread and no pooled connection."""
+    hub = hub or event_hub
+    connected_before = False
+    while True:
+        connection = None
+        try:
+            connection = await asyncio.to_thread(_listen_connection, engine)
+            if connected_before:
+                hub.resync_all()
+            connected_before = True
+            await _drain_notifications(connection, hub)
+        except Exception:
+            log.exception("Event listener failed; reconnecting")
+        finally:
+            if connection is not None:
+                connection.close()
+        await asyncio.sleep(EVENT_LISTEN_RETRY_SECONDS)
+
+def get_stats():
+    return event_hub.get_stats()
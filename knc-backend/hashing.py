@@ -0,0 +1,114 @@
+# hashing.py
+
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+import bcrypt
+from dotenv import load_dotenv
+import metrics
+
+load_dotenv()
+
+# bcrypt cost factor for new hashes; existing hashes keep the cost they were made with
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# Worker processes for hashing (0 hashes inline on the calling thread)
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(os.cpu_count() or 1)))
+
+# Jobs allowed to wait for a free worker before new ones are rejected
+HASH_QUEUE_SIZE = int(os.getenv("HASH_QUEUE_SIZE", str(max(HASH_WORKERS, 1) * 4)))
+
+# Seconds a rejected client is told to wait before retrying
+HASH_RETRY_AFTER = int(os.getenv("HASH_RETRY_AFTER", "1"))
+
+class HashingBusy(Exception):
+    """Raised when the hashing queue is full"""
+    retry_after = HASH_RETRY_AFTER
+
+_executor = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(max(HASH_WORKERS, 1) + HASH_QUEUE_SIZE)
+
+_stats_lock = threading.Lock()
+_stats = {
+    "jobs": 0,
+    "rejected": 0,
+    "in_flight": 0,
+    "queue_wait_seconds_total": 0.0,
+    "queue_wait_seconds_max": 0.0,
+    "hash_seconds_total": 0.0,
+    "hash_seconds_max": 0.0,
+}
+
+# --- Worker Functions (run in the pool) ---
+def _hash_job(pin: bytes, rounds: int, submitted_at: float):
+    started_at = time.time()
+    hashed = bcrypt.hashpw(pin, bcrypt.gensalt(rounds=rounds))
+    return hashed, started_at - submitted_at, time.time() - started_at
+
+def _check_job(pin: bytes, hashed: bytes, submitted_at: float):
+    started_at = time.time()
+    matches = bcrypt.checkpw(pin, hashed)
+    return matches, started_at - submitted_at, time.time() - started_at
+
+# --- Pool Management ---
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ProcessPoolExecutor(max_workers=HASH_WORKERS)
+    return _executor
+
+def shutdown():
+    """Stop the worker processes (called on app shutdown)"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True, cancel_futures=True)
+            _executor = None
+
+def _record(queue_wait: float, hash_time: float):
+    with _stats_lock:
+        _stats["jobs"] += 1
+        _stats["queue_wait_seconds_total"] += queue_wait
+        _stats["queue_wait_seconds_max"] = max(_stats["queue_wait_seconds_max"], queue_wait)
+        _stats["hash_seconds_total"] += hash_time
+        _stats["hash_seconds_max"] = max(_stats["hash_seconds_max"], hash_time)
+
+def _run(job, *args):
+    if not _slots.acquire(blocking=False):
+        with _stats_lock:
+            _stats["rejected"] += 1
+        raise HashingBusy()
+
+    with _stats_lock:
+        _stats["in_flight"] += 1
+    started = time.perf_counter()
+    try:
+        if HASH_WORKERS <= 0:
+            result, queue_wait, hash_time = job(*args, time.time())
+        else:
+            result, queue_wait, hash_time = _get_executor().submit(job, *args, time.time()).result()
+        _record(max(queue_wait, 0.0), hash_time)
+        return result
+    finally:
+        metrics.observe_bcrypt(time.perf_counter() - started)
+        with _stats_lock:
+            _stats["in_flight"] -= 1
+        _slots.release()
+
+# --- Public API ---
+def hash_pin(pin: str) -> str:
+    """Hash a PIN with bcrypt in the worker pool"""
+    return _run(_hash_job, pin.encode('utf-8'), BCRYPT_ROUNDS).decode('utf-8')
+
+def verify_pin(pin: str, hashed_pin: str) -> bool:
+    """Check a PIN against its bcrypt hash in the worker pool"""
+    return _run(_check_job, pin.encode('utf-8'), hashed_pin.encode('utf-8'))
+
+def get_stats():
+    """Snapshot of hashing counters and timings"""
+    with _stats_lock:
+        return dict(_stats)
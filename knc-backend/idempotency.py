@@ -0,0 +1,163 @@
+# idempotency.py
+
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from typing import NamedTuple, Optional
+from fastapi import HTTPException
+from sqlalchemy import delete, exists, func, literal, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from dotenv import load_dotenv
+from database import DATABASE_BACKEND
+from models import IdempotencyKey
+from money import from_cents
+
+load_dotenv()
+
+# How long a completed request can be replayed by its Idempotency-Key
+IDEMPOTENCY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+
+MAX_KEY_LENGTH = 255
+
+# A key is claimed by the same statement that posts the balance (a data-modifying
+# CTE), so the happy path costs no extra round-trip. A concurrent duplicate blocks
+# on the unique index until the first request commits, then sees the conflict and
+# replays the stored response: Postgres itself is the single-flight lock.
+#
+# Other databases (SQLite in development) have no data-modifying CTEs: the claim is
+# inserted right after the posting, in the same transaction, and a conflict rolls
+# the posting back the same way.
+CLAIM_IN_POSTING = DATABASE_BACKEND == "postgresql"
+
+class DuplicateRequest(Exception):
+    """The Idempotency-Key was already used by a committed request"""
+
+class Claim(NamedTuple):
+    key: str
+    request_hash: str
+    message: str
+    transaction_id: str
+    expires_at: datetime
+
+def request_hash(endpoint: str, payload) -> str:
+    body = json.dumps(payload.model_dump(mode="json"), sort_keys=True, default=str)
+    return hashlib.sha256(f"{endpoint}\n{body}".encode('utf-8')).hexdigest()
+
+def make_claim(key: Optional[str], endpoint: str, payload, message: str, transaction_id: str):
+    """Claim to attach to the posting, or None when the client sent no key"""
+    if key is None:
+        return None
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail="Invalid Idempotency-Key")
+    return Claim(
+        key=key,
+        request_hash=request_hash(endpoint, payload),
+        message=message,
+        transaction_id=transaction_id,
+        expires_at=datetime.now(timezone.utc) + timedelta(hours=IDEMPOTENCY_TTL_HOURS),
+    )
+
+# --- Statements ---
+def claiming(posting, claim: Claim):
+    """Wrap a balance UPDATE ... RETURNING id, balance_cents so it also records the claim.
+
+    The result has the posting's id and balance_cents plus a "claimed" flag that is
+    false when a live row for the key already exists. Expired rows are taken over.
+    """
+    posted = posting.cte("posted")
+    values = select(
+        literal(claim.key),
+        literal(claim.request_hash),
+        literal(claim.message),
+        posted.c.balance_cents,
+        literal(claim.transaction_id),
+        literal(claim.expires_at),
+    )
+    columns = ["key", "request_hash", "message", "new_balance_cents", "transaction_id", "expires_at"]
+    insert_claim = pg_insert(IdempotencyKey).from_select(columns, values)
+    insert_claim = insert_claim.on_conflict_do_update(
+        index_elements=[IdempotencyKey.key],
+        set_={column: insert_claim.excluded[column] for column in columns},
+        where=IdempotencyKey.expires_at < func.now(),
+    ).returning(IdempotencyKey.key)
+    claimed = insert_claim.cte("claimed")
+    return select(
+        posted.c.id,
+        posted.c.balance_cents,
+        exists(select(claimed.c.key)).label("claimed"),
+    )
+
+def stored_statement(key: str):
+    return select(IdempotencyKey).where(
+        IdempotencyKey.key == key,
+        IdempotencyKey.expires_at >= func.now(),
+    )
+
+def live_key_statement(key: str):
+    return select(IdempotencyKey.key).where(
+        IdempotencyKey.key == key,
+        IdempotencyKey.expires_at >= func.now(),
+    )
+
+def live_keys_statement(keys):
+    return select(IdempotencyKey.key).where(
+        IdempotencyKey.key.in_(keys),
+        IdempotencyKey.expires_at >= func.now(),
+    )
+
+def record_claims_statement(rows):
+    """Insert many claims at once (rows are IdempotencyKey column dicts); returns the keys actually claimed"""
+    dialect_insert = pg_insert if DATABASE_BACKEND == "postgresql" else sqlite_insert
+    statement = dialect_insert(IdempotencyKey).values(rows)
+    return statement.on_conflict_do_update(
+        index_elements=[IdempotencyKey.key],
+        set_={column: statement.excluded[column] for column in rows[0]},
+        where=IdempotencyKey.expires_at < func.now(),
+    ).returning(IdempotencyKey.key)
+
+def claim_row(claim: Claim, new_balance_cents: int):
+    return {
+        "key": claim.key,
+        "request_hash": claim.request_hash,
+        "message": claim.message,
+        "new_balance_cents": new_balance_cents,
+        "transaction_id": claim.transaction_id,
+        "expires_at": claim.expires_at,
+    }
+
+# --- Replay ---
+def replay_response(stored, claim: Claim):
+    """TransactionResponse fields for a replayed request"""
+    if stored is None:
+        # The original request rolled back after we saw its claim; the client can retry safely
+        raise HTTPException(status_code=409, detail="Request with this Idempotency-Key did not complete. Please retry.")
+    if stored.request_hash != claim.request_hash:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+    return {
+        "message": stored.message,
+        "new_balance": from_cents(stored.new_balance_cents),
+        "transaction_id": stored.transaction_id
+    }
+
+def replay(db, claim: Claim):
+    """Stored response for a duplicate request (call after rolling back)"""
+    return replay_response(db.execute(stored_statement(claim.key)).scalars().first(), claim)
+
+async def replay_async(db, claim: Claim):
+    return replay_response((await db.execute(stored_statement(claim.key))).scalars().first(), claim)
+
+# --- Expiry ---
+def purge_expired(db, chunk_size: int = 10000):
+    """Delete expired keys in chunks; returns how many were removed"""
+    total = 0
+    while True:
+        expired = select(IdempotencyKey.key).where(
+            IdempotencyKey.expires_at < func.now()
+        ).limit(chunk_size).scalar_subquery()
+        removed = db.execute(delete(IdempotencyKey).where(IdempotencyKey.key.in_(expired))).rowcount
+        db.commit()
+        total += removed
+        if removed < chunk_size:
+            return total
@@ -0,0 +1,254 @@
+# journal.py
+
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import NamedTuple, Optional
+from sqlalchemy import insert
+from dotenv import load_dotenv
+from database import SessionLocal
+from models import Transaction
+import events
+import idempotency
+import ledger
+
+load_dotenv()
+
+# Opt-in: post deposits, withdrawals, transfers and bill payments through the group-commit writer
+POSTING_JOURNAL = os.getenv("POSTING_JOURNAL", "false").lower() in ("1", "true", "yes")
+
+# Postings committed together at most
+JOURNAL_MAX_BATCH = int(os.getenv("JOURNAL_MAX_BATCH", "256"))
+
+# Milliseconds the writer waits for more postings after the first one arrives
+JOURNAL_MAX_DELAY_MS = float(os.getenv("JOURNAL_MAX_DELAY_MS", "2"))
+
+# Postings allowed to wait for the writer before new ones are rejected
+JOURNAL_QUEUE_SIZE = int(os.getenv("JOURNAL_QUEUE_SIZE", "10000"))
+
+# Seconds a rejected client is told to wait before retrying
+JOURNAL_RETRY_AFTER = int(os.getenv("JOURNAL_RETRY_AFTER", "1"))
+
+log = logging.getLogger("knc.journal")
+
+# One writer thread per worker process turns many requests into one commit: it
+# locks every account in a batch with a single SELECT ... FOR UPDATE in
+# lock_order, applies the postings in memory (a posting that fails its checks
+# is simply left out), then writes balances, transactions and idempotency keys
+# with one executemany each. Requests are answered only after that commit, so
+# the durability promise is the same as a commit per request.
+
+class JournalBusy(Exception):
+    """Raised when the journal queue is full"""
+    retry_after = JOURNAL_RETRY_AFTER
+
+class Entry(NamedTuple):
+    """A Transaction row for username's account; user_id is filled in by the writer"""
+    username: str
+    row: dict
+
+class Posting(NamedTuple):
+    """Take amount_cents from debit and/or give it to credit, and write entries"""
+    amount_cents: int
+    entries: tuple
+    debit: Optional[str] = None
+    credit: Optional[str] = None
+    claim: Optional[idempotency.Claim] = None
+
+class _ClaimRace(Exception):
+    """Another process claimed some of the batch's idempotency keys after they were checked"""
+
+    def __init__(self, keys):
+        super().__init__(f"{len(keys)} idempotency keys claimed concurrently")
+        self.keys = keys
+
+# --- Batch Posting ---
+def _post(posting: Posting, accounts, balances, duplicates):
+    """Apply one posting to the in-memory balances; returns (user_id, new_balance) like ledger.debit/credit"""
+    if posting.claim is not None and posting.claim.key in duplicates:
+        raise idempotency.DuplicateRequest()
+    for username in ledger.lock_order(*(u for u in (posting.debit, posting.credit) if u)):
+        if username not in accounts:
+            raise ledger.AccountNotFound(username)
+        if username == posting.debit and balances[username] < posting.amount_cents:
+            raise ledger.InsufficientFunds(username)
+    if posting.debit:
+        balances[posting.debit] -= posting.amount_cents
+    if posting.credit:
+        balances[posting.credit] += posting.amount_cents
+    if posting.claim is not None:
+        duplicates.add(posting.claim.key)
+    replied = posting.debit or posting.credit
+    return accounts[replied][0], balances[replied]
+
+def apply_batch(db, postings, raced=frozenset()):
+    """Post a batch in the current transaction; returns one result or exception per posting.
+
+    The caller commits. Raises _ClaimRace if an idempotency key was claimed by
+    someone else between the check and the insert.
+    """
+    usernames = {u for p in postings for u in (p.debit, p.credit) if u}
+    accounts = ledger.lock_accounts(db, usernames)
+    balances = {username: balance for username, (_, balance) in accounts.items()}
+    keys = [p.claim.key for p in postings if p.claim is not None]
+    duplicates = set(raced)
+    if keys:
+        duplicates.update(db.execute(idempotency.live_keys_statement(keys)).scalars())
+
+    results, rows, claims = [], [], []
+    for posting in postings:
+        try:
+            result = _post(posting, accounts, balances, duplicates)
+        except (ledger.LedgerError, idempotency.DuplicateRequest) as e:
+            results.append(e)
+            continue
+        results.append(result)
+        rows.extend({**entry.row, "user_id": accounts[entry.username][0]} for entry in posting.entries)
+        if posting.claim is not None:
+            claims.append(idempotency.claim_row(posting.claim, result[1]))
+
+    changed = {
+        accounts[username][0]: balance
+        for username, balance in balances.items() if balance != accounts[username][1]
+    }
+    ledger.set_balances(db, changed)
+    if rows:
+        # Core table insert: one executemany for the batch (the ORM bulk path splits rows by NULL columns)
+        db.execute(insert(Transaction.__table__), rows)
+        events.queue_postings(db, changed, rows)
+    if claims:
+        claimed = set(db.execute(idempotency.record_claims_statement(claims)).scalars())
+        lost = {row["key"] for row in claims} - claimed
+        if lost:
+            raise _ClaimRace(lost)
+    return results
+
+# --- Writer ---
+class PostingJournal:
+    """Queue of postings drained by one writer thread in group commits"""
+
+    def __init__(self, session_factory, max_batch: int = JOURNAL_MAX_BATCH,
+                 max_delay: float = JOURNAL_MAX_DELAY_MS / 1000, queue_size: int = JOURNAL_QUEUE_SIZE):
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "batches": 0,
+            "postings": 0,
+            "rejected": 0,
+            "failed_batches": 0,
+            "largest_batch": 0,
+            "commit_seconds_total": 0.0,
+        }
+
+    def start(self):
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="posting-journal", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        """Flush what is queued and stop the writer (called on app shutdown)"""
+        with self._thread_lock:
+            if self._thread is not None:
+                self._queue.put(None)
+                self._thread.join()
+                self._thread = None
+
+    def submit(self, posting: Posting) -> Future:
+        self.start()
+        future = Future()
+        try:
+            self._queue.put_nowait((posting, future))
+        except queue.Full:
+            with self._stats_lock:
+                self._stats["rejected"] += 1
+            raise JournalBusy()
+        return future
+
+    def post(self, posting: Posting):
+        """Post and wait for the commit; returns (user_id, new_balance) or raises what ledger would"""
+        return self.submit(posting).result()
+
+    async def post_async(self, posting: Posting):
+        return await asyncio.wrap_future(self.submit(posting))
+
+    def _collect(self):
+        """Block for the first posting, then take more until the batch is full or max_delay passes"""
+        first = self._queue.get()
+        if first is None:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = self._collect()
+            if batch:
+                self._flush(batch)
+
+    def _commit(self, postings):
+        raced = set()
+        with self.session_factory() as db:
+            while True:
+                try:
+                    results = apply_batch(db, postings, raced)
+                    db.commit()
+                    return results
+                except _ClaimRace as race:
+                    db.rollback()
+                    raced |= race.keys
+
+    def _flush(self, batch):
+        started = time.perf_counter()
+        try:
+            results = self._commit([posting for posting, _ in batch])
+        except Exception as e:
+            with self._stats_lock:
+                self._stats["failed_batches"] += 1
+            if len(batch) > 1:
+                # Don't let one bad posting fail its neighbours: retry each on its own
+                log.warning("Journal batch of %d failed (%s); posting individually", len(batch), e)
+                for item in batch:
+                    self._flush([item])
+            else:
+                batch[0][1].set_exception(e)
+            return
+
+        elapsed = time.perf_counter() - started
+        with self._stats_lock:
+            self._stats["batches"] += 1
+            self._stats["postings"] += len(batch)
+            self._stats["largest_batch"] = max(self._stats["largest_batch"], len(batch))
+            self._stats["commit_seconds_total"] += elapsed
+        for (_, future), result in zip(batch, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def get_stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["pending"] = self._queue.qsize()
+        return stats
+
+posting_journal = PostingJournal(SessionLocal)
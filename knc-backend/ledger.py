@@ -0,0 +1,203 @@
+# ledger.py
+
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.orm import Session
+from models import User
+import idempotency
+
+# Balance postings done as single guarded UPDATE ... RETURNING statements, so each
+# account costs one round-trip and the row lock is held only until commit.
+# Amounts and balances are integer centavos (see money.py).
+
+class LedgerError(Exception):
+    """Base class for posting failures"""
+
+class AccountNotFound(LedgerError):
+    def __init__(self, username: str):
+        super().__init__(f"Account {username} not found")
+        self.username = username
+
+class InsufficientFunds(LedgerError):
+    def __init__(self, username: str):
+        super().__init__(f"Insufficient funds in {username}")
+        self.username = username
+
+# --- Statements ---
+def credit_statement(username: str, amount: int):
+    return (
+        update(User)
+        .where(User.username == username)
+        .values(balance_cents=User.balance_cents + amount)
+        .returning(User.id, User.balance_cents)
+        .execution_options(synchronize_session=False)
+    )
+
+def debit_statement(username: str, amount: int):
+    return (
+        update(User)
+        .where(User.username == username, User.balance_cents >= amount)
+        .values(balance_cents=User.balance_cents - amount)
+        .returning(User.id, User.balance_cents)
+        .execution_options(synchronize_session=False)
+    )
+
+def exists_statement(username: str):
+    return select(User.id).where(User.username == username)
+
+def lock_accounts_statement(usernames):
+    """Resolve and lock a set of accounts in one round-trip, in lock_order"""
+    return (
+        select(User.id, User.username, User.balance_cents)
+        .where(User.username.in_(set(usernames)))
+        .order_by(User.username)
+        .with_for_update()
+    )
+
+def credit_many_statement():
+    """Executemany form of a credit; parameters are {"credit_username", "credit_amount"}"""
+    users = User.__table__
+    return (
+        update(users)
+        .where(users.c.username == bindparam("credit_username"))
+        .values(balance_cents=users.c.balance_cents + bindparam("credit_amount"))
+    )
+
+def set_balances_statement():
+    """Executemany form of a balance overwrite; parameters are {"account_id", "new_balance"}.
+
+    Only safe on rows the caller has already locked and read in this transaction.
+    """
+    users = User.__table__
+    return (
+        update(users)
+        .where(users.c.id == bindparam("account_id"))
+        .values(balance_cents=bindparam("new_balance"))
+    )
+
+def lock_order(*usernames: str):
+    """Order in which accounts are posted so concurrent transfers never deadlock"""
+    return sorted(set(usernames))
+
+# --- Sync Postings ---
+def _with_claim(statement, claim):
+    if claim is None or not idempotency.CLAIM_IN_POSTING:
+        return statement
+    return idempotency.claiming(statement, claim)
+
+def _separate_claim(row, claim):
+    """Claim insert for a posting that couldn't carry it (see idempotency.CLAIM_IN_POSTING), else None"""
+    if idempotency.CLAIM_IN_POSTING:
+        return None
+    return idempotency.record_claims_statement([idempotency.claim_row(claim, row.balance_cents)])
+
+def _check_claim(db: Session, row, claim):
+    if claim is None:
+        return
+    claim_statement = _separate_claim(row, claim)
+    claimed = row.claimed if claim_statement is None else db.execute(claim_statement).first() is not None
+    if not claimed:
+        raise idempotency.DuplicateRequest()
+
+def credit(db: Session, username: str, amount: int, claim=None):
+    """Add amount to an account; returns (user_id, new_balance).
+
+    With an idempotency claim the key is recorded in the same statement, and
+    DuplicateRequest is raised if it was already used.
+    """
+    row = db.execute(_with_claim(credit_statement(username, amount), claim)).first()
+    if row is None:
+        raise AccountNotFound(username)
+    _check_claim(db, row, claim)
+    return row.id, row.balance_cents
+
+def debit(db: Session, username: str, amount: int, claim=None):
+    """Take amount from an account if it can cover it; returns (user_id, new_balance)"""
+    row = db.execute(_with_claim(debit_statement(username, amount), claim)).first()
+    if row is None:
+        # Only the failure path pays for telling "missing" apart from "short",
+        # or from a retry whose original already spent the funds
+        if claim is not None and db.execute(idempotency.live_key_statement(claim.key)).first():
+            raise idempotency.DuplicateRequest()
+        if db.execute(exists_statement(username)).first() is None:
+            raise AccountNotFound(username)
+        raise InsufficientFunds(username)
+    _check_claim(db, row, claim)
+    return row.id, row.balance_cents
+
+def transfer(db: Session, sender_username: str, recipient_username: str, amount: int, claim=None):
+    """Move amount between accounts, locking rows in lock_order; returns {username: (user_id, new_balance)}"""
+    postings = {}
+    for username in lock_order(sender_username, recipient_username):
+        if username == sender_username:
+            postings[username] = debit(db, username, amount, claim=claim)
+        else:
+            postings[username] = credit(db, username, amount)
+    return postings
+
+def lock_accounts(db: Session, usernames):
+    """{username: (user_id, balance)} for the accounts that exist, locked until commit"""
+    rows = db.execute(lock_accounts_statement(usernames)).all()
+    return {row.username: (row.id, row.balance_cents) for row in rows}
+
+def credit_many(db: Session, credits):
+    """Apply {username: amount} credits in one executemany; accounts must already be locked"""
+    if credits:
+        db.execute(credit_many_statement(), [
+            {"credit_username": username, "credit_amount": amount}
+            for username, amount in credits.items()
+        ])
+
+def set_balances(db: Session, balances):
+    """Write {user_id: balance} for accounts locked with lock_accounts"""
+    if balances:
+        db.execute(set_balances_statement(), [
+            {"account_id": user_id, "new_balance": balance}
+            for user_id, balance in balances.items()
+        ])
+
+# --- Async Postings ---
+async def _check_claim_async(db, row, claim):
+    if claim is None:
+        return
+    claim_statement = _separate_claim(row, claim)
+    claimed = row.claimed if claim_statement is None else (await db.execute(claim_statement)).first() is not None
+    if not claimed:
+        raise idempotency.DuplicateRequest()
+
+async def credit_async(db, username: str, amount: int, claim=None):
+    row = (await db.execute(_with_claim(credit_statement(username, amount), claim))).first()
+    if row is None:
+        raise AccountNotFound(username)
+    await _check_claim_async(db, row, claim)
+    return row.id, row.balance_cents
+
+async def debit_async(db, username: str, amount: int, claim=None):
+    row = (await db.execute(_with_claim(debit_statement(username, amount), claim))).first()
+    if row is None:
+        if claim is not None and (await db.execute(idempotency.live_key_statement(claim.key))).first():
+            raise idempotency.DuplicateRequest()
+        if (await db.execute(exists_statement(username))).first() is None:
+            raise AccountNotFound(username)
+        raise InsufficientFunds(username)
+    await _check_claim_async(db, row, claim)
+    return row.id, row.balance_cents
+
+async def transfer_async(db, sender_username: str, recipient_username: str, amount: int, claim=None):
+    postings = {}
+    for username in lock_order(sender_username, recipient_username):
+        if username == sender_username:
+            postings[username] = await debit_async(db, username, amount, claim=claim)
+        else:
+            postings[username] = await credit_async(db, username, amount)
+    return postings
+
+async def lock_accounts_async(db, usernames):
+    rows = (await db.execute(lock_accounts_statement(usernames))).all()
+    return {row.username: (row.id, row.balance_cents) for row in rows}
+
+async def credit_many_async(db, credits):
+    if credits:
+        await db.execute(credit_many_statement(), [
+            {"credit_username": username, "credit_amount": amount}
+            for username, amount in credits.items()
+        ])
@@ -1,14 +1,69 @@
 #main.py
 
-from fastapi import FastAPI
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from auth import router as auth_router
-from database import Base, engine
+from fastapi.responses import JSONResponse, Response
+from auth import router as auth_router, money_router as sync_money_router
+from auth_async import router as async_money_router
+from sqlalchemy import text
+from database import DATABASE_BACKEND, SessionLocal, USE_ASYNC_DB, get_engine, get_pool_stats, recent_writes
+from cache import user_cache
+from company_cache import company_directory
+import events
+import hashing
+import journal
+import metrics
+import migrations
+import partitions
+import ratelimit
+import reference
+import summaries
 
-# Create tables if they don't exist
-Base.metadata.create_all(bind=engine)
+# Startup does no database work: the schema is managed by scripts/migrate.py, and
+# caches (like the company directory) fill on first use or from /health/ready
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Lease this worker's reference worker ID before the first posting needs it
+    reference.get_generator()
+    lease_keeper = None
+    if DATABASE_BACKEND == "postgresql":
+        lease_keeper = asyncio.create_task(reference.run_lease_keeper())
 
-app = FastAPI()
+    if migrations.MIGRATE_ON_STARTUP:
+        await asyncio.to_thread(migrations.upgrade)
+
+    # Daily summaries are maintained with Postgres upserts
+    refresher = None
+    if summaries.SUMMARY_REFRESH_SECONDS > 0 and DATABASE_BACKEND == "postgresql":
+        refresher = asyncio.create_task(summaries.run_refresher(SessionLocal))
+
+    # Keeps monthly transaction partitions created ahead of time (no-op until the table is partitioned)
+    maintainer = None
+    if partitions.PARTITION_MAINTENANCE_SECONDS > 0 and DATABASE_BACKEND == "postgresql":
+        maintainer = asyncio.create_task(partitions.run_maintainer(get_engine()))
+
+    # Live event streams: one heartbeat timer, plus the LISTEN connection that fans events in from every worker
+    events.event_hub.start(asyncio.get_running_loop())
+    heartbeat = asyncio.create_task(events.event_hub.run_heartbeat())
+    listener = None
+    if events.EVENTS_BACKEND == "postgres":
+        listener = asyncio.create_task(events.run_listener(get_engine()))
+    yield
+    if refresher is not None:
+        refresher.cancel()
+    if maintainer is not None:
+        maintainer.cancel()
+    heartbeat.cancel()
+    if lease_keeper is not None:
+        lease_keeper.cancel()
+    if listener is not None:
+        listener.cancel()
+    journal.posting_journal.stop()
+    hashing.shutdown()
+
+app = FastAPI(lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -17,11 +72,150 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
+# Outermost, so latency covers CORS handling and the full response body
+app.add_middleware(metrics.MetricsMiddleware)
+
+# Shed login/signup load with a retryable 503 when the hashing pool is saturated
+@app.exception_handler(hashing.HashingBusy)
+def hashing_busy_handler(request: Request, exc: hashing.HashingBusy):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Server is busy. Please try again shortly."},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+# Same for money movements when the posting journal's queue is full
+@app.exception_handler(journal.JournalBusy)
+def journal_busy_handler(request: Request, exc: journal.JournalBusy):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Server is busy. Please try again shortly."},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+# Requests over a rate limit window (logins, user searches) get a retryable 429
+@app.exception_handler(ratelimit.RateLimited)
+def rate_limited_handler(request: Request, exc: ratelimit.RateLimited):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": exc.detail},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+# A worker already holding EVENT_MAX_STREAMS event streams turns new ones away
+@app.exception_handler(events.StreamLimitReached)
+def stream_limit_handler(request: Request, exc: events.StreamLimitReached):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Too many open streams. Please try again shortly."},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
 # Include auth routes
 app.include_router(auth_router, prefix="/auth", tags=["auth"])
 
+# Balance and money-movement routes run sync or async depending on DB_MODE
+money_router = async_money_router if USE_ASYNC_DB else sync_money_router
+app.include_router(money_router, prefix="/auth", tags=["auth"])
+
 @app.get("/")
 def root():
     return {"message": "KNC Bank API is running"}
+
+# --- Health ---
+@app.get("/health/ready")
+def readiness():
+    """200 once the database answers and the schema is at the latest migration; 503 until then.
+
+    Also warms the company directory, so the first bill payment after a deploy
+    doesn't pay for loading it.
+    """
+    try:
+        with SessionLocal() as db:
+            db.execute(text("SELECT 1"))
+            if not migrations.schema_is_current(db.connection()):
+                return JSONResponse(status_code=503, content={"status": "pending_migrations"})
+            company_directory.ensure_fresh(db)
+    except Exception:
+        return JSONResponse(status_code=503, content={"status": "database_unavailable"})
+    return {"status": "ready"}
+
+@app.get("/metrics/hashing")
+def hashing_metrics():
+    return hashing.get_stats()
+
+@app.get("/metrics/pool")
+def pool_metrics():
+    return get_pool_stats()
+
+@app.get("/metrics/journal")
+def journal_metrics():
+    return journal.posting_journal.get_stats()
+
+@app.get("/metrics/ratelimit")
+def ratelimit_metrics():
+    return ratelimit.get_stats()
+
+@app.get("/metrics/events")
+def events_metrics():
+    return events.get_stats()
+
+@app.get("/metrics/cache")
+def cache_metrics():
+    # read_your_writes hits are reads kept on the primary after a write, misses went to the replica
+    return {"user": user_cache.get_stats(), "read_your_writes": recent_writes.get_stats()}
+
+# --- Prometheus Exposition ---
+def _stats_samples(name, documentation, metric_type, stats_by_label, label, key):
+    return metrics.render_samples(name, documentation, metric_type, [
+        ({label: value}, stats[key]) for value, stats in stats_by_label.items() if key in stats
+    ])
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    """Everything under /metrics/* plus per-route request metrics, in Prometheus text format"""
+    pools = get_pool_stats()
+    caches = {"user": user_cache.get_stats(), "read_your_writes": recent_writes.get_stats()}
+    hashing_stats = hashing.get_stats()
+    journal_stats = journal.posting_journal.get_stats()
+    limiters = ratelimit.get_stats()
+    event_stats = events.get_stats()
+
+    lines = metrics.render_request_metrics()
+    for name, key, metric_type, documentation in (
+        ("knc_db_pool_size", "size", "gauge", "Connections the pool keeps open."),
+        ("knc_db_pool_checked_out", "checked_out", "gauge", "Connections currently in use."),
+        ("knc_db_pool_overflow", "overflow", "gauge", "Connections open beyond the pool size."),
+        ("knc_db_pool_checkouts_total", "checkouts", "counter", "Successful connection checkouts."),
+        ("knc_db_pool_timeouts_total", "timeouts", "counter", "Checkouts that gave up waiting for a connection."),
+        ("knc_db_pool_wait_seconds_total", "wait_seconds_total", "counter", "Time spent waiting for connections."),
+    ):
+        lines.extend(_stats_samples(name, documentation, metric_type, pools, "engine", key))
+    for key in ("hits", "misses", "invalidations", "stale_fills"):
+        lines.extend(_stats_samples(f"knc_cache_{key}_total", f"Read-through cache {key}.", "counter", caches, "cache", key))
+    lines.extend(metrics.render_samples("knc_hashing_jobs_total", "PIN hashes and checks completed.", "counter", [({}, hashing_stats["jobs"])]))
+    lines.extend(metrics.render_samples("knc_hashing_rejected_total", "Hashing jobs shed with a 503.", "counter", [({}, hashing_stats["rejected"])]))
+    lines.extend(metrics.render_samples("knc_hashing_in_flight", "Hashing jobs running or queued.", "gauge", [({}, hashing_stats["in_flight"])]))
+    lines.extend(metrics.render_samples("knc_hashing_queue_wait_seconds_total", "Time hashing jobs waited for a worker.", "counter", [({}, hashing_stats["queue_wait_seconds_total"])]))
+    lines.extend(metrics.render_samples("knc_hashing_seconds_total", "Time spent in bcrypt.", "counter", [({}, hashing_stats["hash_seconds_total"])]))
+    for name, key, metric_type, documentation in (
+        ("knc_journal_batches_total", "batches", "counter", "Group commits written by the posting journal."),
+        ("knc_journal_postings_total", "postings", "counter", "Postings committed by the posting journal."),
+        ("knc_journal_rejected_total", "rejected", "counter", "Postings shed with a 503 because the journal queue was full."),
+        ("knc_journal_failed_batches_total", "failed_batches", "counter", "Journal batches retried one posting at a time."),
+        ("knc_journal_commit_seconds_total", "commit_seconds_total", "counter", "Time spent writing and committing journal batches."),
+        ("knc_journal_pending", "pending", "gauge", "Postings waiting for the journal writer."),
+    ):
+        lines.extend(metrics.render_samples(name, documentation, metric_type, [({}, journal_stats[key])]))
+    for name, key, metric_type, documentation in (
+        ("knc_event_streams_open", "open_streams", "gauge", "Server-sent event streams open on this worker."),
+        ("knc_events_delivered_total", "delivered", "counter", "Events queued on event streams."),
+        ("knc_event_resyncs_total", "resyncs", "counter", "Streams told to resync because their buffer overflowed."),
+        ("knc_event_streams_rejected_total", "rejected", "counter", "Streams turned away with a 503 at EVENT_MAX_STREAMS."),
+    ):
+        lines.extend(metrics.render_samples(name, documentation, metric_type, [({}, event_stats[key])]))
+    lines.extend(_stats_samples("knc_rate_limited_total", "Requests rejected with a 429 by a rate limiter.", "counter", limiters, "limiter", "rejected"))
+    return Response("\n".join(lines) + "\n", media_type=metrics.CONTENT_TYPE)
@@ -0,0 +1,247 @@
+# metrics.py
+
+import contextvars
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from sqlalchemy import event
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Requests slower than this are logged with their SQL (0 disables the slow-request log)
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))
+
+# Statements kept per request for the slow-request log
+SLOW_REQUEST_MAX_STATEMENTS = int(os.getenv("SLOW_REQUEST_MAX_STATEMENTS", "50"))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+
+slow_request_log = logging.getLogger("knc.slow_requests")
+
+# Everything here is per worker process; Prometheus sums across workers when scraping each one.
+
+# --- Per-Request Stats ---
+class RequestStats:
+    """Costs accumulated while one request is being served"""
+
+    __slots__ = ("queries", "db_seconds", "bcrypt_seconds", "pool_wait_seconds", "statements")
+
+    def __init__(self, record_statements: bool = False):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.bcrypt_seconds = 0.0
+        self.pool_wait_seconds = 0.0
+        self.statements = [] if record_statements else None
+
+# Set by the middleware; copied into threadpool workers and async DB greenlets with the context
+_current_request = contextvars.ContextVar("current_request", default=None)
+
+def current_request_stats():
+    return _current_request.get()
+
+def observe_bcrypt(seconds: float):
+    stats = _current_request.get()
+    if stats is not None:
+        stats.bcrypt_seconds += seconds
+
+def observe_pool_wait(seconds: float):
+    stats = _current_request.get()
+    if stats is not None:
+        stats.pool_wait_seconds += seconds
+
+# --- Prometheus Types ---
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names, values, extra=None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, label_names, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, label_values, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: (list(counts), total, count) for labels, (counts, total, count) in self._series.items()}
+        for label_values, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = _labels(self.label_names, label_values, f'le="{_number(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            le = _labels(self.label_names, label_values, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {count}")
+            labels = _labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {_number(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+class Counter:
+    def __init__(self, name: str, documentation: str, label_names):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for label_values, value in sorted(values.items()):
+            lines.append(f"{self.name}{_labels(self.label_names, label_values)} {_number(value)}")
+        return lines
+
+def render_samples(name: str, documentation: str, metric_type: str, samples):
+    """Exposition lines for values read from elsewhere; samples are (labels dict, value)"""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {metric_type}"]
+    for labels, value in samples:
+        lines.append(f"{name}{_labels(labels.keys(), labels.values())} {_number(value)}")
+    return lines
+
+# --- Request Metrics ---
+ROUTE_LABELS = ("method", "route")
+
+requests_total = Counter(
+    "knc_http_requests_total", "HTTP requests served.", ROUTE_LABELS + ("status",))
+request_seconds = Histogram(
+    "knc_http_request_duration_seconds", "Time to serve a request, including the response body.",
+    ROUTE_LABELS, SECONDS_BUCKETS)
+request_queries = Histogram(
+    "knc_http_request_db_queries", "SQL statements executed per request.",
+    ROUTE_LABELS, QUERY_COUNT_BUCKETS)
+request_db_seconds = Histogram(
+    "knc_http_request_db_seconds", "Time spent executing SQL per request.",
+    ROUTE_LABELS, SECONDS_BUCKETS)
+request_bcrypt_seconds = Histogram(
+    "knc_http_request_bcrypt_seconds", "Time spent waiting on PIN hashing per request.",
+    ROUTE_LABELS, SECONDS_BUCKETS)
+request_pool_wait_seconds = Histogram(
+    "knc_http_request_pool_wait_seconds", "Time spent waiting for a pooled DB connection per request.",
+    ROUTE_LABELS, SECONDS_BUCKETS)
+
+REQUEST_METRICS = (
+    requests_total, request_seconds, request_queries, request_db_seconds,
+    request_bcrypt_seconds, request_pool_wait_seconds,
+)
+
+def record_request(method: str, route: str, status: int, elapsed: float, stats: RequestStats):
+    labels = (method, route)
+    requests_total.inc(labels + (str(status),))
+    request_seconds.observe(labels, elapsed)
+    request_queries.observe(labels, stats.queries)
+    request_db_seconds.observe(labels, stats.db_seconds)
+    if stats.bcrypt_seconds:
+        request_bcrypt_seconds.observe(labels, stats.bcrypt_seconds)
+    request_pool_wait_seconds.observe(labels, stats.pool_wait_seconds)
+
+    if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+        statements = "".join(
+            f"\n  {seconds * 1000:8.2f} ms  {' '.join(statement.split())}"
+            for seconds, statement in stats.statements or ()
+        )
+        slow_request_log.warning(
+            "Slow request %s %s -> %s in %.1f ms (%d queries, %.1f ms db, %.1f ms bcrypt, %.1f ms pool wait)%s",
+            method, route, status, elapsed * 1000, stats.queries, stats.db_seconds * 1000,
+            stats.bcrypt_seconds * 1000, stats.pool_wait_seconds * 1000, statements,
+        )
+
+# --- Middleware ---
+class MetricsMiddleware:
+    """ASGI middleware that times each request and attributes DB, bcrypt and pool costs to its route.
+
+    Routes are labelled by their path template (e.g. /auth/balance/{username}) so
+    usernames never become label values; unmatched paths share one label.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(record_statements=SLOW_REQUEST_MS > 0)
+        token = _current_request.set(stats)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            _current_request.reset(token)
+            route = scope.get("route")
+            record_request(scope["method"], getattr(route, "path", "unmatched"), status, elapsed, stats)
+
+# --- SQLAlchemy Hooks ---
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started_at", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started_at"].pop()
+    stats = _current_request.get()
+    if stats is None:
+        return
+    stats.queries += 1
+    stats.db_seconds += elapsed
+    if stats.statements is not None and len(stats.statements) < SLOW_REQUEST_MAX_STATEMENTS:
+        stats.statements.append((elapsed, statement))
+
+def _handle_error(exception_context):
+    # A failed statement never reaches after_cursor_execute; drop its start time
+    started = exception_context.connection.info.get("query_started_at") if exception_context.connection else None
+    if started:
+        started.pop()
+
+def instrument_engine(engine):
+    """Count and time every statement run on engine (pass async_engine.sync_engine for async)"""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+def render_request_metrics():
+    lines = []
+    for metric in REQUEST_METRICS:
+        lines.extend(metric.render())
+    return lines
@@ -0,0 +1,151 @@
+# migrations.py
+
+import logging
+import os
+import time
+from typing import Callable, NamedTuple
+from sqlalchemy import inspect, text
+from dotenv import load_dotenv
+from database import DATABASE_BACKEND, Base, get_engine
+import models  # registers every table on Base.metadata
+
+load_dotenv()
+
+# Apply pending migrations from the app lifespan; meant for dev and single-instance
+# setups, deployments run scripts/migrate.py once before starting workers
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "false").lower() in ("1", "true", "yes")
+
+MIGRATIONS_TABLE = "schema_migrations"
+
+# Serializes migration runs between deploy jobs and workers migrating on startup
+MIGRATION_LOCK_ID = 0x6b6e636d
+
+log = logging.getLogger("knc.migrations")
+
+class Migration(NamedTuple):
+    """One schema step, applied once per database and recorded in schema_migrations.
+
+    A step runs in one transaction together with its record: apply(connection).
+    An online step instead manages its own connections and commits in chunks as
+    it goes (backfills, table copies), so nothing big stays locked: apply() must
+    then be safe to re-run if it was interrupted before being recorded.
+    """
+    version: str
+    description: str
+    apply: Callable
+    online: bool = False
+    postgres_only: bool = True
+
+# --- Steps ---
+# The bodies of the Postgres steps live with the scripts they grew out of
+
+def _create_tables(connection):
+    Base.metadata.create_all(bind=connection)
+
+def _enhanced_schema():
+    from scripts.migration_script import run_migration
+    run_migration()
+
+def _companies_is_active_boolean(connection):
+    from scripts.companies_table import convert_is_active_to_boolean
+    convert_is_active_to_boolean(connection)
+
+def _money_to_cents():
+    from scripts.migration_script import migrate_money_to_cents
+    migrate_money_to_cents()
+
+def _partition_transactions():
+    from scripts.migration_script import partition_transactions_table
+    partition_transactions_table()
+
+def _create_settlement_tables(connection):
+    Base.metadata.create_all(bind=connection, tables=[models.BillerSettlement.__table__])
+
+def _bill_company_index():
+    from scripts.migration_script import create_bill_company_index
+    create_bill_company_index()
+
+MIGRATIONS = [
+    Migration("0001", "Create missing tables and indexes from models", _create_tables, postgres_only=False),
+    Migration("0002", "Transaction columns, companies, indexes and support tables", _enhanced_schema, online=True),
+    Migration("0003", "companies.is_active as BOOLEAN DEFAULT TRUE, converted in place", _companies_is_active_boolean),
+    Migration("0004", "Balances and amounts in integer centavos", _money_to_cents, online=True),
+    Migration("0005", "Monthly range partitions for transactions", _partition_transactions, online=True),
+    Migration("0006", "Biller settlements table", _create_settlement_tables, postgres_only=False),
+    Migration("0007", "Partial index on pay_bills rows by biller", _bill_company_index, online=True),
+]
+
+# Destructive contract steps (dropping the float money columns, the unpartitioned
+# transactions table) are not listed: they run only when asked for explicitly.
+
+# --- Runner ---
+def applicable(backend: str = DATABASE_BACKEND):
+    return [m for m in MIGRATIONS if not m.postgres_only or backend == "postgresql"]
+
+def applied_versions(connection):
+    if not inspect(connection).has_table(MIGRATIONS_TABLE):
+        return set()
+    return set(connection.execute(text(f"SELECT version FROM {MIGRATIONS_TABLE}")).scalars())
+
+def pending(connection, backend: str = DATABASE_BACKEND):
+    """Migrations this database still needs, in order"""
+    done = applied_versions(connection)
+    return [m for m in applicable(backend) if m.version not in done]
+
+def _record(connection, migration: Migration, elapsed: float):
+    connection.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {MIGRATIONS_TABLE} (
+            version VARCHAR PRIMARY KEY,
+            description VARCHAR NOT NULL,
+            duration_ms INTEGER NOT NULL,
+            applied_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        )
+    """))
+    connection.execute(
+        text(f"INSERT INTO {MIGRATIONS_TABLE} (version, description, duration_ms) VALUES (:version, :description, :ms)"),
+        {"version": migration.version, "description": migration.description, "ms": int(elapsed * 1000)},
+    )
+
+def upgrade(engine=None):
+    """Apply pending migrations in order; returns the versions applied.
+
+    Holds a Postgres advisory lock for the whole run, so concurrent deploy jobs
+    or workers starting together apply each step exactly once.
+    """
+    engine = engine or get_engine()
+    is_postgres = engine.dialect.name == "postgresql"
+    applied = []
+    with engine.connect() as lock_connection:
+        if is_postgres:
+            lock_connection.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+            lock_connection.commit()
+        try:
+            with engine.connect() as connection:
+                todo = pending(connection, engine.dialect.name)
+            for migration in todo:
+                log.info("Applying migration %s: %s", migration.version, migration.description)
+                started = time.perf_counter()
+                if migration.online:
+                    migration.apply()
+                    with engine.begin() as connection:
+                        _record(connection, migration, time.perf_counter() - started)
+                else:
+                    with engine.begin() as connection:
+                        migration.apply(connection)
+                        _record(connection, migration, time.perf_counter() - started)
+                applied.append(migration.version)
+        finally:
+            if is_postgres:
+                lock_connection.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID})
+                lock_connection.commit()
+    return applied
+
+# --- Readiness ---
+_at_head = False
+
+def schema_is_current(connection) -> bool:
+    """True once every applicable migration is recorded; remembered after the first success"""
+    global _at_head
+    if not _at_head:
+        _at_head = not pending(connection)
+    return _at_head
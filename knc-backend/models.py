@@ -1,6 +1,6 @@
 # models.py
 
-from sqlalchemy import Column, Integer, String, Float, DateTime, Text, Boolean
+from sqlalchemy import Column, Integer, BigInteger, String, Date, DateTime, Text, Boolean, Index
 from sqlalchemy.sql import func
 from database import Base
 
@@ -13,16 +13,24 @@ class User(Base):
     email = Column(String, unique=True, index=True, nullable=False)
     username = Column(String, unique=True, index=True, nullable=False)
     hashed_pin = Column(String, nullable=False)
-    balance = Column(Float, default=0.0, nullable=False)
+    balance_cents = Column(BigInteger, default=0, nullable=False)  # Integer centavos
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+    __table_args__ = (
+        # Serves /auth/users/search prefix lookups (LIKE 'q%' ordered by ~<~) under any collation
+        Index(
+            "idx_users_username_pattern", username,
+            postgresql_ops={"username": "text_pattern_ops"}
+        ).ddl_if(dialect="postgresql"),
+    )
+
 class Transaction(Base):
     __tablename__ = "transactions"
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, nullable=False)
     transaction_type = Column(String, nullable=False)  # 'deposit', 'withdraw', 'send_money', 'receive_money', 'pay_bills'
-    amount = Column(Float, nullable=False)
+    amount_cents = Column(BigInteger, nullable=False)  # Integer centavos, always positive
     description = Column(Text)
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
     reference_number = Column(String, unique=True, index=True)
@@ -33,6 +41,19 @@ class Transaction(Base):
     bill_company = Column(String, nullable=True)        # For pay_bills transactions
     notes = Column(Text, nullable=True)                 # Additional notes
 
+    # On Postgres the table is range-partitioned by month on timestamp (see partitions.py),
+    # so the database primary key is (id, timestamp); ids still come from one sequence.
+    __table_args__ = (
+        # Serves keyset-paginated history: WHERE user_id = ? ORDER BY timestamp DESC, id DESC
+        Index("idx_transactions_user_timestamp_id", user_id, timestamp.desc(), id.desc()),
+        # Serves biller settlement: one company's pay_bills rows past its watermark, in id order
+        Index(
+            "idx_transactions_bill_company_id", bill_company, id,
+            postgresql_where=transaction_type == "pay_bills",
+            sqlite_where=transaction_type == "pay_bills",
+        ),
+    )
+
 class Company(Base):
     __tablename__ = "companies"
     
@@ -40,4 +61,66 @@ class Company(Base):
     name = Column(String, unique=True, nullable=False)
     category = Column(String, nullable=False)  # 'utility', 'telecom', 'internet', etc.
     is_active = Column(Boolean, default=True)  # Fixed: Should be Boolean, not String
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
\ No newline at end of file
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class ArchivedLedgerTotal(Base):
+    __tablename__ = "archived_ledger_totals"
+
+    # Net of each user's transactions whose partitions were archived, so reconciliation still balances
+    user_id = Column(Integer, primary_key=True)
+    total_cents = Column(BigInteger, nullable=False, default=0)  # Credits minus debits
+    transaction_count = Column(BigInteger, nullable=False, default=0)
+    unknown_count = Column(BigInteger, nullable=False, default=0)  # Rows whose type was neither credit nor debit
+    archived_through = Column(Date, nullable=False)  # First month still kept in the database
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    key = Column(String, primary_key=True)             # Client-supplied Idempotency-Key header
+    request_hash = Column(String, nullable=False)      # Endpoint + body, to reject key reuse
+    message = Column(String, nullable=False)
+    new_balance_cents = Column(BigInteger, nullable=False)
+    transaction_id = Column(String, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+class DailyAccountSummary(Base):
+    __tablename__ = "daily_account_summary"
+
+    # Maintained by summaries.refresh_summaries; the primary key serves per-user day ranges
+    user_id = Column(Integer, primary_key=True)
+    day = Column(Date, primary_key=True)
+    transaction_type = Column(String, primary_key=True)
+    transaction_count = Column(Integer, nullable=False, default=0)
+    total_cents = Column(BigInteger, nullable=False, default=0)
+    closing_balance_cents = Column(BigInteger, nullable=False, default=0)  # End of day, same on every row of the day
+
+class SummaryWatermark(Base):
+    __tablename__ = "summary_watermarks"
+
+    name = Column(String, primary_key=True)
+    last_transaction_id = Column(Integer, nullable=False, default=0)  # Highest transaction id already aggregated
+    updated_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class BillerSettlement(Base):
+    __tablename__ = "biller_settlements"
+
+    # What we owe one company for its pay_bills rows with ids in (after_transaction_id, through_transaction_id];
+    # cut by settlements.open_settlements, totals and file filled in by settlements.export_pending
+    id = Column(Integer, primary_key=True)
+    company_id = Column(Integer, nullable=False)
+    company_name = Column(String, nullable=False)
+    after_transaction_id = Column(Integer, nullable=False)
+    through_transaction_id = Column(Integer, nullable=False)
+    status = Column(String, nullable=False, default="pending")  # 'pending' until its export file is written, then 'exported'
+    transaction_count = Column(Integer, nullable=True)
+    total_cents = Column(BigInteger, nullable=True)  # Integer centavos owed to the company
+    export_path = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    exported_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        # A range is cut once per company, whatever happens to the run that cut it
+        Index("idx_biller_settlements_company_range", company_id, after_transaction_id, unique=True),
+        Index("idx_biller_settlements_pending", status, postgresql_where=status == "pending"),
+    )
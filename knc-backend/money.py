@@ -0,0 +1,29 @@
+# money.py
+
+from decimal import Decimal
+from typing import Annotated
+from pydantic import Field, PlainSerializer
+
+# Balances and amounts are stored and posted as integer centavos (BIGINT), so
+# ledger arithmetic and the guarded-debit compare are exact. Pesos only exist
+# at the API edge, as Decimals validated to two places.
+
+# Peso amount in request/response schemas; still a plain JSON number on the wire
+Money = Annotated[
+    Decimal,
+    Field(max_digits=15, decimal_places=2),
+    PlainSerializer(float, return_type=float, when_used="json"),
+]
+
+def to_cents(amount) -> int:
+    """Pesos (a Money value or int) to integer centavos"""
+    return int(Decimal(amount).scaleb(2))
+
+def from_cents(cents: int) -> Decimal:
+    """Integer centavos to an exact peso Decimal"""
+    return Decimal(cents).scaleb(-2)
+
+def cents_to_float(cents: int) -> float:
+    """Pesos as a JSON-friendly float, for cached snapshots, history and exports"""
+    # int / int is correctly rounded, so this is float(from_cents(cents)) without the Decimal
+    return cents / 100
@@ -0,0 +1,150 @@
+# partitions.py
+
+import asyncio
+import logging
+import os
+import re
+from datetime import date, datetime, timezone
+from sqlalchemy import text
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Whole months of transactions kept in Postgres; older partitions are archived by scripts/archive_transactions.py
+TRANSACTION_RETENTION_MONTHS = int(os.getenv("TRANSACTION_RETENTION_MONTHS", "24"))
+
+# Monthly partitions created ahead of the current month
+TRANSACTION_PARTITIONS_AHEAD = int(os.getenv("TRANSACTION_PARTITIONS_AHEAD", "3"))
+
+# Seconds between checks for upcoming partitions in each worker (0 leaves it to scripts/archive_transactions.py)
+PARTITION_MAINTENANCE_SECONDS = float(os.getenv("PARTITION_MAINTENANCE_SECONDS", "3600"))
+
+PARENT = "transactions"
+DEFAULT_PARTITION = "transactions_default"
+
+# Partition months are cut in UTC; the name carries the month, e.g. transactions_p2026_10
+PARTITION_NAME = re.compile(r"^transactions_p(\d{4})_(\d{2})$")
+
+# Serializes partition DDL between workers and the archive script
+MAINTENANCE_LOCK_ID = 0x6b6e6370
+
+log = logging.getLogger("knc.partitions")
+
+# --- Months ---
+def month_start(day: date) -> date:
+    return date(day.year, day.month, 1)
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def current_month() -> date:
+    return month_start(datetime.now(timezone.utc).date())
+
+def partition_name(month: date) -> str:
+    return f"{PARENT}_p{month:%Y_%m}"
+
+def _bound(month: date) -> str:
+    return f"'{month.isoformat()} 00:00:00+00'"
+
+def retention_cutoff(retention_months: int = TRANSACTION_RETENTION_MONTHS, today: date = None) -> date:
+    """First month still kept; partitions for earlier months are due for archival"""
+    return add_months(month_start(today or current_month()), -retention_months)
+
+# --- Catalog ---
+def is_partitioned(connection, table: str = PARENT) -> bool:
+    return connection.execute(
+        text("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(:table)"), {"table": table}
+    ).scalar() or False
+
+def monthly_partitions(connection, parent: str = PARENT):
+    """[(month, partition name)] for the parent's monthly partitions, oldest first"""
+    names = connection.execute(text("""
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = to_regclass(:parent)
+    """), {"parent": parent}).scalars()
+    months = []
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            months.append((date(int(match.group(1)), int(match.group(2)), 1), name))
+    return sorted(months)
+
+# --- DDL ---
+def _default_has_rows(connection, lower: str, upper: str) -> bool:
+    if not connection.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": DEFAULT_PARTITION}).scalar():
+        return False
+    return connection.execute(text(f"""
+        SELECT EXISTS (
+            SELECT 1 FROM {DEFAULT_PARTITION}
+            WHERE timestamp >= {lower} AND timestamp < {upper}
+        )
+    """)).scalar()
+
+def create_partition(connection, month: date, parent: str = PARENT):
+    """Create one month's partition, moving any of its rows out of the default partition first"""
+    name = partition_name(month)
+    lower, upper = _bound(month), _bound(add_months(month, 1))
+    if not _default_has_rows(connection, lower, upper):
+        connection.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {parent} FOR VALUES FROM ({lower}) TO ({upper})"
+        ))
+        return
+    # Attaching a range that the default partition holds rows for would fail, so move them in first
+    connection.execute(text(f"CREATE TABLE {name} (LIKE {parent} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    connection.execute(text(f"""
+        WITH moved AS (
+            DELETE FROM {DEFAULT_PARTITION}
+            WHERE timestamp >= {lower} AND timestamp < {upper}
+            RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+    """))
+    connection.execute(text(f"ALTER TABLE {parent} ATTACH PARTITION {name} FOR VALUES FROM ({lower}) TO ({upper})"))
+    log.warning("Moved stray rows for %s out of %s", month.isoformat(), DEFAULT_PARTITION)
+
+def ensure_partitions(connection, first_month: date = None, months_ahead: int = TRANSACTION_PARTITIONS_AHEAD,
+                      parent: str = PARENT):
+    """Create missing monthly partitions from first_month (default: this month) through months_ahead.
+
+    Runs in the caller's transaction and takes an advisory lock, so workers that
+    check at the same time don't race on the DDL. Returns the months created.
+    """
+    connection.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": MAINTENANCE_LOCK_ID})
+    existing = {month for month, _ in monthly_partitions(connection, parent)}
+    month = first_month or current_month()
+    last = add_months(current_month(), months_ahead)
+    created = []
+    while month <= last:
+        if month not in existing:
+            create_partition(connection, month, parent)
+            created.append(month)
+        month = add_months(month, 1)
+    connection.execute(text(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF {parent} DEFAULT"))
+    return created
+
+def expired_partitions(connection, retention_months: int = TRANSACTION_RETENTION_MONTHS, today: date = None):
+    """[(month, name)] of partitions entirely older than the retention window"""
+    cutoff = retention_cutoff(retention_months, today)
+    return [(month, name) for month, name in monthly_partitions(connection) if month < cutoff]
+
+# --- Background Maintenance ---
+def maintain(engine):
+    """Create upcoming partitions if transactions is partitioned; returns the months created"""
+    with engine.begin() as connection:
+        if not is_partitioned(connection):
+            return []
+        return ensure_partitions(connection)
+
+async def run_maintainer(engine, interval: float = PARTITION_MAINTENANCE_SECONDS):
+    """Background loop started by the app lifespan so inserts never run past the last partition"""
+    while True:
+        try:
+            created = await asyncio.to_thread(maintain, engine)
+            if created:
+                log.info("Created transaction partitions for %s", ", ".join(m.isoformat() for m in created))
+        except Exception:
+            log.exception("Transaction partition maintenance failed")
+        await asyncio.sleep(interval)
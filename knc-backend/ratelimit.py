@@ -0,0 +1,191 @@
+# ratelimit.py
+
+import math
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# "memory" (per process) or "redis" (shared by every worker, needs REDIS_URL)
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+
+# Failed logins allowed per username within the window
+LOGIN_MAX_FAILURES = int(os.getenv("LOGIN_MAX_FAILURES", "5"))
+LOGIN_FAILURE_WINDOW_SECONDS = float(os.getenv("LOGIN_FAILURE_WINDOW_SECONDS", "300"))
+
+# Login attempts allowed per client IP within the window
+LOGIN_MAX_ATTEMPTS_PER_IP = int(os.getenv("LOGIN_MAX_ATTEMPTS_PER_IP", "30"))
+LOGIN_IP_WINDOW_SECONDS = float(os.getenv("LOGIN_IP_WINDOW_SECONDS", "60"))
+
+# User directory searches allowed per client IP within the window (autocomplete sends one per keystroke)
+USER_SEARCH_MAX_PER_IP = int(os.getenv("USER_SEARCH_MAX_PER_IP", "60"))
+USER_SEARCH_WINDOW_SECONDS = float(os.getenv("USER_SEARCH_WINDOW_SECONDS", "60"))
+
+# Use the first X-Forwarded-For address as the client IP (only behind a trusted proxy)
+TRUST_FORWARDED_FOR = os.getenv("TRUST_FORWARDED_FOR", "false").lower() in ("1", "true", "yes")
+
+# Keys tracked by the in-process backend; the least recently used are forgotten first
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+
+class RateLimited(Exception):
+    """Raised when a key has used up its window; retry_after is in whole seconds, detail is for the client"""
+
+    def __init__(self, retry_after: int, detail: str):
+        super().__init__(f"Rate limited for {retry_after}s")
+        self.retry_after = retry_after
+        self.detail = detail
+
+# --- Backends ---
+class WindowBackend:
+    """Timestamps of recent events per key"""
+
+    def acquire(self, key: str, limit: int, window: float, now: float):
+        """Record an event unless limit are already within window, in one atomic step.
+
+        Returns (recorded, time of the oldest event in the window or None).
+        """
+        raise NotImplementedError
+
+    def reset(self, key: str):
+        raise NotImplementedError
+
+class MemoryWindowBackend(WindowBackend):
+    """Per-process deques of event times, bounded to max_keys keys"""
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._events = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _prune(self, key: str, window: float, now: float):
+        events = self._events.get(key)
+        if events is None:
+            return None
+        while events and events[0] <= now - window:
+            events.popleft()
+        if not events:
+            del self._events[key]
+            return None
+        return events
+
+    def acquire(self, key: str, limit: int, window: float, now: float):
+        with self._lock:
+            events = self._prune(key, window, now)
+            if events is not None and len(events) >= limit:
+                return False, events[0]
+            if events is None:
+                events = self._events[key] = deque()
+            events.append(now)
+            self._events.move_to_end(key)
+            while len(self._events) > self.max_keys:
+                self._events.popitem(last=False)
+            return True, events[0]
+
+    def reset(self, key: str):
+        with self._lock:
+            self._events.pop(key, None)
+
+class RedisWindowBackend(WindowBackend):
+    """Sorted set of event times per key, shared by every worker; needs the optional redis package"""
+
+    def __init__(self, url: str):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("RATE_LIMIT_BACKEND=redis requires the redis package (pip install redis)")
+        self._client = redis.Redis.from_url(url)
+
+    def acquire(self, key: str, limit: int, window: float, now: float):
+        # Add first and count in the same MULTI, so concurrent callers each see
+        # the others' events; one that lands past the limit takes its own back out
+        member = uuid.uuid4().hex
+        pipeline = self._client.pipeline()
+        pipeline.zremrangebyscore(key, 0, now - window)
+        pipeline.zadd(key, {member: now})
+        pipeline.zcard(key)
+        pipeline.zrange(key, 0, 0, withscores=True)
+        pipeline.pexpire(key, int(window * 1000))
+        _, _, count, oldest, _ = pipeline.execute()
+        if count > limit:
+            self._client.zrem(key, member)
+            return False, oldest[0][1] if oldest else now
+        return True, oldest[0][1] if oldest else now
+
+    def reset(self, key: str):
+        self._client.delete(key)
+
+def create_backend(name: str = RATE_LIMIT_BACKEND) -> WindowBackend:
+    if name == "memory":
+        return MemoryWindowBackend()
+    if name == "redis":
+        redis_url = os.getenv("REDIS_URL")
+        if not redis_url:
+            raise ValueError("REDIS_URL not found in .env")
+        return RedisWindowBackend(redis_url)
+    raise ValueError("RATE_LIMIT_BACKEND must be 'memory' or 'redis'")
+
+# --- Limiter ---
+class SlidingWindowLimiter:
+    """At most limit events per key in any window-second span.
+
+    acquire() checks and records in one step, before the work it guards, so
+    concurrent requests can't all pass a check made before any of them counted.
+    Callers that only count some outcomes (e.g. failed logins) reset() on the
+    others.
+    """
+
+    def __init__(self, name: str, limit: int, window: float, backend: WindowBackend,
+                 detail: str = "Too many requests. Please try again later."):
+        self.name = name
+        self.limit = limit
+        self.window = window
+        self.backend = backend
+        self.detail = detail
+        self._rejected = 0
+        self._lock = threading.Lock()
+
+    def _key(self, key: str) -> str:
+        return f"ratelimit:{self.name}:{key}"
+
+    def acquire(self, key: str):
+        """Take one event from key's window, or raise RateLimited if it is used up"""
+        now = time.time()
+        recorded, oldest = self.backend.acquire(self._key(key), self.limit, self.window, now)
+        if not recorded:
+            with self._lock:
+                self._rejected += 1
+            raise RateLimited(max(1, math.ceil(oldest + self.window - now)), self.detail)
+
+    def reset(self, key: str):
+        self.backend.reset(self._key(key))
+
+    def get_stats(self):
+        with self._lock:
+            return {"limit": self.limit, "window_seconds": self.window, "rejected": self._rejected}
+
+def client_ip(request) -> str:
+    if TRUST_FORWARDED_FOR:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+_backend = create_backend()
+
+# Acquired before the user lookup and bcrypt, so shed attempts cost neither
+LOGIN_LIMITED = "Too many login attempts. Please try again later."
+login_failures = SlidingWindowLimiter("login_user", LOGIN_MAX_FAILURES, LOGIN_FAILURE_WINDOW_SECONDS, _backend, LOGIN_LIMITED)
+login_attempts = SlidingWindowLimiter("login_ip", LOGIN_MAX_ATTEMPTS_PER_IP, LOGIN_IP_WINDOW_SECONDS, _backend, LOGIN_LIMITED)
+
+# Caps how fast one client can walk the user directory
+user_searches = SlidingWindowLimiter(
+    "user_search_ip", USER_SEARCH_MAX_PER_IP, USER_SEARCH_WINDOW_SECONDS, _backend,
+    "Too many searches. Please try again later."
+)
+
+def get_stats():
+    return {limiter.name: limiter.get_stats() for limiter in (login_failures, login_attempts, user_searches)}
@@ -0,0 +1,196 @@
+# reference.py
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from dotenv import load_dotenv
+from database import DATABASE_BACKEND, get_engine
+
+load_dotenv()
+
+# Seconds between checks that this process still holds its leased worker ID (Postgres)
+WORKER_LEASE_CHECK_SECONDS = float(os.getenv("WORKER_LEASE_CHECK_SECONDS", "30"))
+
+# Key space of the session advisory locks worker IDs are leased with:
+# pg_try_advisory_lock(WORKER_LEASE_LOCK_ID, worker_id)
+WORKER_LEASE_LOCK_ID = 0x6b6e6377
+
+log = logging.getLogger("knc.reference")
+
+# Snowflake-style transaction references: 41 bits of milliseconds since EPOCH_MS,
+# 10 bits of worker ID and a 12-bit per-millisecond sequence. IDs from one worker
+# never repeat and grow with time, so the unique index on
+# Transaction.reference_number is appended to instead of split at random pages.
+
+EPOCH_MS = 1704067200000  # 2024-01-01T00:00:00Z
+
+WORKER_ID_BITS = 10
+SEQUENCE_BITS = 12
+MAX_WORKER_ID = (1 << WORKER_ID_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+# Zero-padded so string order (the column is VARCHAR) matches numeric order
+REFERENCE_WIDTH = 19
+
+def preferred_worker_id() -> int:
+    """WORKER_ID from the environment, else derived from the process ID.
+
+    On SQLite this is the worker ID itself. On Postgres it is only where the
+    lease search starts (see WorkerLease), so a deployment that sets distinct
+    values gets exactly those IDs and one that doesn't still gets unique ones.
+    """
+    configured = os.getenv("WORKER_ID")
+    worker_id = int(configured) if configured is not None else os.getpid() & MAX_WORKER_ID
+    if not 0 <= worker_id <= MAX_WORKER_ID:
+        raise ValueError(f"WORKER_ID must be between 0 and {MAX_WORKER_ID}")
+    return worker_id
+
+class WorkerLease:
+    """A worker ID held by this process through a Postgres session advisory lock.
+
+    Every process writing transactions (each uvicorn worker, every instance,
+    the migration job) takes the first free ID from its preferred one onwards,
+    so no two live processes share one whatever WORKER_ID says. The lock lives
+    on a dedicated connection outside the pool and goes away with it:
+    an exited or crashed process frees its ID.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.connection = None
+        self.worker_id = None
+
+    def _connect(self):
+        """A dedicated autocommit DBAPI connection outside the pool, like the events listener's"""
+        cargs, cparams = self.engine.dialect.create_connect_args(self.engine.url)
+        # TCP keepalives notice a dead server even though this connection is mostly idle
+        cparams.setdefault("keepalives", 1)
+        cparams.setdefault("keepalives_idle", 30)
+        connection = self.engine.dialect.loaded_dbapi.connect(*cargs, **cparams)
+        connection.autocommit = True
+        return connection
+
+    def acquire(self, preferred: int) -> int:
+        connection = self._connect()
+        cursor = connection.cursor()
+        for offset in range(MAX_WORKER_ID + 1):
+            candidate = (preferred + offset) & MAX_WORKER_ID
+            cursor.execute("SELECT pg_try_advisory_lock(%s, %s)", (WORKER_LEASE_LOCK_ID, candidate))
+            if cursor.fetchone()[0]:
+                self.connection, self.worker_id = connection, candidate
+                return candidate
+        connection.close()
+        raise RuntimeError(f"All {MAX_WORKER_ID + 1} worker IDs are leased by other processes")
+
+    def is_held(self) -> bool:
+        """False once the lease connection is gone, and with it the lock"""
+        try:
+            cursor = self.connection.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            return True
+        except Exception:
+            return False
+
+    def renew(self) -> int:
+        """Lease an ID again after the connection was lost; another process may have the old one by now"""
+        lost = self.connection
+        worker_id = self.acquire(self.worker_id)
+        try:
+            lost.close()
+        except Exception:
+            pass
+        return worker_id
+
+class ReferenceGenerator:
+    """Thread-safe generator of time-ordered, collision-free reference numbers"""
+
+    def __init__(self, worker_id: int):
+        if not 0 <= worker_id <= MAX_WORKER_ID:
+            raise ValueError(f"worker_id must be between 0 and {MAX_WORKER_ID}")
+        self.worker_id = worker_id
+        self._lock = threading.Lock()
+        self._last_ms = -1
+        self._sequence = 0
+
+    def next_id(self) -> int:
+        with self._lock:
+            now_ms = int(time.time() * 1000)
+            # Never hand out a timestamp older than one already used (clock steps back)
+            if now_ms < self._last_ms:
+                now_ms = self._last_ms
+            if now_ms == self._last_ms:
+                self._sequence = (self._sequence + 1) & MAX_SEQUENCE
+                if self._sequence == 0:
+                    # Sequence exhausted for this millisecond; wait for the next one
+                    while now_ms <= self._last_ms:
+                        now_ms = int(time.time() * 1000)
+            else:
+                self._sequence = 0
+            self._last_ms = now_ms
+            return ((now_ms - EPOCH_MS) << (WORKER_ID_BITS + SEQUENCE_BITS)) \
+                | (self.worker_id << SEQUENCE_BITS) \
+                | self._sequence
+
+    def switch_worker_id(self, worker_id: int):
+        with self._lock:
+            self.worker_id = worker_id
+
+    def next_reference(self) -> str:
+        return str(self.next_id()).zfill(REFERENCE_WIDTH)
+
+def parse_reference(reference_number: str):
+    """Split a reference into (timestamp_ms, worker_id, sequence); None for legacy YYYYMMNNNN references"""
+    if len(reference_number) != REFERENCE_WIDTH or not reference_number.isdigit():
+        return None
+    value = int(reference_number)
+    sequence = value & MAX_SEQUENCE
+    worker_id = (value >> SEQUENCE_BITS) & MAX_WORKER_ID
+    timestamp_ms = (value >> (WORKER_ID_BITS + SEQUENCE_BITS)) + EPOCH_MS
+    return timestamp_ms, worker_id, sequence
+
+_generator = None
+_generator_pid = None
+_generator_lock = threading.Lock()
+
+# Leases by PID. A forked child takes its own and must never close its parent's
+# connection (that would end the parent's session and free its ID), so none are dropped.
+_leases = {}
+
+def get_generator() -> ReferenceGenerator:
+    """Per-process generator (re-created after fork so children don't share sequences or worker IDs)"""
+    global _generator, _generator_pid
+    pid = os.getpid()
+    if _generator_pid != pid:
+        with _generator_lock:
+            if _generator_pid != pid:
+                worker_id = preferred_worker_id()
+                if DATABASE_BACKEND == "postgresql":
+                    lease = WorkerLease(get_engine())
+                    worker_id = lease.acquire(worker_id)
+                    _leases[pid] = lease
+                _generator = ReferenceGenerator(worker_id)
+                _generator_pid = pid
+    return _generator
+
+def next_reference_number() -> str:
+    return get_generator().next_reference()
+
+async def run_lease_keeper(interval: float = WORKER_LEASE_CHECK_SECONDS):
+    """Background task started by the app lifespan: if the lease connection drops
+    (e.g. the database restarted) the ID is free for others, so lease a new one"""
+    generator = get_generator()
+    lease = _leases.get(os.getpid())
+    if lease is None:
+        return
+    while True:
+        await asyncio.sleep(interval)
+        if await asyncio.to_thread(lease.is_held):
+            continue
+        log.error("Lost the lease on worker ID %d; leasing a new one", lease.worker_id)
+        try:
+            generator.switch_worker_id(await asyncio.to_thread(lease.renew))
+        except Exception:
+            log.exception("Could not lease a worker ID; retrying")
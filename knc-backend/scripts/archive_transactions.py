@@ -0,0 +1,187 @@
+# archive_transactions.py
+"""Archive transaction partitions older than the retention window.
+
+Creates any upcoming monthly partitions, then, for each partition entirely
+before the first retained month (TRANSACTION_RETENTION_MONTHS back from this
+month), streams its rows to a compressed file under --dir, checks the row
+count, folds per-user totals into archived_ledger_totals and detaches and
+drops the partition in one transaction. Files are gzip-compressed CSV, or
+Parquet (zstd) with --format parquet, which needs pyarrow. History queries
+keep working for everything inside the window.
+
+Meant for a daily cron job; run with --dry-run to see what would be archived.
+
+    python scripts/archive_transactions.py --dir /var/lib/knc/archive
+    python scripts/archive_transactions.py --format parquet --retention-months 12
+"""
+import argparse
+import csv
+import gzip
+import os
+import sys
+from datetime import date
+
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+import partitions
+from database import engine
+from models import ArchivedLedgerTotal
+
+CREDIT_TYPES = ("deposit", "receive_money")
+DEBIT_TYPES = ("withdraw", "send_money", "pay_bills")
+
+# --- Export ---
+def stream_partition(connection, name: str, chunk_size: int):
+    """(column names, iterator of row chunks) for a partition, read through a server-side cursor"""
+    result = connection.execution_options(stream_results=True, yield_per=chunk_size).execute(
+        text(f"SELECT * FROM {name} ORDER BY id")
+    )
+    return list(result.keys()), result.partitions()
+
+def write_csv(path: str, columns, chunks) -> int:
+    rows = 0
+    with gzip.open(path, "wt", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for chunk in chunks:
+            writer.writerows(chunk)
+            rows += len(chunk)
+    return rows
+
+def write_parquet(path: str, columns, chunks) -> int:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("--format parquet requires the pyarrow package (pip install pyarrow)")
+
+    rows = 0
+    writer = None
+    try:
+        for chunk in chunks:
+            table = pa.table({column: [row[i] for row in chunk] for i, column in enumerate(columns)})
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema, compression="zstd")
+            writer.write_table(table.cast(writer.schema))
+            rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+WRITERS = {"csv": (".csv.gz", write_csv), "parquet": (".parquet", write_parquet)}
+
+def export_partition(name: str, directory: str, file_format: str, chunk_size: int):
+    """Write a partition to directory; returns (path, rows). The file only appears once complete."""
+    suffix, writer = WRITERS[file_format]
+    path = os.path.join(directory, name + suffix)
+    partial = path + ".partial"
+    with engine.connect() as connection:
+        columns, chunks = stream_partition(connection, name, chunk_size)
+        rows = writer(partial, columns, chunks)
+    os.replace(partial, path)
+    return path, rows
+
+# --- Removal ---
+def archive_totals_statement(name: str, archived_through: date):
+    """Upsert per-user net, count and unknown-type count of a partition into archived_ledger_totals"""
+    credit_types = ", ".join(f"'{t}'" for t in CREDIT_TYPES)
+    debit_types = ", ".join(f"'{t}'" for t in DEBIT_TYPES)
+    totals = text(f"""
+        SELECT
+            user_id,
+            SUM(CASE WHEN transaction_type IN ({credit_types}) THEN amount_cents
+                     WHEN transaction_type IN ({debit_types}) THEN -amount_cents
+                     ELSE 0 END) AS total_cents,
+            COUNT(*) AS transaction_count,
+            COUNT(*) FILTER (WHERE transaction_type NOT IN ({credit_types}, {debit_types})) AS unknown_count,
+            CAST(:archived_through AS DATE) AS archived_through
+        FROM {name}
+        GROUP BY user_id
+    """).bindparams(archived_through=archived_through).columns(
+        ArchivedLedgerTotal.user_id, ArchivedLedgerTotal.total_cents, ArchivedLedgerTotal.transaction_count,
+        ArchivedLedgerTotal.unknown_count, ArchivedLedgerTotal.archived_through,
+    ).subquery()
+    statement = pg_insert(ArchivedLedgerTotal).from_select(
+        ["user_id", "total_cents", "transaction_count", "unknown_count", "archived_through"], totals
+    )
+    return statement.on_conflict_do_update(
+        index_elements=[ArchivedLedgerTotal.user_id],
+        set_={
+            "total_cents": ArchivedLedgerTotal.total_cents + statement.excluded.total_cents,
+            "transaction_count": ArchivedLedgerTotal.transaction_count + statement.excluded.transaction_count,
+            "unknown_count": ArchivedLedgerTotal.unknown_count + statement.excluded.unknown_count,
+            "archived_through": statement.excluded.archived_through,
+        },
+    )
+
+def has_unsettled_bills(connection, name: str) -> bool:
+    """Whether the partition holds bill payments not yet exported to their biller (see settlements.py).
+
+    Only checked once settlement has been run at all, so deployments that don't
+    use it can still archive.
+    """
+    return connection.execute(text(f"""
+        SELECT EXISTS (
+            SELECT 1
+            FROM {name} t
+            JOIN companies c ON c.name = t.bill_company
+            LEFT JOIN summary_watermarks w ON w.name = 'biller_settlement:' || c.id
+            WHERE t.transaction_type = 'pay_bills'
+              AND EXISTS (SELECT 1 FROM summary_watermarks WHERE name LIKE 'biller\\_settlement:%')
+              AND (t.id > COALESCE(w.last_transaction_id, 0) OR EXISTS (
+                  SELECT 1 FROM biller_settlements s
+                  WHERE s.status = 'pending' AND s.company_id = c.id
+                    AND t.id > s.after_transaction_id AND t.id <= s.through_transaction_id
+              ))
+        )
+    """)).scalar()
+
+def drop_partition(name: str, month: date, expected_rows: int):
+    """Fold totals and drop the partition atomically; refuses if rows changed since the export
+    or bill payments in it are still unsettled"""
+    with engine.begin() as connection:
+        connection.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": partitions.MAINTENANCE_LOCK_ID})
+        rows = connection.execute(text(f"SELECT COUNT(*) FROM {name}")).scalar()
+        if rows != expected_rows:
+            raise RuntimeError(f"{name} has {rows} rows but {expected_rows} were archived; not dropping it")
+        if has_unsettled_bills(connection, name):
+            raise RuntimeError(f"{name} has bill payments not yet settled; run scripts/settle_billers.py first")
+        connection.execute(archive_totals_statement(name, partitions.add_months(month, 1)))
+        connection.execute(text(f"ALTER TABLE {partitions.PARENT} DETACH PARTITION {name}"))
+        connection.execute(text(f"DROP TABLE {name}"))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dir", default="archive", help="directory for archived partitions")
+    parser.add_argument("--format", choices=sorted(WRITERS), default="csv")
+    parser.add_argument("--retention-months", type=int, default=partitions.TRANSACTION_RETENTION_MONTHS)
+    parser.add_argument("--chunk-size", type=int, default=50000, help="rows per fetch while exporting")
+    parser.add_argument("--dry-run", action="store_true", help="only list the partitions that would be archived")
+    args = parser.parse_args()
+
+    with engine.begin() as connection:
+        if not partitions.is_partitioned(connection):
+            print("transactions is not partitioned; run scripts/migration_script.py first")
+            sys.exit(1)
+        created = partitions.ensure_partitions(connection)
+        expired = partitions.expired_partitions(connection, args.retention_months)
+    if created:
+        print(f"Created partitions for {', '.join(month.isoformat() for month in created)}")
+
+    cutoff = partitions.retention_cutoff(args.retention_months)
+    print(f"Keeping {args.retention_months} months (from {cutoff.isoformat()}); {len(expired)} partitions to archive")
+    if args.dry_run:
+        for _, name in expired:
+            print(f"  {name}")
+        return
+
+    os.makedirs(args.dir, exist_ok=True)
+    for month, name in expired:
+        path, rows = export_partition(name, args.dir, args.format, args.chunk_size)
+        drop_partition(name, month, rows)
+        print(f"Archived {rows} transactions from {name} to {path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# benchmark_db_modes.py
+"""Compare requests/second of the sync and async DB paths.
+
+Starts one uvicorn server per DB_MODE against the same DATABASE_URL, then
+drives a deposit/balance/history mix at a fixed concurrency and prints the
+throughput for each mode. Needs httpx (`pip install httpx`).
+
+    python scripts/benchmark_db_modes.py --concurrency 64 --duration 15
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import time
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def start_server(mode, port):
+    env = dict(os.environ, DB_MODE=mode)
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env=env,
+    )
+
+async def wait_until_up(client, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            await client.get("/")
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError("Server did not start in time")
+
+async def seed_users(client, count):
+    usernames = []
+    for i in range(count):
+        username = f"bench_{i}"
+        await client.post("/auth/signup", json={
+            "first_name": "Bench",
+            "last_name": str(i),
+            "email": f"{username}@example.com",
+            "username": username,
+            "pin": "1234",
+        })
+        usernames.append(username)
+    return usernames
+
+async def worker(client, usernames, deadline, stats):
+    while time.monotonic() < deadline:
+        username = random.choice(usernames)
+        roll = random.random()
+        if roll < 0.5:
+            response = await client.get(f"/auth/balance/{username}")
+        elif roll < 0.8:
+            response = await client.get(f"/auth/transactions/{username}")
+        else:
+            response = await client.post("/auth/deposit", json={"username": username, "amount": 100})
+        stats["requests"] += 1
+        if response.status_code >= 400:
+            stats["errors"] += 1
+
+async def run_mode(mode, port, args):
+    server = start_server(mode, port)
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=30) as client:
+            await wait_until_up(client)
+            usernames = await seed_users(client, args.users)
+            stats = {"requests": 0, "errors": 0}
+            started = time.monotonic()
+            deadline = started + args.duration
+            await asyncio.gather(*(worker(client, usernames, deadline, stats) for _ in range(args.concurrency)))
+            elapsed = time.monotonic() - started
+        return stats["requests"] / elapsed, stats["errors"]
+    finally:
+        server.terminate()
+        server.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    for offset, mode in enumerate(("sync", "async")):
+        rps, errors = asyncio.run(run_mode(mode, args.port + offset, args))
+        print(f"{mode:>5}: {rps:8.1f} req/s  ({errors} errors)")
+
+if __name__ == "__main__":
+    main()
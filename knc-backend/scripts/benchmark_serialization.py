@@ -0,0 +1,161 @@
+# benchmark_serialization.py
+"""Per-row cost of a transaction history page, before and after the fast path.
+
+Seeds one throwaway user with --rows transactions in the DATABASE_URL database,
+then times the three stages of GET /auth/transactions/{username} for each way
+of serving it, and prints microseconds per row:
+
+  fetch   the page query: Transaction entities (before) or HISTORY_COLUMNS tuples
+  build   rows to items: three strftime calls (before) or one datetime (after)
+  encode  what FastAPI does with the items: jsonable_encoder + JSONResponse
+          for an untyped route (before), TransactionItem validation + ORJSONResponse
+          for the typed route (after), ORJSONResponse alone for legacy_fields=true
+
+The seeded rows are deleted afterwards.
+
+    python scripts/benchmark_serialization.py --rows 1000 --page-size 100 --repeat 200
+"""
+import argparse
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+from pydantic import TypeAdapter
+from sqlalchemy import delete, insert, select
+
+from auth import TransactionItem, history_query, transaction_row, transaction_to_dict
+from database import Base, SessionLocal, engine
+from models import Transaction, User
+from money import cents_to_float
+
+TRANSACTION_TYPES = ["deposit", "withdraw", "send_money", "receive_money", "pay_bills"]
+
+# --- Seeding ---
+def seed_history(username, rows):
+    with SessionLocal() as db:
+        user = User(
+            first_name="Bench",
+            last_name="Serialization",
+            email=f"{username}@example.com",
+            username=username,
+            hashed_pin="!",
+        )
+        db.add(user)
+        db.flush()
+        started = datetime.now() - timedelta(minutes=rows)
+        batch = []
+        for i in range(rows):
+            row = transaction_row(
+                user.id, TRANSACTION_TYPES[i % len(TRANSACTION_TYPES)], 1000 + i, f"Benchmark posting {i}",
+                recipient_username="someone" if i % 5 == 2 else None,
+                notes="bench" if i % 3 == 0 else None,
+                reference_number=f"BENCH{uuid.uuid4().hex[:16].upper()}",
+            )
+            row["timestamp"] = started + timedelta(minutes=i)
+            batch.append(row)
+        db.execute(insert(Transaction.__table__), batch)
+        db.commit()
+        return user.id
+
+def remove_history(username, user_id):
+    with SessionLocal() as db:
+        db.execute(delete(Transaction).where(Transaction.user_id == user_id))
+        db.execute(delete(User).where(User.username == username))
+        db.commit()
+
+# --- Paths ---
+def legacy_history_query(username, limit):
+    """The page query as it was: whole Transaction entities"""
+    return (
+        select(Transaction)
+        .join(User, User.id == Transaction.user_id)
+        .where(User.username == username)
+        .order_by(Transaction.timestamp.desc(), Transaction.id.desc())
+        .limit(limit + 1)
+    )
+
+def legacy_item(t):
+    return {
+        "reference_number": t.reference_number,
+        "type": t.transaction_type,
+        "amount": cents_to_float(t.amount_cents),
+        "description": t.description,
+        "timestamp": t.timestamp.strftime("%m/%d/%Y %I:%M %p"),
+        "date": t.timestamp.strftime("%m/%d/%Y"),
+        "time": t.timestamp.strftime("%I:%M %p"),
+        "recipient": t.recipient_username,
+        "sender": t.sender_username,
+        "company": t.bill_company,
+        "notes": t.notes
+    }
+
+page_adapter = TypeAdapter(List[TransactionItem])
+
+PATHS = {
+    "before": (
+        lambda db, username, limit: db.execute(legacy_history_query(username, limit)).scalars().all(),
+        legacy_item,
+        lambda items: JSONResponse(jsonable_encoder(items)).body,
+    ),
+    "after": (
+        lambda db, username, limit: db.execute(history_query(username, limit)).all(),
+        transaction_to_dict,
+        lambda items: ORJSONResponse(page_adapter.dump_python(page_adapter.validate_python(items), mode="json")).body,
+    ),
+    "legacy_fields": (
+        lambda db, username, limit: db.execute(history_query(username, limit)).all(),
+        lambda row: transaction_to_dict(row, legacy_fields=True),
+        lambda items: ORJSONResponse(items).body,
+    ),
+}
+
+def time_path(name, username, page_size, repeat):
+    """Seconds spent in fetch, build and encode over `repeat` pages"""
+    fetch, build, encode = PATHS[name]
+    totals = {"fetch": 0.0, "build": 0.0, "encode": 0.0}
+    with SessionLocal() as db:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            rows = fetch(db, username, page_size)[:page_size]
+            fetched = time.perf_counter()
+            items = [build(row) for row in rows]
+            built = time.perf_counter()
+            encode(items)
+            encoded = time.perf_counter()
+            totals["fetch"] += fetched - started
+            totals["build"] += built - fetched
+            totals["encode"] += encoded - built
+            # A fresh identity map each page, as each request gets its own session
+            db.expunge_all()
+    return totals
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000, help="transactions seeded for the benchmark user")
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=200, help="pages timed per path")
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    username = f"bench_serial_{uuid.uuid4().hex[:8]}"
+    user_id = seed_history(username, args.rows)
+    try:
+        page_rows = min(args.page_size, args.rows)
+        for name in PATHS:
+            time_path(name, username, args.page_size, 5)  # warm caches and compiled statements
+        results = {name: time_path(name, username, args.page_size, args.repeat) for name in PATHS}
+    finally:
+        remove_history(username, user_id)
+
+    per_row = 1e6 / (args.repeat * page_rows)
+    print(f"{page_rows}-row pages, {args.repeat} pages per path, {engine.dialect.name}; microseconds per row")
+    print(f"{'path':14} {'fetch':>8} {'build':>8} {'encode':>8} {'total':>8}")
+    for name, totals in results.items():
+        stages = [totals[stage] * per_row for stage in ("fetch", "build", "encode")]
+        print(f"{name:14} " + " ".join(f"{value:8.2f}" for value in stages + [sum(stages)]))
+
+if __name__ == "__main__":
+    main()
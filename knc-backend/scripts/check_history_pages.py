@@ -0,0 +1,76 @@
+# check_history_pages.py
+"""Check that paging through transaction history returns every row exactly once.
+
+Runs the app in this process, makes --postings deposits for a new user (several
+land in the same second, which is where keyset cursors go wrong) and follows
+X-Next-Cursor through /auth/transactions/{username} --limit rows at a time.
+Exits non-zero if a row shows up twice, is missing, or the order isn't newest
+first. DATABASE_URL picks the database; without one a throwaway SQLite file
+is used.
+
+    python scripts/check_history_pages.py --postings 7 --limit 3
+"""
+import argparse
+import os
+import sys
+import tempfile
+import uuid
+
+if not os.getenv("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.gettempdir(), 'knc_history_pages.db')}"
+    os.environ.setdefault("DB_MODE", "sync")
+
+from fastapi.testclient import TestClient
+
+from database import Base, engine
+from main import app
+
+PIN = "1234"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--postings", type=int, default=7, help="deposits to make")
+    parser.add_argument("--limit", type=int, default=3, help="rows per page")
+    args = parser.parse_args()
+
+    username = f"hp_{uuid.uuid4().hex[:8]}"
+    Base.metadata.create_all(bind=engine)
+    with TestClient(app) as client:
+        client.post("/auth/signup", json={
+            "first_name": "History", "last_name": "Pages", "email": f"{username}@example.com",
+            "username": username, "pin": PIN,
+        }).raise_for_status()
+        for amount in range(1, args.postings + 1):
+            client.post("/auth/deposit", json={"username": username, "amount": 100 * amount}).raise_for_status()
+
+        pages = []
+        params = {"limit": args.limit}
+        while True:
+            response = client.get(f"/auth/transactions/{username}", params=params)
+            response.raise_for_status()
+            pages.append([item["reference_number"] for item in response.json()])
+            cursor = response.headers.get("X-Next-Cursor")
+            if cursor is None or len(pages) > args.postings:
+                break
+            params = {"limit": args.limit, "cursor": cursor}
+
+        everything = client.get(f"/auth/transactions/{username}", params={"limit": args.postings + 1}).json()
+
+    seen = [reference for page in pages for reference in page]
+    expected = [item["reference_number"] for item in everything]
+    failures = []
+    if len(seen) != len(set(seen)):
+        failures.append(f"duplicates across pages: {len(seen) - len(set(seen))}")
+    if len(expected) != args.postings:
+        failures.append(f"expected {args.postings} rows in one page, got {len(expected)}")
+    if seen != expected:
+        failures.append("paged rows differ from the single-page listing")
+
+    print(f"{len(pages)} pages of up to {args.limit}: {[len(page) for page in pages]}")
+    for failure in failures:
+        print(f"FAIL {failure}")
+    print("all checks passed" if not failures else f"{len(failures)} failed")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# check_idempotency.py
+"""Check Idempotency-Key handling on the money routes, on any database.
+
+Runs the app in this process, sends a deposit, a withdrawal, a transfer and a
+bill payment with an Idempotency-Key, then retries each with the same key and
+body (the stored response comes back and balances don't move) and with the same
+key and a different body (422). Exits non-zero on any mismatch. DATABASE_URL
+picks the database; without one a throwaway SQLite file is used.
+
+    python scripts/check_idempotency.py
+"""
+import argparse
+import os
+import sys
+import tempfile
+import uuid
+
+if not os.getenv("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.gettempdir(), 'knc_idempotency.db')}"
+    os.environ.setdefault("DB_MODE", "sync")
+# Balances must come from the database, not the profile cache
+os.environ["CACHE_TTL"] = "0"
+
+from fastapi.testclient import TestClient
+
+from database import Base, SessionLocal, engine
+from main import app
+from models import Company
+
+PIN = "1234"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--verbose", action="store_true", help="print every check, not only failures")
+    args = parser.parse_args()
+
+    prefix = f"ik_{uuid.uuid4().hex[:8]}"
+    alice, bob = f"{prefix}_alice", f"{prefix}_bob"
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        if db.query(Company).filter_by(name="MERALCO").first() is None:
+            db.add(Company(name="MERALCO", category="utility"))
+            db.commit()
+
+    failures = total = 0
+
+    def check(name, ok, detail=""):
+        nonlocal failures, total
+        total += 1
+        if not ok:
+            failures += 1
+        if args.verbose or not ok:
+            print(f"{'ok  ' if ok else 'FAIL'} {name}" + (f"  ({detail})" if detail and not ok else ""))
+
+    with TestClient(app) as client:
+        for username in (alice, bob):
+            client.post("/auth/signup", json={
+                "first_name": "Idempotency", "last_name": "Check", "email": f"{username}@example.com",
+                "username": username, "pin": PIN,
+            }).raise_for_status()
+
+        def balances():
+            return tuple(client.get(f"/auth/balance/{username}").json()["balance"] for username in (alice, bob))
+
+        # (name, path, body, the same request with a different body)
+        requests = [
+            ("deposit", "/auth/deposit", {"username": alice, "amount": 1000}, {"username": alice, "amount": 2000}),
+            ("withdraw", "/auth/withdraw", {"username": alice, "amount": 100}, {"username": alice, "amount": 200}),
+            ("send money", "/auth/send-money",
+             {"sender_username": alice, "recipient_username": bob, "amount": 100},
+             {"sender_username": alice, "recipient_username": bob, "amount": 200}),
+            ("pay bills", "/auth/pay-bills",
+             {"username": alice, "company_name": "MERALCO", "amount": 100},
+             {"username": alice, "company_name": "MERALCO", "amount": 200}),
+        ]
+        for name, path, body, other_body in requests:
+            headers = {"Idempotency-Key": f"{prefix}-{name}"}
+            first = client.post(path, json=body, headers=headers)
+            check(f"{name} with a key", first.status_code == 200, f"{first.status_code} {first.text}")
+            after_first = balances()
+            retry = client.post(path, json=body, headers=headers)
+            check(f"{name} retry replays the response", retry.status_code == 200 and retry.json() == first.json(),
+                  f"{retry.status_code} {retry.text}")
+            check(f"{name} retry moves no money", balances() == after_first, (after_first, balances()))
+            reused = client.post(path, json=other_body, headers=headers)
+            check(f"{name} key reused for another body", reused.status_code == 422, f"{reused.status_code} {reused.text}")
+
+    print(f"{total - failures} passed, {failures} failed")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
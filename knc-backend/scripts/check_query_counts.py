@@ -0,0 +1,131 @@
+# check_query_counts.py
+"""Check that API endpoints stay within their SQL statement budgets.
+
+Runs the app in this process, seeds two users, calls each endpoint once with a
+cold user cache and counts the statements it sends to the database. Exits
+non-zero if any endpoint needs more than its budget, so a handler that grows an
+extra lookup fails CI instead of showing up as a latency regression later.
+DATABASE_URL and DB_MODE pick the database and handlers as for the app;
+without a DATABASE_URL a throwaway SQLite file is used.
+
+    python scripts/check_query_counts.py
+    DB_MODE=async DATABASE_URL=postgresql://... python scripts/check_query_counts.py
+"""
+import argparse
+import os
+import sys
+import tempfile
+import uuid
+
+if not os.getenv("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.gettempdir(), 'knc_query_counts.db')}"
+    os.environ.setdefault("DB_MODE", "sync")
+
+# Count only what the handlers send; PIN checks and group commits would blur the numbers
+os.environ["CREDENTIAL_CACHE_SECONDS"] = "0"
+os.environ["POSTING_JOURNAL"] = "false"
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from cache import user_cache
+from database import Base, async_engine, async_replica_engine, engine, replica_engine
+from events import EVENTS_BACKEND
+from main import app
+
+PIN = "1234"
+
+# A committed posting also sends its stream events in one pg_notify with the postgres events backend
+NOTIFY = 1 if EVENTS_BACKEND == "postgres" else 0
+
+# --- Counting ---
+class StatementCounter:
+    """Statements executed on the app's engines (replicas included) since the last reset"""
+
+    def __init__(self):
+        self.count = 0
+        engines = [engine, replica_engine] + [
+            built.sync_engine for built in (async_engine, async_replica_engine) if built is not None
+        ]
+        for counted in filter(None, engines):
+            event.listen(counted, "after_cursor_execute", self._count)
+
+    def _count(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+    def reset(self):
+        self.count = 0
+
+# --- Checks ---
+def checks(alice, bob):
+    """(name, method, path, json body, expected status, statement budget) in the order they run"""
+    return [
+        ("signup", "POST", "/auth/signup", {
+            "first_name": "Query", "last_name": "Count", "email": f"{alice}@example.com",
+            "username": alice, "pin": PIN,
+        }, 200, 2),
+        ("signup duplicate", "POST", "/auth/signup", {
+            "first_name": "Query", "last_name": "Count", "email": f"{alice}@example.com",
+            "username": alice, "pin": PIN,
+        }, 400, 1),
+        ("login", "POST", "/auth/login", {"username": alice, "pin": PIN}, 200, 1),
+        ("balance", "GET", f"/auth/balance/{alice}", None, 200, 1),
+        ("profile", "GET", f"/auth/profile/{alice}", None, 200, 1),
+        ("update profile", "PUT", f"/auth/profile/{alice}", {
+            "first_name": "Renamed", "last_name": "Count", "email": f"{alice}.new@example.com",
+        }, 200, 1),
+        ("update profile, email taken", "PUT", f"/auth/profile/{alice}", {
+            "first_name": "Renamed", "last_name": "Count", "email": f"{bob}@example.com",
+        }, 400, 1),
+        ("update profile, no user", "PUT", f"/auth/profile/{alice}_missing", {
+            "first_name": "Nobody", "last_name": "Count", "email": f"{alice}.missing@example.com",
+        }, 404, 1),
+        ("deposit", "POST", "/auth/deposit", {"username": alice, "amount": 500}, 200, 2 + NOTIFY),
+        ("send money", "POST", "/auth/send-money", {
+            "sender_username": alice, "recipient_username": bob, "amount": 100,
+        }, 200, 3 + NOTIFY),
+        ("send money, no recipient", "POST", "/auth/send-money", {
+            "sender_username": alice, "recipient_username": f"{bob}_missing", "amount": 100,
+        }, 404, 3),
+        ("history", "GET", f"/auth/transactions/{alice}", None, 200, 1),
+        ("history, no user", "GET", f"/auth/transactions/{alice}_missing", None, 404, 2),
+        ("user search", "GET", f"/auth/users/search?q={alice}", None, 200, 1),
+        ("user search, cached", "GET", f"/auth/users/search?q={alice}", None, 200, 0),
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--verbose", action="store_true", help="print every endpoint, not only failures")
+    args = parser.parse_args()
+
+    prefix = f"qc_{uuid.uuid4().hex[:8]}"
+    alice, bob = f"{prefix}_alice", f"{prefix}_bob"
+    failures = 0
+    Base.metadata.create_all(bind=engine)
+    with TestClient(app) as client:
+        signup = client.post("/auth/signup", json={
+            "first_name": "Query", "last_name": "Count", "email": f"{bob}@example.com", "username": bob, "pin": PIN,
+        })
+        signup.raise_for_status()
+        # User search takes any user's session; the {username} routes run without one
+        login = client.post("/auth/login", json={"username": bob, "pin": PIN})
+        login.raise_for_status()
+        search_headers = {"Authorization": f"Bearer {login.json()['token']}"}
+        counter = StatementCounter()
+        for name, method, path, body, status, budget in checks(alice, bob):
+            user_cache.invalidate(alice, bob)
+            counter.reset()
+            headers = search_headers if path.startswith("/auth/users/search") else None
+            response = client.request(method, path, json=body, headers=headers)
+            ok = response.status_code == status and counter.count <= budget
+            if not ok:
+                failures += 1
+            if args.verbose or not ok:
+                print(f"{'ok  ' if ok else 'FAIL'} {name:30} {response.status_code} (want {status})  "
+                      f"{counter.count} statements (budget {budget})")
+
+    print(f"{len(checks(alice, bob)) - failures} passed, {failures} failed")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+# check_replica_routing.py
+"""Check which database each route reads from, using two ordinary local databases.
+
+Point DATABASE_URL at one database and REPLICA_DATABASE_URL at another; no
+replication is needed. The script creates the schema in both, then makes them
+disagree on purpose: accounts copied into the "replica" by hand never see the
+postings made on the primary afterwards, so every response shows which side it
+was read from. It checks that:
+
+  - money movement and profile updates run on the primary
+  - a user's reads stay on the primary for READ_YOUR_WRITES_SECONDS after a
+    write touches their account (the recipient of a transfer included)
+  - after that window, balance, profile, history, export, summary and search are
+    served by the replica, without a single statement on the primary
+  - replica sessions are read-only (Postgres)
+
+Exits non-zero if any check fails.
+
+    DATABASE_URL=postgresql://.../knc REPLICA_DATABASE_URL=postgresql://.../knc_replica \\
+        python scripts/check_replica_routing.py
+
+Two SQLite files work too; only the read-only check is skipped.
+"""
+import argparse
+import os
+import sys
+import time
+import uuid
+
+# Every read must reach a database, not the user cache
+os.environ["CACHE_TTL"] = "0"
+os.environ["CACHE_BACKEND"] = "lru"
+os.environ["POSTING_JOURNAL"] = "false"
+os.environ.setdefault("READ_YOUR_WRITES_SECONDS", "1")
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event, insert, select, text, update
+
+from database import (
+    READ_YOUR_WRITES_SECONDS, REPLICA_DATABASE_URL, Base, ReplicaSessionLocal, SessionLocal,
+    async_engine, async_replica_engine, engine, replica_engine
+)
+from models import User
+from main import app
+
+PIN = "1234"
+
+class EngineCounter:
+    """Statements sent to the primary and to the replica since the last reset"""
+
+    def __init__(self):
+        self.counts = {"primary": 0, "replica": 0}
+        for side, engines in (("primary", (engine, async_engine)), ("replica", (replica_engine, async_replica_engine))):
+            for built in engines:
+                if built is not None:
+                    target = getattr(built, "sync_engine", built)
+                    event.listen(target, "after_cursor_execute", self._counter(side))
+
+    def _counter(self, side):
+        def count(conn, cursor, statement, parameters, context, executemany):
+            self.counts[side] += 1
+        return count
+
+    def reset(self):
+        self.counts = {"primary": 0, "replica": 0}
+
+def counts_on(counts, side):
+    """True when every statement went to side"""
+    return counts[side] > 0 and sum(counts.values()) == counts[side]
+
+def writable(connection):
+    """Lift the replica engine's read-only default for this transaction (Postgres only; SQLite has no such mode)"""
+    if connection.dialect.name == "postgresql":
+        connection.execute(text("SET TRANSACTION READ WRITE"))
+
+def copy_users(usernames):
+    """'Replicate' these accounts as they are now; later postings never reach the replica"""
+    with SessionLocal() as primary:
+        users = primary.execute(select(User.__table__).where(User.username.in_(usernames))).mappings().all()
+    # The replica's sessions are read-only, so write its copy on a plain connection
+    with replica_engine.begin() as connection:
+        writable(connection)
+        connection.execute(insert(User.__table__), [dict(user) for user in users])
+
+def main():
+    argparse.ArgumentParser(description=__doc__.splitlines()[0]).parse_args()
+    if not REPLICA_DATABASE_URL:
+        sys.exit("Set REPLICA_DATABASE_URL to a second database")
+
+    Base.metadata.create_all(bind=engine)
+    with replica_engine.begin() as connection:
+        writable(connection)
+        Base.metadata.create_all(bind=connection)
+
+    prefix = f"rr_{uuid.uuid4().hex[:8]}"
+    alice, bob = f"{prefix}_alice", f"{prefix}_bob"
+    counter = EngineCounter()
+    failures = []
+
+    def check(name, ok, detail=""):
+        print(f"{'ok  ' if ok else 'FAIL'} {name}" + (f"  ({detail})" if detail and not ok else ""))
+        if not ok:
+            failures.append(name)
+
+    def balance(username):
+        counter.reset()
+        response = client.get(f"/auth/balance/{username}")
+        return response.status_code, response.json().get("balance"), dict(counter.counts)
+
+    with TestClient(app) as client:
+        for username in (alice, bob):
+            client.post("/auth/signup", json={
+                "first_name": "Replica", "last_name": "Check", "email": f"{username}@example.com",
+                "username": username, "pin": PIN,
+            }).raise_for_status()
+        # User search needs a session; the {username} reads accept the owner's too
+        login = client.post("/auth/login", json={"username": alice, "pin": PIN})
+        login.raise_for_status()
+        session = {"Authorization": f"Bearer {login.json()['token']}"}
+
+        status, _, counts = balance(alice)
+        check("balance right after signup reads the primary", status == 200 and counts["replica"] == 0, counts)
+
+        copy_users([alice, bob])
+        counter.reset()
+        deposit = client.post("/auth/deposit", json={"username": alice, "amount": 500})
+        check("deposit runs on the primary", deposit.status_code == 200 and counter.counts["replica"] == 0, counter.counts)
+        counter.reset()
+        sent = client.post("/auth/send-money", json={"sender_username": alice, "recipient_username": bob, "amount": 100})
+        check("send money runs on the primary", sent.status_code == 200 and counter.counts["replica"] == 0, counter.counts)
+
+        status, value, counts = balance(alice)
+        check("sender reads their own write", value == 400 and counts["replica"] == 0, (value, counts))
+        status, value, counts = balance(bob)
+        check("recipient reads the transfer", value == 100 and counts["replica"] == 0, (value, counts))
+
+        time.sleep(READ_YOUR_WRITES_SECONDS + 0.2)
+        status, value, counts = balance(alice)
+        check("after the window balance comes from the replica",
+              value == 0 and counts == {"primary": 0, "replica": 1}, (value, counts))
+        for name, path in (
+            ("profile", f"/auth/profile/{alice}"),
+            ("history", f"/auth/transactions/{alice}"),
+            ("statement export", f"/auth/transactions/{alice}/export"),
+            ("summary", f"/auth/summary/{alice}"),
+            ("user search", f"/auth/users/search?q={prefix}"),
+        ):
+            counter.reset()
+            response = client.get(path, headers=session)
+            check(f"{name} reads the replica only",
+                  response.status_code == 200 and counts_on(counter.counts, "replica"), counter.counts)
+
+        counter.reset()
+        renamed = client.put(f"/auth/profile/{alice}", json={
+            "first_name": "Renamed", "last_name": "Check", "email": f"{alice}.new@example.com",
+        })
+        check("profile update runs on the primary", renamed.status_code == 200 and counter.counts["replica"] == 0, counter.counts)
+        counter.reset()
+        profile = client.get(f"/auth/profile/{alice}").json()
+        check("profile reads the update", profile.get("first_name") == "Renamed" and counter.counts["replica"] == 0,
+              (profile.get("first_name"), counter.counts))
+
+    if replica_engine.dialect.name == "postgresql":
+        try:
+            with ReplicaSessionLocal() as db:
+                db.execute(update(User).where(User.username == alice).values(first_name="Written"))
+            check("replica sessions are read-only", False, "write succeeded")
+        except Exception:
+            check("replica sessions are read-only", True)
+
+    print(f"{len(failures)} failed" if failures else "all checks passed")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# check_sessions.py
+"""Check that session tokens are enforced the same way on every account route.
+
+Runs the app in this process with SESSION_REQUIRED on, signs up two users and
+calls each {username} route with no token, the owner's token, the other user's
+token and malformed ones (garbage, non-ASCII in the header and in ?token=),
+expecting 401/403 for everything but the owner. User search takes any user's
+token but never runs without one. Exits non-zero on any mismatch. DATABASE_URL picks the database; without one a throwaway SQLite
+file is used.
+
+    python scripts/check_sessions.py
+"""
+import argparse
+import os
+import sys
+import tempfile
+import uuid
+
+if not os.getenv("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.gettempdir(), 'knc_sessions.db')}"
+    os.environ.setdefault("DB_MODE", "sync")
+os.environ["SESSION_REQUIRED"] = "true"
+
+from fastapi.testclient import TestClient
+
+from database import Base, engine
+from main import app
+
+PIN = "1234"
+
+def account_routes(username):
+    return [
+        ("balance", f"/auth/balance/{username}"),
+        ("history", f"/auth/transactions/{username}"),
+        ("export", f"/auth/transactions/{username}/export"),
+        ("summary", f"/auth/summary/{username}"),
+        ("profile", f"/auth/profile/{username}"),
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--verbose", action="store_true", help="print every check, not only failures")
+    args = parser.parse_args()
+
+    prefix = f"ss_{uuid.uuid4().hex[:8]}"
+    alice, bob = f"{prefix}_alice", f"{prefix}_bob"
+    Base.metadata.create_all(bind=engine)
+    failures = total = 0
+    with TestClient(app) as client:
+        tokens = {}
+        for username in (alice, bob):
+            client.post("/auth/signup", json={
+                "first_name": "Session", "last_name": "Check", "email": f"{username}@example.com",
+                "username": username, "pin": PIN,
+            }).raise_for_status()
+            login = client.post("/auth/login", json={"username": username, "pin": PIN})
+            login.raise_for_status()
+            tokens[username] = login.json()["token"]
+
+        # (case, headers, query params, expected status)
+        cases = [
+            ("no token", {}, {}, 401),
+            ("own token", {"Authorization": f"Bearer {tokens[alice]}"}, {}, 200),
+            ("other user's token", {"Authorization": f"Bearer {tokens[bob]}"}, {}, 403),
+            ("garbage token", {"Authorization": "Bearer not.a-token"}, {}, 401),
+            ("non-ASCII token", {"Authorization": "Bearer ñandú.señal".encode("utf-8")}, {}, 401),
+        ]
+        checks = [
+            (f"{name}, {case}", path, headers, params, status)
+            for name, path in account_routes(alice)
+            for case, headers, params, status in cases
+        ]
+        # EventSource can't send headers, so the stream also takes ?token=; a 200 would block here
+        checks += [
+            ("stream, no token", f"/auth/stream/{alice}", {}, {}, 401),
+            ("stream, other user's token", f"/auth/stream/{alice}", {}, {"token": tokens[bob]}, 403),
+            ("stream, non-ASCII ?token=", f"/auth/stream/{alice}", {}, {"token": "ñandú.señal"}, 401),
+        ]
+        search, bearer = "/auth/users/search", {"Authorization": f"Bearer {tokens[bob]}"}
+        checks += [
+            ("user search, no token", search, {}, {"q": prefix}, 401),
+            ("user search, garbage token", search, {"Authorization": "Bearer not.a-token"}, {"q": prefix}, 401),
+            ("user search, any user's token", search, bearer, {"q": prefix}, 200),
+            ("user search, one-letter prefix", search, bearer, {"q": "s"}, 422),
+        ]
+
+        for name, path, headers, params, status in checks:
+            total += 1
+            response = client.get(path, headers=headers, params=params)
+            ok = response.status_code == status
+            if not ok:
+                failures += 1
+            if args.verbose or not ok:
+                print(f"{'ok  ' if ok else 'FAIL'} {name:45} {response.status_code} (want {status})")
+
+    print(f"{total - failures} passed, {failures} failed")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
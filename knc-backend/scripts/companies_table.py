@@ -1,118 +1,45 @@
-# fix_companies_table.py
-from sqlalchemy import text
+# companies_table.py
+"""Make companies.is_active a BOOLEAN DEFAULT TRUE, converting existing values in place.
+
+Older databases stored is_active as text. The column is retyped with
+ALTER ... USING, so rows, ids and foreign references survive; nothing is dropped.
+Applied as migration 0003 by scripts/migrate.py; running this file directly
+does the same conversion on its own.
+"""
+from sqlalchemy import inspect, text
+from sqlalchemy.types import Boolean
+
 from database import engine
 
+def convert_is_active_to_boolean(connection):
+    """Make companies.is_active BOOLEAN DEFAULT TRUE; returns whether the column had to be retyped.
+
+    Rows inserted without is_active on a table built by create_all (which sets
+    no server default) are NULL and are treated as active.
+    """
+    if not inspect(connection).has_table("companies"):
+        return False
+    columns = {col['name']: col['type'] for col in inspect(connection).get_columns("companies")}
+    if "is_active" not in columns:
+        return False
+    retyped = not isinstance(columns["is_active"], Boolean)
+    if retyped:
+        connection.execute(text("ALTER TABLE companies ALTER COLUMN is_active DROP DEFAULT"))
+        connection.execute(text("""
+            ALTER TABLE companies ALTER COLUMN is_active TYPE BOOLEAN
+            USING (LOWER(TRIM(is_active::text)) IN ('true', 't', '1', 'yes'))
+        """))
+    connection.execute(text("ALTER TABLE companies ALTER COLUMN is_active SET DEFAULT TRUE"))
+    connection.execute(text("UPDATE companies SET is_active = TRUE WHERE is_active IS NULL"))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS idx_companies_active ON companies (is_active)"))
+    return retyped
+
 def fix_companies_table():
-    """Fix the is_active column data type in companies table"""
-    
-    with engine.connect() as connection:
-        trans = connection.begin()
-        
-        try:
-            print("Fixing companies table schema...")
-            
-            # First, let's see what data is currently in the table
-            result = connection.execute(text("SELECT name, is_active FROM companies LIMIT 5"))
-            existing_data = result.fetchall()
-            print(f"Current data sample: {existing_data}")
-            
-            # Method 1: If table is empty or you want to recreate it
-            print("Recreating companies table with correct schema...")
-            
-            # Drop existing table
-            connection.execute(text("DROP TABLE IF EXISTS companies CASCADE"))
-            
-            # Create new table with correct Boolean type
-            connection.execute(text("""
-                CREATE TABLE companies (
-                    id SERIAL PRIMARY KEY,
-                    name VARCHAR UNIQUE NOT NULL,
-                    category VARCHAR NOT NULL,
-                    is_active BOOLEAN DEFAULT TRUE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """))
-            
-            # Insert sample companies with proper boolean values
-            connection.execute(text("""
-                INSERT INTO companies (name, category, is_active) VALUES
-                ('MERALCO', 'utility', TRUE),
-                ('Maynilad', 'utility', TRUE),
-                ('PLDT', 'telecom', TRUE),
-                ('Globe', 'telecom', TRUE),
-                ('Smart', 'telecom', TRUE),
-                ('Sky Broadband', 'internet', TRUE),
-                ('Converge', 'internet', TRUE),
-                ('SSS', 'government', TRUE),
-                ('PhilHealth', 'government', TRUE),
-                ('Pag-IBIG', 'government', TRUE)
-            """))
-            
-            # Create index
-            connection.execute(text("""
-                CREATE INDEX IF NOT EXISTS idx_companies_active 
-                ON companies (is_active)
-            """))
-            
-            print("Companies table fixed successfully!")
-            
-            # Verify the fix
-            result = connection.execute(text("SELECT name, is_active FROM companies LIMIT 3"))
-            new_data = result.fetchall()
-            print(f"New data sample: {new_data}")
-            
-            trans.commit()
-            
-        except Exception as e:
-            trans.rollback()
-            print(f"Error fixing companies table: {e}")
-            
-            # Alternative method: If you want to preserve existing data
-            print("Trying alternative method with data preservation...")
-            
-            try:
-                # Create a temporary table with correct schema
-                connection.execute(text("""
-                    CREATE TABLE companies_temp (
-                        id SERIAL PRIMARY KEY,
-                        name VARCHAR UNIQUE NOT NULL,
-                        category VARCHAR NOT NULL,
-                        is_active BOOLEAN DEFAULT TRUE,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                """))
-                
-                # Copy data with proper conversion
-                connection.execute(text("""
-                    INSERT INTO companies_temp (name, category, is_active, created_at)
-                    SELECT 
-                        name, 
-                        category, 
-                        CASE 
-                            WHEN is_active = 'true' OR is_active = 'TRUE' OR is_active = '1' THEN TRUE 
-                            ELSE FALSE 
-                        END,
-                        created_at
-                    FROM companies
-                """))
-                
-                # Drop old table and rename
-                connection.execute(text("DROP TABLE companies"))
-                connection.execute(text("ALTER TABLE companies_temp RENAME TO companies"))
-                
-                # Create index
-                connection.execute(text("""
-                    CREATE INDEX IF NOT EXISTS idx_companies_active 
-                    ON companies (is_active)
-                """))
-                
-                trans.commit()
-                print("Companies table fixed with data preservation!")
-                
-            except Exception as e2:
-                trans.rollback()
-                print(f"Both methods failed: {e2}")
-                raise
+    with engine.begin() as connection:
+        if convert_is_active_to_boolean(connection):
+            print("Converted companies.is_active to BOOLEAN")
+        else:
+            print("companies.is_active was already BOOLEAN; default and NULLs fixed")
 
 if __name__ == "__main__":
-    fix_companies_table()
\ No newline at end of file
+    fix_companies_table()
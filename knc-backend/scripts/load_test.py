@@ -0,0 +1,332 @@
+# load_test.py
+"""Load test for the KNC Bank API with per-endpoint latency and query counts.
+
+Seeds users and billers straight into the database, then drives a weighted mix
+of login, balance, deposit, send-money, pay-bills and history requests from
+--concurrency workers for --duration seconds. By default the app runs in this
+process over httpx's ASGI transport, so no port or network is needed; --server
+starts it under uvicorn instead. DATABASE_URL picks the database (a local
+Postgres); without one a throwaway SQLite file is used.
+
+Reports requests/second, p50/p95/p99 latency and errors per endpoint, plus DB
+queries per request read from the app's own /metrics. Results are saved as JSON;
+pass an earlier file as --baseline to flag endpoints that got slower.
+
+    python scripts/load_test.py --users 200 --concurrency 32 --duration 20
+    python scripts/load_test.py --mix balance=60,history=40 --server
+    python scripts/load_test.py --baseline load-test-abc1234.json --max-regression 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if not os.getenv("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.gettempdir(), 'knc_load_test.db')}"
+    os.environ.setdefault("DB_MODE", "sync")
+
+import httpx
+import numpy as np
+
+from database import DB_MODE, Base, SessionLocal, engine
+from hashing import hash_pin
+from models import Company, User
+
+PIN = "1234"
+
+# Operation -> (method, route template as labelled in /metrics)
+ROUTES = {
+    "login": ("POST", "/auth/login"),
+    "balance": ("GET", "/auth/balance/{username}"),
+    "deposit": ("POST", "/auth/deposit"),
+    "send_money": ("POST", "/auth/send-money"),
+    "pay_bills": ("POST", "/auth/pay-bills"),
+    "history": ("GET", "/auth/transactions/{username}"),
+}
+
+MIXES = {
+    "default": {"login": 5, "balance": 35, "history": 20, "deposit": 15, "send_money": 15, "pay_bills": 10},
+    "read_heavy": {"balance": 60, "history": 35, "login": 5},
+    "write_heavy": {"deposit": 30, "send_money": 50, "pay_bills": 20},
+    "login": {"login": 100},
+}
+
+QUERY_SAMPLE = re.compile(r'^knc_http_request_db_queries_(sum|count)\{method="([^"]*)",route="([^"]*)"\} (\S+)$')
+
+# --- Seeding ---
+def seed(prefix, users, companies, opening_cents):
+    """Insert users (all with PIN 1234) and billers directly; returns (usernames, company names)"""
+    Base.metadata.create_all(bind=engine)
+    hashed_pin = hash_pin(PIN)
+    usernames = [f"{prefix}_{i}" for i in range(users)]
+    company_names = [f"{prefix} Biller {i}" for i in range(companies)]
+    with SessionLocal() as db:
+        db.add_all([
+            User(
+                first_name="Load",
+                last_name=str(i),
+                email=f"{username}@example.com",
+                username=username,
+                hashed_pin=hashed_pin,
+                balance_cents=opening_cents,
+            )
+            for i, username in enumerate(usernames)
+        ])
+        db.add_all([Company(name=name, category="utility", is_active=True) for name in company_names])
+        db.commit()
+    return usernames, company_names
+
+# --- Traffic ---
+def parse_mix(value):
+    if value in MIXES:
+        return MIXES[value]
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ROUTES:
+            raise argparse.ArgumentTypeError(f"Unknown operation {name!r}; choose from {', '.join(ROUTES)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+def build_request(operation, rng, usernames, company_names):
+    username = rng.choice(usernames)
+    if operation == "login":
+        return "POST", "/auth/login", {"username": username, "pin": PIN}
+    if operation == "balance":
+        return "GET", f"/auth/balance/{username}", None
+    if operation == "history":
+        return "GET", f"/auth/transactions/{username}", None
+    if operation == "deposit":
+        return "POST", "/auth/deposit", {"username": username, "amount": rng.randint(100, 1000)}
+    if operation == "send_money":
+        recipient = rng.choice(usernames)
+        while recipient == username and len(usernames) > 1:
+            recipient = rng.choice(usernames)
+        return "POST", "/auth/send-money", {
+            "sender_username": username, "recipient_username": recipient, "amount": rng.randint(1, 50),
+        }
+    return "POST", "/auth/pay-bills", {
+        "username": username, "company_name": rng.choice(company_names), "amount": rng.randint(1, 50),
+    }
+
+async def worker(client, mix, usernames, company_names, deadline, samples, errors, seed_value):
+    rng = random.Random(seed_value)
+    operations, weights = list(mix), list(mix.values())
+    while time.monotonic() < deadline:
+        operation = rng.choices(operations, weights)[0]
+        method, path, body = build_request(operation, rng, usernames, company_names)
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, path, json=body)
+            failed = response.status_code >= 400
+        except httpx.TransportError:
+            failed = True
+        samples[operation].append(time.perf_counter() - started)
+        if failed:
+            errors[operation] += 1
+
+async def drive(client, args, usernames, company_names):
+    """Run the mix for args.duration seconds; returns (latencies by operation, errors, elapsed)"""
+    samples = defaultdict(list)
+    errors = defaultdict(int)
+    started = time.monotonic()
+    deadline = started + args.duration
+    await asyncio.gather(*(
+        worker(client, args.mix, usernames, company_names, deadline, samples, errors, args.seed + i)
+        for i in range(args.concurrency)
+    ))
+    return samples, errors, time.monotonic() - started
+
+# --- Query Counts ---
+async def query_totals(client):
+    """{(method, route): [queries, requests]} from the app's Prometheus endpoint"""
+    totals = defaultdict(lambda: [0.0, 0.0])
+    response = await client.get("/metrics")
+    for line in response.text.splitlines():
+        match = QUERY_SAMPLE.match(line)
+        if match:
+            kind, method, route, value = match.groups()
+            totals[(method, route)][0 if kind == "sum" else 1] = float(value)
+    return totals
+
+def queries_per_request(before, after, operation):
+    key = ROUTES[operation]
+    queries = after[key][0] - before[key][0]
+    requests = after[key][1] - before[key][1]
+    return queries / requests if requests else None
+
+# --- Runners ---
+async def run_in_process(args, usernames, company_names):
+    from main import app
+
+    transport = httpx.ASGITransport(app=app)
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://knc", limits=limits, timeout=60) as client:
+            return await measure(client, args, usernames, company_names)
+
+async def run_server(args, usernames, company_names):
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port),
+         "--workers", "1", "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env=dict(os.environ),
+    )
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", limits=limits, timeout=60) as client:
+            await wait_until_up(client)
+            return await measure(client, args, usernames, company_names)
+    finally:
+        server.terminate()
+        server.wait()
+
+async def wait_until_up(client, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            await client.get("/")
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError("Server did not start in time")
+
+async def measure(client, args, usernames, company_names):
+    if args.warmup > 0:
+        warmup = argparse.Namespace(**{**vars(args), "duration": args.warmup})
+        await drive(client, warmup, usernames, company_names)
+    before = await query_totals(client)
+    samples, errors, elapsed = await drive(client, args, usernames, company_names)
+    after = await query_totals(client)
+    return summarize(samples, errors, elapsed, before, after)
+
+# --- Results ---
+def summarize(samples, errors, elapsed, before, after):
+    endpoints = {}
+    for operation in sorted(samples):
+        latencies = np.array(samples[operation]) * 1000
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        endpoints[operation] = {
+            "route": " ".join(ROUTES[operation]),
+            "requests": len(latencies),
+            "errors": errors[operation],
+            "rps": len(latencies) / elapsed,
+            "p50_ms": float(p50),
+            "p95_ms": float(p95),
+            "p99_ms": float(p99),
+            "queries_per_request": queries_per_request(before, after, operation),
+        }
+    total = sum(len(latencies) for latencies in samples.values())
+    return {
+        "elapsed_seconds": elapsed,
+        "requests": total,
+        "rps": total / elapsed,
+        "errors": sum(errors.values()),
+        "endpoints": endpoints,
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_results(results):
+    print(f"{'endpoint':<12} {'requests':>9} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'queries':>8} {'errors':>7}")
+    for operation, stats in results["endpoints"].items():
+        queries = stats["queries_per_request"]
+        print(
+            f"{operation:<12} {stats['requests']:>9} {stats['rps']:>9.1f} {stats['p50_ms']:>9.2f} "
+            f"{stats['p95_ms']:>9.2f} {stats['p99_ms']:>9.2f} "
+            f"{'-' if queries is None else f'{queries:.1f}':>8} {stats['errors']:>7}"
+        )
+    print(f"{'total':<12} {results['requests']:>9} {results['rps']:>9.1f}{'':>48} {results['errors']:>7}")
+
+def compare(results, baseline, max_regression):
+    """Endpoints whose p95 rose or throughput fell by more than max_regression percent"""
+    regressions = []
+    for operation, stats in results["endpoints"].items():
+        previous = baseline["endpoints"].get(operation)
+        if not previous:
+            continue
+        p95_change = (stats["p95_ms"] / previous["p95_ms"] - 1) * 100 if previous["p95_ms"] else 0.0
+        rps_change = (stats["rps"] / previous["rps"] - 1) * 100 if previous["rps"] else 0.0
+        print(f"{operation:<12} p95 {p95_change:+7.1f}%   req/s {rps_change:+7.1f}%")
+        if p95_change > max_regression or -rps_change > max_regression:
+            regressions.append(operation)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--companies", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--warmup", type=float, default=2.0, help="seconds of unmeasured traffic first")
+    parser.add_argument("--mix", type=parse_mix, default="default",
+                        help=f"one of {', '.join(MIXES)} or weights like balance=60,deposit=40")
+    parser.add_argument("--server", action="store_true", help="run the app under uvicorn instead of in-process")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="JSON results file (default load-test-<commit>.json)")
+    parser.add_argument("--baseline", help="earlier results to compare against")
+    parser.add_argument("--max-regression", type=float, default=15.0,
+                        help="percent p95 increase or req/s drop that fails the run with --baseline")
+    args = parser.parse_args()
+    if isinstance(args.mix, str):
+        args.mix = parse_mix(args.mix)
+
+    prefix = f"load_{uuid.uuid4().hex[:8]}"
+    usernames, company_names = seed(prefix, args.users, args.companies, opening_cents=10_000_000)
+    runner = run_server if args.server else run_in_process
+    results = asyncio.run(runner(args, usernames, company_names))
+
+    commit = git_commit()
+    results = {
+        "commit": commit,
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "database": engine.dialect.name,
+        "db_mode": DB_MODE,
+        "target": "uvicorn" if args.server else "in-process",
+        "config": {
+            "users": args.users,
+            "companies": args.companies,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "mix": args.mix,
+        },
+        **results,
+    }
+    print(f"{results['target']} app, {results['database']} ({DB_MODE}), "
+          f"{args.concurrency} workers for {args.duration:.0f}s")
+    print_results(results)
+
+    output = args.output or f"load-test-{commit or 'local'}.json"
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"Compared with {args.baseline} ({baseline.get('commit')}):")
+        regressions = compare(results, baseline, args.max_regression)
+        if regressions:
+            print(f"REGRESSED: {', '.join(regressions)}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+# migrate.py
+"""Apply pending schema migrations and record them in schema_migrations.
+
+Run once per deploy, before starting workers; the app never changes the schema
+at startup (unless MIGRATE_ON_STARTUP is set) and /health/ready reports 503
+until every migration is applied. Each step runs once per database. Steps that
+backfill or copy large tables run online in small committed chunks, and a
+Postgres advisory lock keeps concurrent runs from overlapping.
+
+The destructive contract steps only run when asked for, once every server runs
+code that no longer needs what they remove:
+
+    python scripts/migrate.py
+    python scripts/migrate.py --status
+    python scripts/migrate.py --drop-float-money --drop-unpartitioned-transactions
+"""
+import argparse
+import logging
+
+import migrations
+from database import engine
+
+def print_status():
+    with engine.connect() as connection:
+        done = migrations.applied_versions(connection)
+    for migration in migrations.applicable(engine.dialect.name):
+        state = "applied" if migration.version in done else "pending"
+        print(f"  {migration.version}  {state:8} {migration.description}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--status", action="store_true", help="list migrations and whether each is applied")
+    parser.add_argument("--drop-float-money", action="store_true",
+                        help="drop the legacy float balance/amount columns and their sync triggers")
+    parser.add_argument("--drop-unpartitioned-transactions", action="store_true",
+                        help="drop the pre-partitioning transactions table kept after the swap")
+    args = parser.parse_args()
+
+    if args.status:
+        print_status()
+        return
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    applied = migrations.upgrade(engine)
+    print(f"Applied {len(applied)} migrations" + (f": {', '.join(applied)}" if applied else "; schema is current"))
+
+    if args.drop_float_money or args.drop_unpartitioned_transactions:
+        from scripts.migration_script import drop_float_money_columns, drop_unpartitioned_transactions
+
+        if args.drop_float_money:
+            drop_float_money_columns()
+        if args.drop_unpartitioned_transactions:
+            drop_unpartitioned_transactions()
+
+if __name__ == "__main__":
+    main()
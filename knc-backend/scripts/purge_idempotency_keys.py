@@ -0,0 +1,12 @@
+# purge_idempotency_keys.py
+# Expired keys are already ignored by the API; run this from cron to reclaim the space.
+from database import SessionLocal
+from idempotency import purge_expired
+
+if __name__ == "__main__":
+    db = SessionLocal()
+    try:
+        removed = purge_expired(db)
+        print(f"Purged {removed} expired idempotency keys")
+    finally:
+        db.close()
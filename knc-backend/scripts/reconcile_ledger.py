@@ -0,0 +1,256 @@
+# reconcile_ledger.py
+"""End-of-day reconciliation of account balances against the transaction ledger.
+
+Every account's balance should equal its credits (deposit, receive_money) minus
+its debits (withdraw, send_money, pay_bills). A full run streams the whole
+transactions table through a server-side cursor in chunks and sums signed
+amounts per user with NumPy, so memory stays proportional to the number of
+accounts rather than transactions. An incremental run only re-checks accounts
+with transactions since the previous run, using a grouped query per chunk of
+accounts. Totals of partitions already archived by archive_transactions.py
+are added back from archived_ledger_totals. Balances and transactions are read from one REPEATABLE READ snapshot,
+so postings that land mid-run never show up as drift.
+
+Mismatches are written to a CSV report and the script exits non-zero if any
+were found.
+
+    python scripts/reconcile_ledger.py --report reconciliation.csv
+    python scripts/reconcile_ledger.py --incremental
+"""
+import argparse
+import csv
+import sys
+import time
+from datetime import date
+
+import numpy as np
+from sqlalchemy import case, func, select
+
+from database import SessionLocal, engine
+from models import ArchivedLedgerTotal, SummaryWatermark, Transaction, User
+from money import cents_to_float
+
+CREDIT_TYPES = ("deposit", "receive_money")
+DEBIT_TYPES = ("withdraw", "send_money", "pay_bills")
+
+WATERMARK_NAME = "reconciliation"
+
+REPORT_FIELDS = ["user_id", "username", "balance", "ledger_total", "difference", "transactions", "unknown_types"]
+
+# +1 credit, -1 debit, 0 for a type the ledger doesn't know (reported, never summed)
+SIGN = case(
+    (Transaction.transaction_type.in_(CREDIT_TYPES), 1),
+    (Transaction.transaction_type.in_(DEBIT_TYPES), -1),
+    else_=0,
+)
+
+class LedgerTotals:
+    """Per-user running sums indexed by user id, grown as larger ids show up"""
+
+    def __init__(self, size: int = 0):
+        self.totals = np.zeros(size, dtype=np.int64)  # centavos
+        self.counts = np.zeros(size, dtype=np.int64)
+        self.unknown = np.zeros(size, dtype=np.int64)
+
+    def _grow(self, size: int):
+        if size > len(self.totals):
+            size = max(size, len(self.totals) * 2)
+            for name in ("totals", "counts", "unknown"):
+                current = getattr(self, name)
+                grown = np.zeros(size, dtype=current.dtype)
+                grown[:len(current)] = current
+                setattr(self, name, grown)
+
+    def add_chunk(self, user_ids, signs, amounts):
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        signs = np.asarray(signs, dtype=np.int8)
+        amounts = np.asarray(amounts, dtype=np.int64)
+        size = int(user_ids.max()) + 1
+        self._grow(size)
+        # bincount sums in float64, exact for per-chunk centavo totals below 2**53
+        self.totals[:size] += np.rint(np.bincount(user_ids, weights=amounts * signs, minlength=size)).astype(np.int64)
+        self.counts[:size] += np.bincount(user_ids, minlength=size)
+        self.unknown[:size] += np.bincount(user_ids, weights=(signs == 0), minlength=size).astype(np.int64)
+
+    def add_rows(self, rows):
+        """Rows already grouped by user: (user_id, total, count, unknown)"""
+        for user_id, total, count, unknown in rows:
+            self._grow(user_id + 1)
+            self.totals[user_id] += int(total)
+            self.counts[user_id] += count
+            self.unknown[user_id] += unknown
+
+# --- Snapshot Reads ---
+def snapshot_connection():
+    connection = engine.connect()
+    if engine.dialect.name == "postgresql":
+        connection = connection.execution_options(isolation_level="REPEATABLE READ", postgresql_readonly=True)
+    return connection
+
+def stream_ledger_totals(connection, chunk_size: int):
+    totals = LedgerTotals()
+    scanned = 0
+    result = connection.execution_options(stream_results=True, yield_per=chunk_size).execute(
+        select(Transaction.user_id, SIGN, Transaction.amount_cents)
+    )
+    for chunk in result.partitions():
+        user_ids, signs, amounts = zip(*chunk)
+        totals.add_chunk(user_ids, signs, amounts)
+        scanned += len(chunk)
+    return totals, scanned
+
+def grouped_ledger_totals(connection, user_ids, chunk_size: int):
+    totals = LedgerTotals()
+    scanned = 0
+    for start in range(0, len(user_ids), chunk_size):
+        chunk = user_ids[start:start + chunk_size]
+        rows = connection.execute(
+            select(
+                Transaction.user_id,
+                func.sum(Transaction.amount_cents * SIGN),
+                func.count(),
+                func.count().filter(SIGN == 0),
+            )
+            .where(Transaction.user_id.in_(chunk))
+            .group_by(Transaction.user_id)
+        ).all()
+        totals.add_rows(rows)
+        scanned += sum(row[2] for row in rows)
+    return totals, scanned
+
+def archived_totals(connection, user_ids=None):
+    """Rows for LedgerTotals.add_rows from archived_ledger_totals, for every user or for user_ids"""
+    query = select(
+        ArchivedLedgerTotal.user_id,
+        ArchivedLedgerTotal.total_cents,
+        ArchivedLedgerTotal.transaction_count,
+        ArchivedLedgerTotal.unknown_count,
+    )
+    if user_ids is not None:
+        query = query.where(ArchivedLedgerTotal.user_id.in_(user_ids))
+    return connection.execute(query).all()
+
+def touched_user_ids(connection, after_id: int):
+    return connection.execute(
+        select(Transaction.user_id).where(Transaction.id > after_id).distinct()
+    ).scalars().all()
+
+def account_balances(connection, chunk_size: int, user_ids=None):
+    """Balances in centavos indexed by user id (NaN where there is no account), for every account or for user_ids"""
+    query = select(User.id, User.balance_cents)
+    if user_ids is None:
+        chunks = connection.execution_options(stream_results=True, yield_per=chunk_size).execute(query).partitions()
+    else:
+        chunks = (
+            connection.execute(query.where(User.id.in_(user_ids[start:start + chunk_size]))).all()
+            for start in range(0, len(user_ids), chunk_size)
+        )
+    balances = np.full(0, np.nan)
+    for chunk in chunks:
+        if not chunk:
+            continue
+        ids, amounts = (np.asarray(column) for column in zip(*chunk))
+        if ids.max() >= len(balances):
+            grown = np.full(max(int(ids.max()) + 1, len(balances) * 2), np.nan)
+            grown[:len(balances)] = balances
+            balances = grown
+        balances[ids] = amounts
+    return balances
+
+def usernames_for(connection, user_ids):
+    if not user_ids:
+        return {}
+    return dict(connection.execute(select(User.id, User.username).where(User.id.in_(user_ids))).all())
+
+# --- Diff ---
+def find_mismatches(totals: LedgerTotals, balances, tolerance_cents: int = 0):
+    """Ids of accounts whose balance is off from their ledger, plus ids with ledger rows but no account"""
+    size = max(len(totals.totals), len(balances))
+    ledger = np.zeros(size, dtype=np.int64)
+    ledger[:len(totals.totals)] = totals.totals
+    counts = np.zeros(size, dtype=np.int64)
+    counts[:len(totals.counts)] = totals.counts
+    unknown = np.zeros(size, dtype=np.int64)
+    unknown[:len(totals.unknown)] = totals.unknown
+    balance = np.full(size, np.nan)
+    balance[:len(balances)] = balances
+
+    has_account = ~np.isnan(balance)
+    off = np.abs(np.where(has_account, balance, 0.0) - ledger) > tolerance_cents
+    bad = (has_account & (off | (unknown > 0))) | (~has_account & (counts > 0))
+    return [
+        {
+            "user_id": user_id,
+            "balance": None if np.isnan(balance[user_id]) else cents_to_float(int(balance[user_id])),
+            "ledger_total": cents_to_float(int(ledger[user_id])),
+            "difference": None if np.isnan(balance[user_id]) else cents_to_float(int(balance[user_id]) - int(ledger[user_id])),
+            "transactions": int(counts[user_id]),
+            "unknown_types": int(unknown[user_id]),
+        }
+        for user_id in np.flatnonzero(bad).tolist()
+    ]
+
+def write_report(path: str, mismatches):
+    with open(path, "w", newline="", encoding="utf-8") as report:
+        writer = csv.DictWriter(report, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
+        writer.writerows(mismatches)
+
+# --- Watermark ---
+def last_checked_id() -> int:
+    with SessionLocal() as db:
+        watermark = db.get(SummaryWatermark, WATERMARK_NAME)
+        return watermark.last_transaction_id if watermark else 0
+
+def save_checked_id(transaction_id: int):
+    with SessionLocal() as db:
+        watermark = db.get(SummaryWatermark, WATERMARK_NAME)
+        if watermark is None:
+            watermark = SummaryWatermark(name=WATERMARK_NAME)
+            db.add(watermark)
+        watermark.last_transaction_id = transaction_id
+        watermark.updated_at = func.now()
+        db.commit()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--incremental", action="store_true",
+                        help="only check accounts with transactions since the last run")
+    parser.add_argument("--chunk-size", type=int, default=100000,
+                        help="rows per fetch when streaming (accounts per query when incremental)")
+    parser.add_argument("--tolerance-cents", type=int, default=0,
+                        help="allowed difference; balances are integer centavos, so 0 means exact")
+    parser.add_argument("--report", default=f"reconciliation-{date.today().isoformat()}.csv")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    after_id = last_checked_id() if args.incremental else 0
+    with snapshot_connection() as connection, connection.begin():
+        high_id = connection.execute(select(func.coalesce(func.max(Transaction.id), 0))).scalar()
+        if args.incremental:
+            user_ids = touched_user_ids(connection, after_id)
+            totals, scanned = grouped_ledger_totals(connection, user_ids, min(args.chunk_size, 1000))
+            totals.add_rows(archived_totals(connection, user_ids))
+            balances = account_balances(connection, min(args.chunk_size, 1000), user_ids)
+            checked = len(user_ids)
+        else:
+            totals, scanned = stream_ledger_totals(connection, args.chunk_size)
+            totals.add_rows(archived_totals(connection))
+            balances = account_balances(connection, args.chunk_size)
+            checked = int(np.count_nonzero(~np.isnan(balances)))
+
+        mismatches = find_mismatches(totals, balances, args.tolerance_cents)
+        usernames = usernames_for(connection, [row["user_id"] for row in mismatches])
+        for row in mismatches:
+            row["username"] = usernames.get(row["user_id"], "")
+
+    write_report(args.report, mismatches)
+    save_checked_id(high_id)
+
+    print(f"Checked {checked} accounts against {scanned} transactions "
+          f"(through id {high_id}) in {time.perf_counter() - started:.1f}s")
+    print(f"{len(mismatches)} mismatches written to {args.report}")
+    sys.exit(1 if mismatches else 0)
+
+if __name__ == "__main__":
+    main()
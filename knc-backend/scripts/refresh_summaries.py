@@ -0,0 +1,10 @@
+# refresh_summaries.py
+# Backfills daily_account_summary on first run, then folds in new transactions.
+# The API workers do this every SUMMARY_REFRESH_SECONDS; set that to 0 to run this from cron instead.
+from database import SessionLocal
+from summaries import refresh_summaries
+
+if __name__ == "__main__":
+    with SessionLocal() as db:
+        added = refresh_summaries(db)
+    print(f"Added {added} transactions to the daily account summary")
@@ -0,0 +1,35 @@
+# settle_billers.py
+"""Settle bill payments with the billers they were paid to.
+
+For every company with pay_bills rows newer than its watermark (and older than
+SETTLEMENT_SETTLE_SECONDS), cuts one settlement covering those rows, then
+streams them to a CSV file under --dir and records the count and total owed in
+biller_settlements. A cycle reads only rows paid since the previous one.
+
+Safe to rerun at any point: settled ranges are never cut again, and a
+settlement left pending by an interrupted run is exported again from its fixed
+range on the next run. Meant for cron; concurrent runs skip each other's work.
+
+    python scripts/settle_billers.py --dir /var/lib/knc/settlements
+"""
+import argparse
+
+from database import SessionLocal
+from money import from_cents
+from settlements import SETTLEMENT_CHUNK_SIZE, SETTLEMENT_DIR, run_settlement_cycle
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dir", default=SETTLEMENT_DIR, help="directory for settlement files")
+    parser.add_argument("--chunk-size", type=int, default=SETTLEMENT_CHUNK_SIZE, help="rows per fetch while exporting")
+    args = parser.parse_args()
+
+    with SessionLocal() as db:
+        opened, exported = run_settlement_cycle(db, args.dir, args.chunk_size)
+    print(f"Cut {opened} new settlements; exported {len(exported)}")
+    for settlement in exported:
+        print(f"  #{settlement['id']} {settlement['company']}: {settlement['transactions']} payments, "
+              f"PHP {from_cents(settlement['total_cents'])} -> {settlement['path']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# stress_ledger.py
+"""Concurrency stress test for ledger postings.
+
+Hammers a few hot accounts with concurrent transfers and withdrawals from many
+threads, then checks that every account's balance equals its opening balance
+plus the postings that committed, that no balance went negative, and that no
+deadlocks happened. Exits non-zero if any check fails.
+
+    python scripts/stress_ledger.py --accounts 4 --threads 32 --ops 200
+"""
+import argparse
+import random
+import sys
+import threading
+import uuid
+from collections import defaultdict
+from decimal import Decimal
+
+from sqlalchemy import delete, select
+from sqlalchemy.exc import DBAPIError
+
+import ledger
+from money import from_cents, to_cents
+from database import Base, SessionLocal, engine
+from models import User
+
+def seed_accounts(prefix, count, opening_cents):
+    usernames = [f"{prefix}_{i}" for i in range(count)]
+    with SessionLocal() as db:
+        db.add_all([
+            User(
+                first_name="Stress",
+                last_name=str(i),
+                email=f"{username}@example.com",
+                username=username,
+                hashed_pin="!",
+                balance_cents=opening_cents,
+            )
+            for i, username in enumerate(usernames)
+        ])
+        db.commit()
+    return usernames
+
+def run_worker(usernames, ops, applied, counters, lock):
+    rng = random.Random()
+    local = defaultdict(int)
+    with SessionLocal() as db:
+        for _ in range(ops):
+            amount = rng.randint(1, 5000)  # centavos
+            try:
+                if rng.random() < 0.8:
+                    sender, recipient = rng.sample(usernames, 2)
+                    ledger.transfer(db, sender, recipient, amount)
+                    deltas = {sender: -amount, recipient: amount}
+                else:
+                    username = rng.choice(usernames)
+                    ledger.debit(db, username, amount)
+                    deltas = {username: -amount}
+                db.commit()
+                for username, delta in deltas.items():
+                    local[username] += delta
+                outcome = "committed"
+            except ledger.InsufficientFunds:
+                db.rollback()
+                outcome = "insufficient"
+            except DBAPIError as e:
+                db.rollback()
+                outcome = "deadlocks" if "deadlock" in str(e.orig).lower() else "db_errors"
+            with lock:
+                counters[outcome] += 1
+    with lock:
+        for username, delta in local.items():
+            applied[username] += delta
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--accounts", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--ops", type=int, default=200)
+    parser.add_argument("--opening-balance", type=Decimal, default=Decimal("1000"))
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    prefix = f"stress_{uuid.uuid4().hex[:8]}"
+    opening_cents = to_cents(args.opening_balance)
+    usernames = seed_accounts(prefix, args.accounts, opening_cents)
+
+    applied = defaultdict(int)
+    counters = defaultdict(int)
+    lock = threading.Lock()
+    threads = [
+        threading.Thread(target=run_worker, args=(usernames, args.ops, applied, counters, lock))
+        for _ in range(args.threads)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with SessionLocal() as db:
+        balances = dict(db.execute(
+            select(User.username, User.balance_cents).where(User.username.in_(usernames))
+        ).all())
+        db.execute(delete(User).where(User.username.in_(usernames)))
+        db.commit()
+
+    failures = []
+    for username in usernames:
+        expected = opening_cents + applied[username]
+        if balances[username] != expected:
+            failures.append(f"{username}: balance {from_cents(balances[username])}, expected {from_cents(expected)}")
+        if balances[username] < 0:
+            failures.append(f"{username}: negative balance {from_cents(balances[username])}")
+    if counters.get("deadlocks"):
+        failures.append(f"{counters['deadlocks']} deadlocks")
+
+    print(f"Postings: {dict(counters)}")
+    if failures:
+        print("FAILED")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+    print("OK: no lost updates, no negative balances, no deadlocks")
+
+if __name__ == "__main__":
+    main()
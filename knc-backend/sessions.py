@@ -0,0 +1,144 @@
+# sessions.py
+
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import time
+from datetime import datetime, timezone
+from typing import Optional
+from fastapi import Header, HTTPException, Query
+from dotenv import load_dotenv
+from cache import LRUBackend
+
+load_dotenv()
+
+log = logging.getLogger("knc.sessions")
+
+# Key for signing session tokens; every worker must share it for tokens to work across them
+SESSION_SECRET = os.getenv("SESSION_SECRET")
+
+if not SESSION_SECRET:
+    SESSION_SECRET = secrets.token_hex(32)
+    log.warning("SESSION_SECRET not set; session tokens only work on the worker that issued them")
+
+# Seconds a session token issued at login stays valid
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", "900"))
+
+# Require a token on balance and history routes (off: a token is checked only when one is sent)
+SESSION_REQUIRED = os.getenv("SESSION_REQUIRED", "false").lower() in ("1", "true", "yes")
+
+# Seconds a successful PIN check is remembered so repeat logins skip bcrypt (0 disables)
+CREDENTIAL_CACHE_SECONDS = float(os.getenv("CREDENTIAL_CACHE_SECONDS", "300"))
+
+_key = SESSION_SECRET.encode('utf-8')
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode('ascii')
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+def _sign(payload: str) -> bytes:
+    return _b64encode(hmac.new(_key, payload.encode('utf-8'), hashlib.sha256).digest()).encode('ascii')
+
+# --- Tokens ---
+def issue_token(username: str):
+    """(token, expires_at) for a user who just logged in"""
+    expires = int(time.time()) + SESSION_TTL_SECONDS
+    payload = _b64encode(json.dumps({"sub": username, "exp": expires}, separators=(",", ":")).encode('utf-8'))
+    return f"{payload}.{_sign(payload).decode('ascii')}", datetime.fromtimestamp(expires, timezone.utc)
+
+def verify_token(token: str) -> Optional[str]:
+    """Username the token was issued to, or None if it is forged, malformed or expired"""
+    payload, _, signature = token.partition(".")
+    # Compared as bytes: tokens come from headers and query strings and may hold any character
+    if not signature or not hmac.compare_digest(signature.encode('utf-8'), _sign(payload)):
+        return None
+    try:
+        claims = json.loads(_b64decode(payload))
+    except ValueError:
+        return None
+    if not isinstance(claims, dict) or claims.get("exp", 0) < time.time():
+        return None
+    return claims.get("sub")
+
+def _check_token(username: str, token: Optional[str]):
+    if token is None:
+        if SESSION_REQUIRED:
+            raise HTTPException(status_code=401, detail="Login required", headers={"WWW-Authenticate": "Bearer"})
+        return None
+    subject = verify_token(token)
+    if subject is None:
+        raise HTTPException(status_code=401, detail="Invalid or expired session", headers={"WWW-Authenticate": "Bearer"})
+    if subject != username:
+        raise HTTPException(status_code=403, detail="Session does not match this account")
+    return subject
+
+def check_session(username: str, authorization: Optional[str] = Header(None)):
+    """Dependency for routes keyed by a {username} path parameter.
+
+    A valid bearer token must belong to that username. Verifying it costs one
+    HMAC, no database or bcrypt work.
+    """
+    if authorization is None:
+        return _check_token(username, None)
+    scheme, _, token = authorization.partition(" ")
+    return _check_token(username, token.strip() if scheme.lower() == "bearer" else "")
+
+def check_any_session(authorization: Optional[str] = Header(None)):
+    """Dependency for routes not keyed by an account, such as the user directory.
+
+    Any user's valid bearer token will do, but one is always required, whatever
+    SESSION_REQUIRED says: these routes expose other people's details.
+    """
+    scheme, _, token = (authorization or "").partition(" ")
+    subject = verify_token(token.strip()) if scheme.lower() == "bearer" else None
+    if subject is None:
+        raise HTTPException(status_code=401, detail="Login required", headers={"WWW-Authenticate": "Bearer"})
+    return subject
+
+async def check_stream_session(username: str, authorization: Optional[str] = Header(None), token: Optional[str] = Query(None)):
+    """check_session for the event stream, which also takes ?token= since EventSource can't set headers.
+
+    Async because it is only an HMAC: stream opens come in bursts when clients
+    reconnect, and this keeps them off the threadpool.
+    """
+    if authorization is not None:
+        return check_session(username, authorization)
+    return _check_token(username, token)
+
+# --- Credential Check Cache ---
+class CredentialCache:
+    """Remembers successful PIN checks in this process for a short time.
+
+    Stores an HMAC of (username, stored hash, PIN) under the server secret, so a
+    PIN change invalidates the entry and nothing here is reusable elsewhere.
+    Failed checks are never cached; those are what the login limiter counts.
+    """
+
+    def __init__(self, ttl: float = CREDENTIAL_CACHE_SECONDS):
+        self.ttl = ttl
+        self._entries = LRUBackend()
+
+    def _digest(self, username: str, hashed_pin: str, pin: str) -> str:
+        message = "\0".join((username, hashed_pin, pin)).encode('utf-8')
+        return hmac.new(_key, message, hashlib.sha256).hexdigest()
+
+    def matches(self, username: str, hashed_pin: str, pin: str) -> bool:
+        if self.ttl <= 0:
+            return False
+        remembered = self._entries.get(username)
+        return remembered is not None and hmac.compare_digest(remembered, self._digest(username, hashed_pin, pin))
+
+    def remember(self, username: str, hashed_pin: str, pin: str):
+        if self.ttl > 0:
+            self._entries.set(username, self._digest(username, hashed_pin, pin), self.ttl)
+
+    def forget(self, username: str):
+        self._entries.delete(username)
+
+credential_cache = CredentialCache()
@@ -0,0 +1,160 @@
+# settlements.py
+
+import csv
+import logging
+import os
+from datetime import timedelta
+from sqlalchemy import func, select
+from dotenv import load_dotenv
+from models import BillerSettlement, Company, Transaction
+from money import from_cents
+from summaries import claim_watermark
+
+load_dotenv()
+
+# pay_bills rows younger than this wait for the next cycle, so rows still being
+# committed by in-flight payments are never skipped past by a watermark
+SETTLEMENT_SETTLE_SECONDS = float(os.getenv("SETTLEMENT_SETTLE_SECONDS", "60"))
+
+# Rows fetched per server-side cursor round-trip while writing a settlement file
+SETTLEMENT_CHUNK_SIZE = int(os.getenv("SETTLEMENT_CHUNK_SIZE", "10000"))
+
+# Directory settlement files are written to
+SETTLEMENT_DIR = os.getenv("SETTLEMENT_DIR", "settlements")
+
+SETTLEMENT_FIELDS = ["reference_number", "timestamp", "user_id", "amount", "notes"]
+
+log = logging.getLogger("knc.settlements")
+
+def watermark_name(company_id: int) -> str:
+    """summary_watermarks row holding the highest pay_bills id already settled for a company"""
+    return f"biller_settlement:{company_id}"
+
+# --- Queries ---
+# Both only touch the company's rows past a watermark, through idx_transactions_bill_company_id,
+# so a cycle costs what was paid since the last one, not what the table holds
+
+def _company_bills(company_name: str):
+    return (Transaction.transaction_type == "pay_bills", Transaction.bill_company == company_name)
+
+def _settled_high_id(db, company_name: str, low: int):
+    return db.execute(
+        select(func.max(Transaction.id)).where(
+            *_company_bills(company_name),
+            Transaction.id > low,
+            Transaction.timestamp < func.now() - timedelta(seconds=SETTLEMENT_SETTLE_SECONDS),
+        )
+    ).scalar()
+
+def settlement_rows_query(settlement: BillerSettlement):
+    """The pay_bills rows a settlement covers, in id order"""
+    return (
+        select(
+            Transaction.reference_number,
+            Transaction.timestamp,
+            Transaction.user_id,
+            Transaction.amount_cents,
+            Transaction.notes,
+        )
+        .where(
+            *_company_bills(settlement.company_name),
+            Transaction.id > settlement.after_transaction_id,
+            Transaction.id <= settlement.through_transaction_id,
+        )
+        .order_by(Transaction.id)
+    )
+
+# --- Cycle ---
+def open_settlements(db) -> int:
+    """Cut a pending settlement for each company with newly settled payments; returns how many.
+
+    Each company's record is committed together with its advanced watermark while
+    holding the watermark's row lock, so a range is never cut twice: a concurrent
+    run skips the company and a rerun finds nothing new.
+    """
+    opened = 0
+    companies = db.execute(select(Company.id, Company.name).order_by(Company.id)).all()
+    for company_id, company_name in companies:
+        watermark = claim_watermark(db, watermark_name(company_id))
+        if watermark is None:
+            db.rollback()
+            continue
+
+        low = watermark.last_transaction_id
+        high = _settled_high_id(db, company_name, low)
+        if high is not None:
+            db.add(BillerSettlement(
+                company_id=company_id,
+                company_name=company_name,
+                after_transaction_id=low,
+                through_transaction_id=high,
+                status="pending",
+            ))
+            watermark.last_transaction_id = high
+            opened += 1
+        watermark.updated_at = func.now()
+        db.commit()
+    return opened
+
+def settlement_path(directory: str, settlement: BillerSettlement) -> str:
+    return os.path.join(directory, f"settlement-{settlement.id:06d}-company-{settlement.company_id}.csv")
+
+def write_settlement_file(db, settlement: BillerSettlement, path: str, chunk_size: int):
+    """Stream a settlement's rows to a CSV file; returns (rows, total_cents). The file only appears once complete."""
+    count = total_cents = 0
+    partial = path + ".partial"
+    with open(partial, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(SETTLEMENT_FIELDS)
+        result = db.execute(settlement_rows_query(settlement).execution_options(yield_per=chunk_size))
+        for rows in result.partitions():
+            writer.writerows(
+                (row.reference_number, row.timestamp.isoformat(), row.user_id, from_cents(row.amount_cents), row.notes)
+                for row in rows
+            )
+            count += len(rows)
+            total_cents += sum(row.amount_cents for row in rows)
+    os.replace(partial, path)
+    return count, total_cents
+
+def export_pending(db, directory: str = SETTLEMENT_DIR, chunk_size: int = SETTLEMENT_CHUNK_SIZE):
+    """Write the file and totals of every pending settlement; returns what was exported.
+
+    A settlement's id range is fixed when it is cut and its rows no longer change,
+    so exporting again after a crash rewrites the same file with the same totals.
+    """
+    os.makedirs(directory, exist_ok=True)
+    exported = []
+    while True:
+        settlement = db.execute(
+            select(BillerSettlement)
+            .where(BillerSettlement.status == "pending")
+            .order_by(BillerSettlement.id)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        ).scalars().first()
+        if settlement is None:
+            db.rollback()
+            return exported
+
+        path = settlement_path(directory, settlement)
+        count, total_cents = write_settlement_file(db, settlement, path, chunk_size)
+        settlement.transaction_count = count
+        settlement.total_cents = total_cents
+        settlement.export_path = path
+        settlement.status = "exported"
+        settlement.exported_at = func.now()
+        exported.append({
+            "id": settlement.id,
+            "company": settlement.company_name,
+            "transactions": count,
+            "total_cents": total_cents,
+            "path": path,
+        })
+        db.commit()
+        log.info("Settled %d bill payments to %s in %s", count, exported[-1]["company"], path)
+
+def run_settlement_cycle(db, directory: str = SETTLEMENT_DIR, chunk_size: int = SETTLEMENT_CHUNK_SIZE):
+    """Cut new settlements, then export them along with any an earlier run left pending"""
+    opened = open_settlements(db)
+    return opened, export_pending(db, directory, chunk_size)
@@ -0,0 +1,93 @@
+# statements.py
+
+import csv
+import io
+import json
+from sqlalchemy import select
+from database import SessionLocal, AsyncSessionLocal
+from models import Transaction
+from money import cents_to_float
+
+# Rows fetched per server-side cursor round-trip, and per chunk written to the client
+EXPORT_CHUNK_SIZE = 1000
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+STATEMENT_FIELDS = [
+    "reference_number", "type", "amount", "description", "timestamp",
+    "recipient", "sender", "company", "notes"
+]
+
+def statement_query(user_id: int):
+    """Column-only query for a user's full history, oldest first"""
+    return (
+        select(
+            Transaction.reference_number,
+            Transaction.transaction_type,
+            Transaction.amount_cents,
+            Transaction.description,
+            Transaction.timestamp,
+            Transaction.recipient_username,
+            Transaction.sender_username,
+            Transaction.bill_company,
+            Transaction.notes,
+        )
+        .where(Transaction.user_id == user_id)
+        .order_by(Transaction.timestamp, Transaction.id)
+    )
+
+# --- Formatting ---
+def _row_values(row):
+    values = list(row)
+    values[2] = cents_to_float(row.amount_cents)
+    values[4] = row.timestamp.isoformat() if row.timestamp else None
+    return values
+
+def format_csv_chunk(rows, header: bool = False) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(STATEMENT_FIELDS)
+    writer.writerows(_row_values(row) for row in rows)
+    return buffer.getvalue()
+
+def format_ndjson_chunk(rows, header: bool = False) -> str:
+    return "".join(
+        json.dumps(dict(zip(STATEMENT_FIELDS, _row_values(row)))) + "\n"
+        for row in rows
+    )
+
+FORMATTERS = {
+    "csv": format_csv_chunk,
+    "ndjson": format_ndjson_chunk,
+}
+
+# --- Streaming ---
+def stream_statement(query, export_format: str, session_factory=SessionLocal):
+    """Yield formatted chunks from a server-side cursor.
+
+    Owns its session because the request's get_db session is closed before a
+    StreamingResponse body starts. session_factory picks the database
+    (read_sessionmaker() for the replica).
+    """
+    formatter = FORMATTERS[export_format]
+    header = formatter([], header=True)
+    if header:
+        yield header
+    with session_factory() as db:
+        result = db.execute(query.execution_options(yield_per=EXPORT_CHUNK_SIZE))
+        for rows in result.partitions():
+            yield formatter(rows)
+
+async def stream_statement_async(query, export_format: str, session_factory=AsyncSessionLocal):
+    formatter = FORMATTERS[export_format]
+    header = formatter([], header=True)
+    if header:
+        yield header
+    async with session_factory() as db:
+        result = await db.stream(query.execution_options(yield_per=EXPORT_CHUNK_SIZE))
+        async for rows in result.partitions():
+            yield formatter(rows)
@@ -0,0 +1,288 @@
+# summaries.py
+
+import asyncio
+import logging
+import os
+from datetime import date, timedelta
+from typing import Optional
+import numpy as np
+from sqlalchemy import Date, and_, case, cast, exists, func, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from dotenv import load_dotenv
+from models import DailyAccountSummary, SummaryWatermark, Transaction, User
+from money import cents_to_float
+
+load_dotenv()
+
+# Calendar days are cut in this zone, not in the database server's
+SUMMARY_TIMEZONE = os.getenv("SUMMARY_TIMEZONE", "Asia/Manila")
+
+# Transactions younger than this are left for the next run, so rows still being
+# committed by in-flight postings are never skipped past by the watermark
+SUMMARY_SETTLE_SECONDS = float(os.getenv("SUMMARY_SETTLE_SECONDS", "60"))
+
+# Transactions aggregated per database transaction
+SUMMARY_BATCH_SIZE = int(os.getenv("SUMMARY_BATCH_SIZE", "10000"))
+
+# Seconds between background refreshes in each worker (0 leaves it to scripts/refresh_summaries.py)
+SUMMARY_REFRESH_SECONDS = float(os.getenv("SUMMARY_REFRESH_SECONDS", "30"))
+
+CREDIT_TYPES = ("deposit", "receive_money")
+WATERMARK_NAME = "daily_account_summary"
+
+log = logging.getLogger("knc.summaries")
+
+def signed(amount, transaction_type):
+    """Amount as it moved the balance: credits positive, debits negative"""
+    return case((transaction_type.in_(CREDIT_TYPES), amount), else_=-amount)
+
+# --- Aggregation Job ---
+def claim_watermark(db, name: str = WATERMARK_NAME):
+    """Lock the named watermark row (created at 0), or None if another worker holds it.
+
+    summary_watermarks also keeps the per-company watermarks of settlements.py.
+    """
+    db.execute(pg_insert(SummaryWatermark).values(name=name, last_transaction_id=0).on_conflict_do_nothing())
+    return db.execute(
+        select(SummaryWatermark)
+        .where(SummaryWatermark.name == name)
+        .with_for_update(skip_locked=True)
+    ).scalars().first()
+
+def _settled_high_id(db, low: int, batch_size: int):
+    settled = (
+        select(Transaction.id)
+        .where(
+            Transaction.id > low,
+            Transaction.timestamp < func.now() - timedelta(seconds=SUMMARY_SETTLE_SECONDS),
+        )
+        .order_by(Transaction.id)
+        .limit(batch_size)
+        .subquery()
+    )
+    return db.execute(select(func.max(settled.c.id))).scalar()
+
+def _add_counts_statement(low: int, high: int):
+    """Upsert per (user, day, type) counts and totals for transactions in (low, high]"""
+    days = select(
+        Transaction.user_id,
+        cast(func.timezone(SUMMARY_TIMEZONE, Transaction.timestamp), Date).label("day"),
+        Transaction.transaction_type,
+        Transaction.amount_cents,
+    ).where(Transaction.id > low, Transaction.id <= high).subquery()
+    batch = select(
+        days.c.user_id, days.c.day, days.c.transaction_type, func.count(), func.sum(days.c.amount_cents)
+    ).group_by(days.c.user_id, days.c.day, days.c.transaction_type)
+
+    statement = pg_insert(DailyAccountSummary).from_select(
+        ["user_id", "day", "transaction_type", "transaction_count", "total_cents"], batch
+    )
+    return statement.on_conflict_do_update(
+        index_elements=[DailyAccountSummary.user_id, DailyAccountSummary.day, DailyAccountSummary.transaction_type],
+        set_={
+            "transaction_count": DailyAccountSummary.transaction_count + statement.excluded.transaction_count,
+            "total_cents": DailyAccountSummary.total_cents + statement.excluded.total_cents,
+        },
+    )
+
+def _closing_balances_statement(low: int, high: int):
+    """Re-derive closing balances from the earliest day touched by (low, high], per affected user.
+
+    Balances are anchored on users.balance_cents less whatever was posted after high, so
+    accounts that predate the summaries (or were adjusted outside the ledger) come
+    out right without replaying their whole history. One statement, one snapshot.
+    """
+    summary = DailyAccountSummary
+    affected = select(
+        Transaction.user_id,
+        func.min(cast(func.timezone(SUMMARY_TIMEZONE, Transaction.timestamp), Date)).label("from_day"),
+    ).where(Transaction.id > low, Transaction.id <= high).group_by(Transaction.user_id).cte("affected")
+    pending = select(
+        Transaction.user_id,
+        func.sum(signed(Transaction.amount_cents, Transaction.transaction_type)).label("net"),
+    ).where(Transaction.id > high).group_by(Transaction.user_id).cte("pending")
+    daily = select(
+        summary.user_id,
+        summary.day,
+        func.sum(signed(summary.total_cents, summary.transaction_type)).label("net"),
+    ).join(
+        affected, and_(summary.user_id == affected.c.user_id, summary.day >= affected.c.from_day)
+    ).group_by(summary.user_id, summary.day).cte("daily")
+
+    anchor = User.balance_cents - func.coalesce(pending.c.net, 0)
+    closing = select(
+        daily.c.user_id,
+        daily.c.day,
+        (
+            anchor
+            - func.sum(daily.c.net).over(partition_by=daily.c.user_id)
+            + func.sum(daily.c.net).over(partition_by=daily.c.user_id, order_by=daily.c.day)
+        ).label("closing_balance_cents"),
+    ).join(User, User.id == daily.c.user_id).outerjoin(
+        pending, pending.c.user_id == daily.c.user_id
+    ).subquery()
+
+    return (
+        update(summary)
+        .where(summary.user_id == closing.c.user_id, summary.day == closing.c.day)
+        .values(closing_balance_cents=closing.c.closing_balance_cents)
+        .execution_options(synchronize_session=False)
+    )
+
+def refresh_summaries(db, batch_size: int = SUMMARY_BATCH_SIZE) -> int:
+    """Fold settled transactions into daily_account_summary; returns how many were added.
+
+    Each batch commits with the watermark, so an interrupted run resumes where it
+    stopped. Concurrent callers skip instead of queueing behind the running one.
+    """
+    total = 0
+    while True:
+        watermark = claim_watermark(db)
+        if watermark is None:
+            db.rollback()
+            return total
+
+        low = watermark.last_transaction_id
+        high = _settled_high_id(db, low, batch_size)
+        if high is not None:
+            db.execute(_add_counts_statement(low, high))
+            db.execute(_closing_balances_statement(low, high))
+            total += db.execute(
+                select(func.count()).where(Transaction.id > low, Transaction.id <= high)
+            ).scalar()
+            watermark.last_transaction_id = high
+        watermark.updated_at = func.now()
+        db.commit()
+
+        if high is None:
+            return total
+
+async def run_refresher(session_factory, interval: float = SUMMARY_REFRESH_SECONDS):
+    """Background loop started by the app lifespan; every worker runs one, only one refreshes at a time"""
+    def refresh_once():
+        with session_factory() as db:
+            return refresh_summaries(db)
+
+    while True:
+        try:
+            await asyncio.to_thread(refresh_once)
+        except Exception:
+            log.exception("Daily summary refresh failed")
+        await asyncio.sleep(interval)
+
+# --- Range Queries ---
+def summary_rows_query(username: str, start_date: Optional[date], end_date: Optional[date]):
+    query = (
+        select(
+            DailyAccountSummary.day,
+            DailyAccountSummary.transaction_type,
+            DailyAccountSummary.transaction_count,
+            DailyAccountSummary.total_cents,
+            DailyAccountSummary.closing_balance_cents,
+        )
+        .join(User, User.id == DailyAccountSummary.user_id)
+        .where(User.username == username)
+        .order_by(DailyAccountSummary.day)
+    )
+    if start_date:
+        query = query.where(DailyAccountSummary.day >= start_date)
+    if end_date:
+        query = query.where(DailyAccountSummary.day <= end_date)
+    return query
+
+def summary_context_query(username: str, start_date: Optional[date]):
+    """Whether the user exists, their balance before start_date, and the last refresh time"""
+    opening_balance = None
+    if start_date:
+        opening_balance = (
+            select(DailyAccountSummary.closing_balance_cents)
+            .join(User, User.id == DailyAccountSummary.user_id)
+            .where(User.username == username, DailyAccountSummary.day < start_date)
+            .order_by(DailyAccountSummary.day.desc())
+            .limit(1)
+            .scalar_subquery()
+        )
+    refreshed_at = select(SummaryWatermark.updated_at).where(
+        SummaryWatermark.name == WATERMARK_NAME
+    ).scalar_subquery()
+    return select(
+        exists().where(User.username == username).label("user_exists"),
+        func.coalesce(opening_balance, 0).label("opening_balance_cents"),
+        refreshed_at.label("refreshed_at"),
+    )
+
+def _amounts(counts, total_cents):
+    return {"count": int(counts), "amount": cents_to_float(int(total_cents))}
+
+def _grid_sum(cells, weights, size: int):
+    # bincount sums in float64, which is exact for centavo totals below 2**53
+    return np.rint(np.bincount(cells, weights=weights, minlength=size)).astype(np.int64)
+
+def build_summary(rows, opening_balance_cents: int):
+    """Totals by type and by month from daily snapshot rows (ordered by day)"""
+    opening_balance = cents_to_float(opening_balance_cents)
+    if not rows:
+        return {
+            "opening_balance": opening_balance,
+            "closing_balance": opening_balance,
+            "net_change": 0.0,
+            "totals": {},
+            "months": [],
+        }
+
+    days, types, counts, totals, closing = zip(*rows)
+    months = np.array(days, dtype="datetime64[D]").astype("datetime64[M]")
+    counts = np.array(counts, dtype=np.int64)
+    totals = np.array(totals, dtype=np.int64)
+    closing = np.array(closing, dtype=np.int64)
+
+    # One bincount per measure over a (month, type) grid instead of a Python loop per row
+    type_names, type_index = np.unique(np.array(types), return_inverse=True)
+    month_names, month_index = np.unique(months, return_inverse=True)
+    cells = month_index * len(type_names) + type_index
+    shape = (len(month_names), len(type_names))
+    cell_counts = _grid_sum(cells, counts, shape[0] * shape[1]).reshape(shape)
+    cell_totals = _grid_sum(cells, totals, shape[0] * shape[1]).reshape(shape)
+
+    signs = np.where(np.isin(type_names, CREDIT_TYPES), 1, -1)
+    month_net = cell_totals @ signs
+    # Rows are day-ordered, so each month's closing balance is on its last row
+    month_last_row = np.append(np.flatnonzero(np.diff(month_index)), len(month_index) - 1)
+    month_closing = closing[month_last_row]
+
+    type_counts = cell_counts.sum(axis=0)
+    type_totals = cell_totals.sum(axis=0)
+    return {
+        "opening_balance": opening_balance,
+        "closing_balance": cents_to_float(int(closing[-1])),
+        "net_change": cents_to_float(int(closing[-1]) - opening_balance_cents),
+        "totals": {
+            name: _amounts(type_counts[i], type_totals[i]) for i, name in enumerate(type_names.tolist())
+        },
+        "months": [
+            {
+                "month": month,
+                "net_change": cents_to_float(int(month_net[m])),
+                "closing_balance": cents_to_float(int(month_closing[m])),
+                "by_type": {
+                    name: _amounts(cell_counts[m, i], cell_totals[m, i])
+                    for i, name in enumerate(type_names.tolist()) if cell_counts[m, i]
+                },
+            }
+            for m, month in enumerate(np.datetime_as_string(month_names).tolist())
+        ],
+    }
+
+def summary_response(username: str, start_date, end_date, context, rows):
+    """Body for GET /summary/{username}; transactions younger than as_of may not be included yet"""
+    summary = build_summary(rows, context.opening_balance_cents)
+    as_of = None
+    if context.refreshed_at is not None:
+        as_of = (context.refreshed_at - timedelta(seconds=SUMMARY_SETTLE_SECONDS)).isoformat()
+    return {
+        "username": username,
+        "start_date": start_date.isoformat() if start_date else None,
+        "end_date": end_date.isoformat() if end_date else None,
+        "as_of": as_of,
+        **summary,
+    }
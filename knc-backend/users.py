@@ -0,0 +1,173 @@
+# users.py
+
+import os
+from typing import Optional
+from fastapi import Depends
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import literal_column, or_, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+from cache import LRUBackend
+from database import (
+    DATABASE_BACKEND, USE_ASYNC_DB, AsyncSessionLocal, SessionLocal,
+    get_async_db, get_async_read_db, get_db, get_read_db
+)
+from models import User
+
+load_dotenv()
+
+# Seconds a username search result is reused for the same prefix in this worker (0 disables)
+USER_SEARCH_CACHE_SECONDS = float(os.getenv("USER_SEARCH_CACHE_SECONDS", "30"))
+
+# Distinct prefixes kept in each worker's search cache
+USER_SEARCH_CACHE_ENTRIES = int(os.getenv("USER_SEARCH_CACHE_ENTRIES", "10000"))
+
+IS_POSTGRES = DATABASE_BACKEND == "postgresql"
+
+# --- Request-Scoped Resolver ---
+class UserResolver:
+    """Users looked up while serving one request.
+
+    Each username is queried at most once per request (misses included), and
+    get_many fetches several with one IN query.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+        self._users = {}
+
+    def _missing(self, usernames):
+        return [username for username in dict.fromkeys(usernames) if username not in self._users]
+
+    def _remember(self, usernames, users):
+        self._users.update(dict.fromkeys(usernames))
+        self._users.update((user.username, user) for user in users)
+
+    def get_many(self, *usernames: str):
+        """{username: User or None}"""
+        missing = self._missing(usernames)
+        if missing:
+            self._remember(missing, self.db.execute(select(User).where(User.username.in_(missing))).scalars())
+        return {username: self._users[username] for username in usernames}
+
+    def get(self, username: str) -> Optional[User]:
+        return self.get_many(username)[username]
+
+class AsyncUserResolver(UserResolver):
+    """UserResolver for AsyncSession; get and get_many are awaitable"""
+
+    async def get_many(self, *usernames: str):
+        missing = self._missing(usernames)
+        if missing:
+            result = await self.db.execute(select(User).where(User.username.in_(missing)))
+            self._remember(missing, result.scalars())
+        return {username: self._users[username] for username in usernames}
+
+    async def get(self, username: str) -> Optional[User]:
+        return (await self.get_many(username))[username]
+
+# FastAPI resolves get_db once per request, so the resolver shares the handler's session
+def get_user_resolver(db: Session = Depends(get_db)) -> UserResolver:
+    return UserResolver(db)
+
+async def get_async_user_resolver(db: AsyncSession = Depends(get_async_db)) -> AsyncUserResolver:
+    return AsyncUserResolver(db)
+
+# For read-only routes: shares get_read_db's session, so the replica unless the user just wrote
+def get_read_user_resolver(db: Session = Depends(get_read_db)) -> UserResolver:
+    return UserResolver(db)
+
+async def get_async_read_user_resolver(db: AsyncSession = Depends(get_async_read_db)) -> AsyncUserResolver:
+    return AsyncUserResolver(db)
+
+# Usernames never change, so ids are cached long; a reconnect storm after a deploy
+# then costs one query per user rather than one per stream
+USER_ID_CACHE_SECONDS = 3600
+
+_user_ids = LRUBackend(USER_SEARCH_CACHE_ENTRIES)
+
+def _user_id(username: str) -> Optional[int]:
+    with SessionLocal() as db:
+        return db.execute(select(User.id).where(User.username == username)).scalar()
+
+async def lookup_user_id(username: str) -> Optional[int]:
+    """User id for a long-lived async route.
+
+    Uses its own short session rather than get_db: a dependency's session would
+    hold its pooled connection for as long as the response keeps streaming.
+    """
+    user_id = _user_ids.get(username)
+    if user_id is None:
+        if USE_ASYNC_DB:
+            async with AsyncSessionLocal() as db:
+                user_id = (await db.execute(select(User.id).where(User.username == username))).scalar()
+        else:
+            user_id = await run_in_threadpool(_user_id, username)
+        if user_id is not None:
+            _user_ids.set(username, user_id, USER_ID_CACHE_SECONDS)
+    return user_id
+
+# --- Writes ---
+def account_exists_statement(username: str, email: str):
+    """SELECT EXISTS for a user already holding this username or email (both unique-indexed)"""
+    return select(select(User.id).where(or_(User.username == username, User.email == email)).exists())
+
+def insert_user_statement(**values):
+    """INSERT that skips a taken username or email instead of raising; RETURNING id is empty then"""
+    dialect_insert = postgresql.insert if IS_POSTGRES else sqlite.insert
+    return dialect_insert(User).values(**values).on_conflict_do_nothing().returning(User.id)
+
+# --- Search ---
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def search_statement(prefix: str, limit: int):
+    """Usernames starting with prefix, in byte order.
+
+    On Postgres this is a range scan of idx_users_username_pattern (text_pattern_ops):
+    ordering with the index's own ~<~ operator lets LIMIT stop after `limit`
+    entries however many usernames share the prefix. In that order an exact
+    match always comes first.
+    """
+    order = literal_column("users.username USING ~<~") if IS_POSTGRES else User.username
+    return (
+        select(User.username, User.first_name, User.last_name)
+        .where(User.username.like(_escape_like(prefix) + "%", escape="\\"))
+        .order_by(order)
+        .limit(limit)
+    )
+
+def search_response(prefix: str, rows):
+    return {
+        "query": prefix,
+        "exists": bool(rows) and rows[0].username == prefix,
+        "results": [
+            {"username": row.username, "display_name": f"{row.first_name} {row.last_name}"}
+            for row in rows
+        ],
+    }
+
+class UserSearchCache:
+    """Per-worker LRU of recent search responses, so hot prefixes skip the database"""
+
+    def __init__(self, ttl: float = USER_SEARCH_CACHE_SECONDS, max_entries: int = USER_SEARCH_CACHE_ENTRIES):
+        self.ttl = ttl
+        self._entries = LRUBackend(max_entries)
+
+    def get(self, prefix: str, limit: int):
+        return self._entries.get(f"{limit}:{prefix}") if self.ttl > 0 else None
+
+    def set(self, prefix: str, limit: int, response):
+        if self.ttl > 0:
+            self._entries.set(f"{limit}:{prefix}", response, self.ttl)
+
+user_search_cache = UserSearchCache()
+
+def search_users(db: Session, prefix: str, limit: int):
+    response = user_search_cache.get(prefix, limit)
+    if response is None:
+        response = search_response(prefix, db.execute(search_statement(prefix, limit)).all())
+        user_search_cache.set(prefix, limit, response)
+    return response
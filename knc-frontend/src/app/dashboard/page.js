@@ -1,6 +1,7 @@
 "use client";
 
 import Sidebar from '@/components/Sidebar';
+import { formatDate, formatTime } from '@/lib/format';
 import Link from 'next/link';
 import { useRouter } from 'next/navigation';
 import { useEffect, useState } from 'react';
@@ -27,6 +28,26 @@ export default function Dashboard() {
         }
     }, [router]);
 
+    // live balance and transactions; the browser reconnects on its own
+    useEffect(() => {
+        if (!username) return;
+        const stream = new EventSource(`http://localhost:8000/auth/stream/${username}`);
+
+        stream.addEventListener('balance', (event) => {
+            setBalance(JSON.parse(event.data).balance);
+        });
+        stream.addEventListener('transaction', (event) => {
+            const transaction = JSON.parse(event.data);
+            setTransactions((current) => [transaction, ...current].slice(0, 5));
+        });
+        // sent when events were missed; reload everything instead
+        stream.addEventListener('resync', () => {
+            fetchDashboardData(username);
+        });
+
+        return () => stream.close();
+    }, [username]);
+
     const fetchDashboardData = async (username) => {
         try {
             setIsLoading(true);
@@ -176,8 +197,8 @@ export default function Dashboard() {
                                                 </p>
                                             </div>
                                             <div className="flex flex-col text-right text-sm text-black">
-                                                <p>{transaction.date}</p>
-                                                <p>{transaction.time}</p>
+                                                <p>{formatDate(transaction.timestamp)}</p>
+                                                <p>{formatTime(transaction.timestamp)}</p>
                                             </div>
                                         </div>
                                     ))
@@ -1,6 +1,7 @@
 "use client";
 
 import Sidebar from "@/components/Sidebar";
+import { formatDate, formatTime } from "@/lib/format";
 import { useRouter } from 'next/navigation';
 import { useEffect, useState } from 'react';
 
@@ -289,8 +290,8 @@ export default function History() {
                                                             PHP {formatCurrency(transaction.amount)}
                                                         </p>
                                                         <div className="text-sm text-gray-mid">
-                                                            <p>{transaction.date}</p>
-                                                            <p>{transaction.time}</p>
+                                                            <p>{formatDate(transaction.timestamp)}</p>
+                                                            <p>{formatTime(transaction.timestamp)}</p>
                                                         </div>
                                                     </div>
                                                 </div>
@@ -0,0 +1,17 @@
+// lib/format.js
+
+// History timestamps arrive as ISO 8601; shown as MM/DD/YYYY and hh:mm AM/PM
+export const formatDate = (timestamp) => {
+    return new Date(timestamp).toLocaleDateString('en-US', {
+        month: '2-digit',
+        day: '2-digit',
+        year: 'numeric'
+    });
+};
+
+export const formatTime = (timestamp) => {
+    return new Date(timestamp).toLocaleTimeString('en-US', {
+        hour: '2-digit',
+        minute: '2-digit'
+    });
+};